@@ -1,6 +1,35 @@
-from . import parse
-from . import gps
-from . import io
-from . import gps_plot
+import importlib
 
-__version__ = "0.1"
\ No newline at end of file
+__version__ = "0.1"
+
+# Submodules are imported on first access, so that importing the package
+# does not load the plotting dependencies (matplotlib, geopandas, contextily).
+SUBMODULES = [
+    "aio",
+    "benchmark",
+    "cache",
+    "gps",
+    "gps_plot",
+    "gpx",
+    "io",
+    "mp4",
+    "parallel",
+    "parse",
+    "profiling",
+    "sensors",
+    "session",
+    "simplify",
+    "spatial",
+    "synthetic",
+    "tiles",
+]
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + SUBMODULES)
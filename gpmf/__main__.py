@@ -1,17 +1,90 @@
 import os
 import sys
+import glob
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy
-import gpxpy
-import matplotlib.pyplot as plt
 
 
-from .gps import extract_gps_blocks, make_pgx_segment, parse_gps_block
-from .parse import filter_klv
-from .io import extract_gpmf_stream
-from .gps_plot import plot_gps_trace
+from .gps import concatenate_gps_blocks, extract_gps, extract_gps_from_file, extract_gps_incremental, extract_gps_window, extract_gps_blocks, find_first_gps, first_of_blocks, make_pgx_segment, parse_gps_block
+from .io import extract_gpmf_stream, extract_gpmf_stream_with_track
+from .parse import read_klv_stream
+from .cache import CACHE_DIR_VARIABLE
+from .profiling import Profile
+from .gpx import write_gpx
+from .simplify import METHODS as SIMPLIFY_METHODS, decimate
+from .session import Session, extract_session_gps, extract_session_sensors, find_sessions
+from .sensors import SENSORS, extract_sensors
+from .spatial import DEFAULT_INDEX_FILE, DEFAULT_TOLERANCE as INDEX_TOLERANCE, SpatialIndex
+
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".360")
+
+# Input file reading a raw GPMF stream from the standard input, and output
+# file writing to the standard output.
+STDIN = "-"
+STDOUT = "-"
+# Commands accepting STDIN as input file
+STDIN_COMMANDS = {"gps-extract", "gps-plot"}
+
+# Formats of the export command, gpmf.export (and with it pandas and pyarrow)
+# being only imported when it runs.
+EXPORT_FORMATS = ("csv", "feather", "parquet")
+EXPORT_CHUNK_SIZE = 100000
+
+
+def add_input_arguments(parser):
+    parser.add_argument("files", nargs="+",
+                        help="Input files, glob patterns or directories. With gps-extract and gps-plot, "
+                             "'-' reads a raw GPMF stream from the standard input (e.g. piped from ffmpeg)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of files processed in parallel, or of processes decoding "
+                             "the stream of a single file (default=1)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory caching extracted telemetry (default=$%s)" % CACHE_DIR_VARIABLE)
+    parser.add_argument("--profile", action="store_true",
+                        help="Report the time and amount of data of each stage as JSON "
+                             "(on stderr, or in the result line of each file in batch mode)")
+
+
+def parse_time(value):
+    """Parse a time given in seconds from the start of the video or as a UTC date."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def positive_float(value):
+    """Parse a strictly positive number."""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError("must be positive, got %s" % value)
+    return number
+
+
+def add_session_arguments(parser):
+    parser.add_argument("-S", "--sessions", action="store_true",
+                        help="Join the chapters of GoPro recordings (GX01xxxx.MP4, GX02xxxx.MP4, ...) "
+                             "into a single track, processed with --jobs chapters in parallel")
+
+
+def add_window_arguments(parser):
+    parser.add_argument("--start", type=parse_time, default=None,
+                        help="Start of the time window, in seconds from the start of the video or as UTC time")
+    parser.add_argument("--end", type=parse_time, default=None,
+                        help="End of the time window, in seconds from the start of the video or as UTC time")
+
+
+def add_decimation_arguments(parser):
+    parser.add_argument("-t", "--tolerance", type=float, default=None,
+                        help="Simplify the track, keeping its shape within this distance in meters")
+    parser.add_argument("--simplify-method", choices=sorted(SIMPLIFY_METHODS), default="douglas-peucker",
+                        help="The track simplification method (default=douglas-peucker)")
+    parser.add_argument("-i", "--interval", type=positive_float, default=None,
+                        help="Keep at most one GPS entry per interval, in seconds")
 
 
 def parse_args():
@@ -20,7 +93,7 @@ def parse_args():
     # GPS Extract
     subparsers = parser.add_subparsers(dest="command")
     gps_parser = subparsers.add_parser("gps-extract")
-    gps_parser.add_argument("file", help="Input File")
+    add_input_arguments(gps_parser)
     gps_parser.add_argument('-o', '--output-file', default=None)
     gps_parser.add_argument('-d', '--output-directory', default=None)
     gps_parser.add_argument('-f', '--first-only', action="store_true",
@@ -29,116 +102,414 @@ def parse_args():
                             help="Do not store speed informations as extensions")
     gps_parser.add_argument("-g", "--gpx-version", choices=["1.0", "1.1"], default="1.1",
                             help="The GPX version to use (default=1.0)")
+    gps_parser.add_argument("--use-gpxpy", action="store_true",
+                            help="Build the GPX document with gpxpy instead of streaming it")
+    add_session_arguments(gps_parser)
+    add_window_arguments(gps_parser)
+    add_decimation_arguments(gps_parser)
 
     # GPS First Position
     gps_first_parser = subparsers.add_parser("gps-first")
-    gps_first_parser.add_argument("file")
+    add_input_arguments(gps_first_parser)
+    gps_first_parser.add_argument("-s", "--skip-no-fix", action="store_true",
+                                  help="Skip the GPS blocks without a 2d or 3d fix")
+    gps_first_parser.add_argument("-p", "--max-precision", type=float, default=None,
+                                  help="With --skip-no-fix, also skip the blocks with a greater precision (DOP)")
 
     # GPS Plot
     gps_plot_parser = subparsers.add_parser("gps-plot")
-    gps_plot_parser.add_argument("file")
+    add_input_arguments(gps_plot_parser)
     gps_plot_parser.add_argument('-o', '--output-file', default=None)
     gps_plot_parser.add_argument('-d', '--output-directory', default=None)
     gps_plot_parser.add_argument('-f', '--first-only', action="store_true",
                             help="Plot only the first GPS entry of a block")
-    return parser.parse_args()
+    gps_plot_parser.add_argument("-z", "--zoom", type=int, default=12,
+                                 help="Zoom level of the map (default=12)")
+    gps_plot_parser.add_argument("--tiles", default=None,
+                                 help="Map tiles: a .mbtiles file, a {z}/{x}/{y}.png directory or a URL template")
+    gps_plot_parser.add_argument("--tile-cache-dir", default=None,
+                                 help="Directory storing downloaded map tiles")
+    gps_plot_parser.add_argument("--offline", action="store_true",
+                                 help="Only use the tiles already in --tile-cache-dir (or in --tiles)")
+    add_session_arguments(gps_plot_parser)
+    add_window_arguments(gps_plot_parser)
+    add_decimation_arguments(gps_plot_parser)
+
+    # Columnar export
+    export_parser = subparsers.add_parser("export")
+    add_input_arguments(export_parser)
+    export_parser.add_argument('-o', '--output-file', default=None,
+                               help="The output file, when a single stream is exported")
+    export_parser.add_argument('-d', '--output-directory', default=None)
+    export_parser.add_argument("-F", "--format", choices=EXPORT_FORMATS, default="parquet",
+                               help="The output format (default=parquet)")
+    export_parser.add_argument("-s", "--streams", nargs="+", type=str.upper, default=["GPS"],
+                               help="The streams exported, GPS or sensor FourCC codes (%s), "
+                                    "one file each (default=GPS)" % ", ".join(SENSORS))
+    export_parser.add_argument("-c", "--columns", nargs="+", default=None,
+                               help="The columns exported (default=all)")
+    export_parser.add_argument("--compression", default=None,
+                               help="The compression codec, or 'none' (default=snappy for parquet, "
+                                    "lz4 for feather, none for csv)")
+    export_parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE,
+                               help="The number of rows written at once (default=%i)" % EXPORT_CHUNK_SIZE)
+    add_session_arguments(export_parser)
+
+    # Spatial index
+    index_parser = subparsers.add_parser("index")
+    index_parser.add_argument("files", nargs="+",
+                              help="Input files, glob patterns or directories")
+    index_parser.add_argument("-j", "--jobs", type=int, default=1,
+                              help="Number of files processed in parallel (default=1)")
+    index_parser.add_argument("-x", "--index-file", default=DEFAULT_INDEX_FILE,
+                              help="The index file, created if needed (default=%s)" % DEFAULT_INDEX_FILE)
+    index_parser.add_argument("-t", "--tolerance", type=float, default=INDEX_TOLERANCE,
+                              help="Simplification tolerance of the indexed tracks in meters "
+                                   "(default=%g)" % INDEX_TOLERANCE)
+    index_parser.add_argument("--prune", action="store_true",
+                              help="Remove the files which do not exist anymore from the index")
+
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("-x", "--index-file", default=DEFAULT_INDEX_FILE,
+                              help="The index file (default=%s)" % DEFAULT_INDEX_FILE)
+    location = query_parser.add_mutually_exclusive_group(required=True)
+    location.add_argument("-p", "--point", type=float, nargs=2, metavar=("LAT", "LON"),
+                          help="Find the files passing near this point")
+    location.add_argument("-b", "--bbox", type=float, nargs=4, metavar=("MIN_LAT", "MIN_LON", "MAX_LAT", "MAX_LON"),
+                          help="Find the files passing through this bounding box")
+    query_parser.add_argument("-r", "--radius", type=float, default=100.,
+                              help="Distance to the point in meters (default=100)")
+    query_parser.add_argument("--start", default=None,
+                              help="Only search the parts of the tracks recorded from this UTC time")
+    query_parser.add_argument("--end", default=None,
+                              help="Only search the parts of the tracks recorded before this UTC time")
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.error("a command is required")
+    if args.command == "query":
+        return args
+
+    if getattr(args, "use_gpxpy", False) and (args.start is not None or args.end is not None):
+        parser.error("--start and --end cannot be used with --use-gpxpy")
+    if getattr(args, "use_gpxpy", False) and args.sessions:
+        parser.error("--sessions cannot be used with --use-gpxpy")
+    if STDIN in args.files:
+        if args.command not in STDIN_COMMANDS:
+            parser.error("%s cannot read from the standard input" % args.command)
+        if len(args.files) > 1:
+            parser.error("the standard input cannot be read along with other files")
+        if getattr(args, "use_gpxpy", False):
+            parser.error("--use-gpxpy cannot be used with the standard input")
+        if args.sessions or args.start is not None or args.end is not None:
+            parser.error("--sessions, --start and --end cannot be used with the standard input")
+    if getattr(args, "offline", False) and args.tiles is None and args.tile_cache_dir is None:
+        parser.error("--offline requires --tile-cache-dir or --tiles")
+    if args.command == "export" and args.output_file is not None and len(args.streams) > 1:
+        parser.error("--output-file cannot be used with several streams")
+
+    if getattr(args, "cache_dir", None) is not None:
+        # Set through the environment so that worker processes use it too.
+        os.environ[CACHE_DIR_VARIABLE] = args.cache_dir
+
+    args.files = expand_inputs(args.files)
+    if len(args.files) == 0:
+        parser.error("no input file found")
+    if getattr(args, "sessions", False):
+        args.files = find_sessions(args.files)
+    if len(args.files) > 1 and getattr(args, "output_file", None) is not None:
+        parser.error("--output-file cannot be used with several input files")
+
+    return args
+
+
+def expand_inputs(paths):
+    """Expand glob patterns and directories into a list of files.
+
+    Directories are searched (non recursively) for video files.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            ))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path)))
+        else:
+            files.append(path)
+    return files
+
+
+def output_path_for(infile, args, extension):
+    if args.output_file is not None:
+        return args.output_file
+    if infile == STDIN:
+        return STDOUT
+    if isinstance(infile, Session):
+        infile = infile.files[0]
+    output_path = os.path.splitext(infile)[0] + extension
+    if args.output_directory is not None:
+        output_path = os.path.join(args.output_directory, os.path.basename(output_path))
+    return output_path
+
+
+def load_gps(infile, args):
+    if infile == STDIN:
+        return extract_gps_incremental(read_klv_stream(sys.stdin.buffer))
+    if isinstance(infile, Session):
+        return extract_session_gps(infile.files, args.start, args.end, jobs=args.jobs)
+    if args.start is not None or args.end is not None:
+        return extract_gps_window(infile, args.start, args.end)
+    # Files are already processed in parallel in batch mode
+    return extract_gps_from_file(infile, jobs=args.jobs if len(args.files) == 1 else 1)
+
+
+def decimate_gps(gps_data, args):
+    if args.first_only:
+        gps_data = gps_data[first_of_blocks(gps_data)]
+    if args.tolerance is not None or args.interval is not None:
+        gps_data = gps_data[decimate(gps_data, tolerance=args.tolerance, interval=args.interval,
+                                     method=args.simplify_method)]
+    return gps_data
+
+
+def command_gpx_extract(infile, args):
+    output_path = output_path_for(infile, args, ".gpx")
+
+    if args.use_gpxpy:
+        import gpxpy.gpx
+
+        gps_blocks = extract_gps_blocks(extract_gpmf_stream(infile))
+        gps_data_blocks = map(parse_gps_block, gps_blocks)
+
+        mask = None
+        if args.tolerance is not None or args.interval is not None:
+            gps_data_blocks = list(gps_data_blocks)
+            gps_data = concatenate_gps_blocks(gps_data_blocks)
+            selected = first_of_blocks(gps_data) if args.first_only else numpy.ones(len(gps_data), dtype=bool)
+            mask = numpy.zeros(len(gps_data), dtype=bool)
+            mask[selected] = decimate(gps_data[selected], tolerance=args.tolerance, interval=args.interval,
+                                      method=args.simplify_method)
+
+        gpx = gpxpy.gpx.GPX()
+        gpx_track = gpxpy.gpx.GPXTrack()
+        gpx_segment = make_pgx_segment(gps_data_blocks, first_only=args.first_only,
+                                       speeds_as_extensions=not args.no_speed, mask=mask)
+        gpx.tracks.append(gpx_track)
+        gpx_track.segments.append(gpx_segment)
+
+        with open(output_path, "w") as out_file:
+            out_file.write(gpx.to_xml(version=args.gpx_version))
+    else:
+        gps_data = decimate_gps(load_gps(infile, args), args)
 
+        if output_path == STDOUT:
+            write_gpx(gps_data, sys.stdout, version=args.gpx_version,
+                      speeds_as_extensions=not args.no_speed)
+        else:
+            with open(output_path, "w") as out_file:
+                write_gpx(gps_data, out_file, version=args.gpx_version,
+                          speeds_as_extensions=not args.no_speed)
 
-def command_gpx_extract(args):
-    infile = args.file
+    return {"output": output_path}
 
-    if args.output_file is None:
-        output_path = os.path.splitext(infile)[0] + ".gpx"
-        if args.output_directory is not None:
-            basename = os.path.basename(output_path)
-            output_path = os.path.join(args.output_directory, basename)
-    else:
-        output_path = args.output_file
-
-    gpmf_stream = extract_gpmf_stream(infile)
-    gps_blocks = extract_gps_blocks(gpmf_stream)
-    gps_data_blocks = map(parse_gps_block, gps_blocks)
-
-    gpx = gpxpy.gpx.GPX()
-    gpx_track = gpxpy.gpx.GPXTrack()
-    gpx_segment = make_pgx_segment(gps_data_blocks)
-    gpx.tracks.append(gpx_track)
-    gpx_track.segments.append(gpx_segment)
-
-    with open(output_path, "w") as out_file:
-        out_file.write(gpx.to_xml(version=args.gpx_version))
-
-
-def command_gps_first(args):
-    infile = args.file
-
-    gpmf_stream = extract_gpmf_stream(infile)
-    gps_block = None
-
-    for stream_item in filter_klv(gpmf_stream, "STRM"):
-        is_gps = False
-        content = []
-        for klv_item in stream_item.value:
-            content.append(klv_item)
-            if klv_item.key == "GPS5":
-                is_gps = True
-        if is_gps:
-            gps_block = content
-            break
-
-    if gps_block is not None:
-        gps_data = parse_gps_block(gps_block)
-
-        info = {
-            "latitude": gps_data.latitude[0],
-            "longitude": gps_data.longitude[0],
-            "speed": gps_data.speed_3d[0],
-            "timestamp": gps_data.timestamp
-        }
-
-        print(json.dumps(info))
-    else:
-        print("No GPS information found", file=sys.stderr)
+
+def command_gps_first(infile, args):
+    gps_data = find_first_gps(infile, skip_no_fix=args.skip_no_fix, max_precision=args.max_precision)
+
+    if gps_data is None:
+        raise RuntimeError("No GPS information found")
+
+    return {
+        "latitude": gps_data.latitude[0],
+        "longitude": gps_data.longitude[0],
+        "speed": gps_data.speed_3d[0],
+        "timestamp": gps_data.timestamp
+    }
 
 
-def command_gps_plot(args):
-    infile = args.file
+def command_gps_plot(infile, args):
+    import matplotlib.pyplot as plt
+    from .gps_plot import plot_gps_trace
+    from .tiles import open_tile_provider
 
-    if args.output_file is None:
-        output_path = os.path.splitext(infile)[0] + ".png"
-        if args.output_directory is not None:
-            basename = os.path.basename(output_path)
-            output_path = os.path.join(args.output_directory, basename)
+    output_path = output_path_for(infile, args, ".png")
+
+    gps_data = decimate_gps(load_gps(infile, args), args)
+
+    latlon = numpy.column_stack([gps_data["latitude"], gps_data["longitude"]])
+
+    map_provider = None
+    if args.tiles is not None:
+        map_provider = open_tile_provider(args.tiles, cache_dir=args.tile_cache_dir, offline=args.offline)
+
+    plot_gps_trace(latlon, map_provider=map_provider, zoom=args.zoom, tile_cache=args.tile_cache_dir,
+                   offline=args.offline)
+    plt.tight_layout()
+    if output_path == STDOUT:
+        plt.savefig(sys.stdout.buffer, format="png")
     else:
-        output_path = args.output_file
+        plt.savefig(output_path)
+    plt.close()
 
-    gpmf_stream = extract_gpmf_stream(infile)
-    gps_blocks = extract_gps_blocks(gpmf_stream)
-    gps_data_blocks = map(parse_gps_block, gps_blocks)
+    return {"output": output_path}
 
-    if args.first_only:
-        latlon = numpy.array([[b.latitude[0], b.longitude[0]] for b in gps_data_blocks])
+
+def command_export(infile, args):
+    from .export import export, file_extension
+
+    fourccs = [fourcc for fourcc in args.streams if fourcc != "GPS"]
+
+    if isinstance(infile, Session):
+        gps_data = extract_session_gps(infile.files, jobs=args.jobs) if "GPS" in args.streams else None
+        sensors = extract_session_sensors(infile.files, fourccs=fourccs, jobs=args.jobs) if fourccs else {}
     else:
-        latlon = numpy.vstack([
-            numpy.vstack([b.latitude, b.longitude]).T for b in gps_data_blocks
-        ])
+        stream, track = extract_gpmf_stream_with_track(infile)
+        gps_data = extract_gps(stream) if "GPS" in args.streams else None
+        sensors = extract_sensors(stream, fourccs=fourccs, track=track) if fourccs else {}
 
-    plot_gps_trace(latlon)
-    plt.tight_layout()
-    plt.savefig(output_path)
+    outputs = {}
+    for name in args.streams:
+        data = gps_data if name == "GPS" else sensors.get(name)
+        if data is None:
+            continue
+        output_path = output_path_for(infile, args, "." + name.lower() + file_extension(args.format, args.compression))
+        export(data, output_path, format=args.format, columns=args.columns,
+               compression=args.compression, chunk_size=args.chunk_size)
+        outputs[name] = output_path
+
+    if len(outputs) == 0:
+        raise RuntimeError("No stream to export found")
+    return {"outputs": outputs}
 
 
 COMMANDS = {
-    "gpx-extract": command_gpx_extract,
+    "gps-extract": command_gpx_extract,
     "gps-first": command_gps_first,
-    "gps-plot": command_gps_plot
+    "gps-plot": command_gps_plot,
+    "export": command_export
+}
+
+
+PRINT_SINGLE_RESULT = {"gps-first"}
+
+
+def process_file(command, infile, args):
+    """Run a command on a file, catching errors so that a batch goes on."""
+    if isinstance(infile, Session):
+        description = {"file": infile.files[0], "chapters": infile.files}
+    else:
+        description = {"file": infile}
+    profile = Profile() if args.profile else None
+    try:
+        if profile is None:
+            return dict(description, **COMMANDS[command](infile, args))
+        with profile:
+            result = COMMANDS[command](infile, args)
+        return dict(description, profile=profile.report(), **result)
+    except Exception as e:
+        if profile is not None:
+            description["profile"] = profile.report()
+        return dict(description, error=str(e) or e.__class__.__name__)
+
+
+def run_batch(args):
+    """Run the command on all the input files and print one line per file.
+
+    Returns
+    -------
+    n_failed: int
+        The number of files that could not be processed.
+    """
+    # With sessions, the chapters of each session are processed in parallel instead.
+    if args.jobs > 1 and len(args.files) > 1 and not getattr(args, "sessions", False):
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = executor.map(process_file, [args.command] * len(args.files), args.files,
+                                   [args] * len(args.files))
+            results = list(_print_results(results))
+    else:
+        results = list(_print_results(process_file(args.command, infile, args) for infile in args.files))
+
+    n_failed = sum("error" in r for r in results)
+    print("%i files processed, %i failed" % (len(results), n_failed), file=sys.stderr)
+    return n_failed
+
+
+def _print_results(results):
+    for result in results:
+        print(json.dumps(result), flush=True)
+        yield result
+
+
+def command_index(args):
+    with SpatialIndex(args.index_file, tolerance=args.tolerance) as index:
+        stats = index.update(args.files, jobs=args.jobs)
+        if args.prune:
+            stats["removed"] = index.prune()
+    print(json.dumps(stats))
+    return 1 if stats["failed"] else 0
+
+
+def command_query(args):
+    if not os.path.exists(args.index_file):
+        print("Index file not found: %s" % args.index_file, file=sys.stderr)
+        return 1
+
+    with SpatialIndex(args.index_file) as index:
+        if args.point is not None:
+            matches = index.query_point(args.point[0], args.point[1], args.radius, start=args.start, end=args.end)
+        else:
+            matches = index.query_bbox(*args.bbox, start=args.start, end=args.end)
+
+    for match in matches:
+        print(json.dumps({
+            "file": match.path,
+            "start": match.start,
+            "end": match.end,
+            "offset": match.offset,
+            "time": str(match.time) + "Z",
+            "distance": None if numpy.isnan(match.distance) else match.distance
+        }))
+    return 0
+
+
+# Commands working on the whole library rather than file by file
+LIBRARY_COMMANDS = {
+    "index": command_index,
+    "query": command_query
 }
 
 
 def main():
     args = parse_args()
-    COMMANDS[args.command](args)
+
+    if args.command in LIBRARY_COMMANDS:
+        return LIBRARY_COMMANDS[args.command](args)
+
+    if len(args.files) > 1:
+        return 1 if run_batch(args) else 0
+
+    profile = Profile() if args.profile else None
+    try:
+        if profile is None:
+            result = COMMANDS[args.command](args.files[0], args)
+        else:
+            with profile:
+                result = COMMANDS[args.command](args.files[0], args)
+    except Exception as e:
+        # The same errors as in batch mode, reported without a traceback
+        print(str(e) or e.__class__.__name__, file=sys.stderr)
+        return 1
+    finally:
+        if profile is not None:
+            print(profile.to_json(indent=2), file=sys.stderr)
+
+    if args.command in PRINT_SINGLE_RESULT:
+        print(json.dumps(result))
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
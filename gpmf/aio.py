@@ -0,0 +1,223 @@
+""" asyncio variants of the extraction functions
+
+Files are read natively in the default executor of the event loop and ffmpeg
+is run as an asyncio subprocess, so that many files can be processed from an
+event loop without blocking it. The number of concurrent extractions is
+bounded, see `set_concurrency`.
+
+Example::
+
+    gps_data = await gpmf.aio.extract_gps("GH010215.MP4", timeout=30)
+"""
+import json
+import shutil
+import struct
+import asyncio
+import logging
+import weakref
+import functools
+
+import numpy
+
+from . import io as gpmf_io
+from .gps import extract_gps as _extract_gps_from_stream
+from .cache import file_key, resolve_cache
+
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+DEFAULT_CONCURRENCY = 4
+
+_concurrency = DEFAULT_CONCURRENCY
+# One semaphore per event loop
+_limits = weakref.WeakKeyDictionary()
+
+
+def set_concurrency(concurrency):
+    """ Set the default maximum number of concurrent extractions
+
+    Parameters
+    ----------
+    concurrency: int
+        The maximum number of extractions running at the same time in an
+        event loop. Other extractions wait for a slot.
+    """
+    global _concurrency
+    _concurrency = concurrency
+    _limits.clear()
+
+
+def get_limit():
+    """ Get the semaphore bounding the extractions of the running event loop """
+    loop = asyncio.get_running_loop()
+    limit = _limits.get(loop)
+    if limit is None:
+        limit = _limits[loop] = asyncio.Semaphore(_concurrency)
+    return limit
+
+
+async def _run_blocking(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args))
+
+
+async def _communicate(*command):
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await process.communicate()
+    except BaseException:
+        # Cancelled or timed out: do not leave the process running.
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise RuntimeError("%s failed: %s" % (command[0], stderr.decode(errors="replace").strip()))
+    return stdout
+
+
+async def find_gpmf_stream(fname):
+    """ Find the reference to the GPMF Stream in the video file with ffprobe
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    stream_info: dict
+        The GPMF Stream info.
+
+    Raises
+    ------
+    RuntimeError: If no stream found.
+    """
+    probe = json.loads(await _communicate(FFPROBE, "-v", "error", "-show_streams", "-of", "json", fname))
+
+    for s in probe["streams"]:
+        if s.get("codec_tag_string") == "gpmd":
+            return s
+
+    raise RuntimeError("Could not find GPS stream")
+
+
+async def extract_gpmf_stream_ffmpeg(fname):
+    """Extract GPMF binary data from video files using an ffmpeg subprocess
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream
+    """
+    stream_index = (await find_gpmf_stream(fname))["index"]
+    return await _communicate(FFMPEG, "-v", "error", "-i", fname, "-map", "0:%i" % stream_index,
+                              "-codec", "copy", "-f", "rawvideo", "pipe:")
+
+
+async def _extract_gpmf_stream(fname, use_ffmpeg):
+    if not use_ffmpeg:
+        try:
+            return await _run_blocking(gpmf_io.extract_gpmf_stream_native, fname)
+        except (RuntimeError, struct.error, ValueError) as e:
+            if shutil.which(FFMPEG) is None:
+                raise
+            logger.info("Native extraction of '%s' failed (%s), falling back to ffmpeg.", fname, e)
+    return await extract_gpmf_stream_ffmpeg(fname)
+
+
+async def _cached(cache, fname, name, compute, value_type=bytes):
+    if cache is None:
+        return await compute()
+
+    key = await _run_blocking(file_key, fname)
+    value = await _run_blocking(cache.load, key, name, value_type)
+    if value is None:
+        value = await compute()
+        await _run_blocking(cache.store, key, name, value)
+    else:
+        logger.debug("Cache hit for '%s' (%s)", fname, name)
+    return value
+
+
+async def _limited(coroutine, timeout, limit):
+    if limit is None:
+        limit = get_limit()
+    async with limit:
+        return await asyncio.wait_for(coroutine, timeout)
+
+
+async def extract_gpmf_stream(fname, use_ffmpeg=False, cache=None, timeout=None, limit=None):
+    """Extract GPMF binary data from video files
+
+    See `gpmf.io.extract_gpmf_stream`. If the task is cancelled or times out,
+    the ffmpeg subprocesses are killed. A native read which already started
+    runs to completion in the executor, but its result is dropped.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    use_ffmpeg: bool, optional (default=False)
+        If True, always use ffmpeg to extract the stream.
+    cache: gpmf.cache.TelemetryCache or bool, optional (default=None)
+        The cache storing extracted streams, see `gpmf.io.extract_gpmf_stream`.
+    timeout: float, optional (default=None)
+        The maximum duration of the extraction in seconds, not counting the
+        time spent waiting for a slot. `asyncio.TimeoutError` is raised when
+        it is exceeded.
+    limit: asyncio.Semaphore, optional (default=None)
+        The semaphore bounding the concurrent extractions. If None, the one
+        of the running event loop is used, see `set_concurrency`.
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream
+    """
+    cache = resolve_cache(cache)
+    return await _limited(
+        _cached(cache, fname, "gpmf", lambda: _extract_gpmf_stream(fname, use_ffmpeg)),
+        timeout, limit)
+
+
+async def extract_gps(fname, use_ffmpeg=False, cache=None, timeout=None, limit=None):
+    """Extract all the GPS data of a video file into a single columnar array.
+
+    The asyncio variant of `gpmf.gps.extract_gps_from_file`. The stream is
+    parsed in the default executor of the event loop.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    use_ffmpeg: bool, optional (default=False)
+        If True, always use ffmpeg to extract the stream.
+    cache: gpmf.cache.TelemetryCache or bool, optional (default=None)
+        The cache storing extracted data, see `gpmf.gps.extract_gps_from_file`.
+    timeout: float, optional (default=None)
+        The maximum duration of the extraction in seconds, see `extract_gpmf_stream`.
+    limit: asyncio.Semaphore, optional (default=None)
+        The semaphore bounding the concurrent extractions, see `extract_gpmf_stream`.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    """
+    cache = resolve_cache(cache)
+
+    async def compute():
+        stream = await _cached(cache, fname, "gpmf", lambda: _extract_gpmf_stream(fname, use_ffmpeg))
+        return await _run_blocking(_extract_gps_from_stream, stream)
+
+    return await _limited(_cached(cache, fname, "gps", compute, numpy.ndarray), timeout, limit)
@@ -0,0 +1,285 @@
+""" Benchmark of the parsing and export stages on synthetic GPMF streams
+
+Run with::
+
+    python -m gpmf.benchmark --durations 60 600 3600
+
+No video file or ffmpeg is needed. Stages whose optional dependencies
+(gpxpy, the plotting modules) are missing are skipped.
+
+The import times of the library and of the command line entry point are
+also checked against `IMPORT_BUDGETS`: the benchmark exits with status 1
+when one of them is over budget.
+"""
+import os
+import sys
+import io
+import gc
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from collections import namedtuple, OrderedDict
+
+from . import gps, gpx, parallel, parse, sensors, synthetic
+from . import io as gpmf_io
+
+
+StageResult = namedtuple("StageResult", ["stage", "duration", "bytes", "seconds", "mb_per_s",
+                                         "samples", "samples_per_s", "peak_memory"])
+
+
+def _consume(generator):
+    # Walk nested generators of KLV items, decoding everything
+    for item in generator:
+        if item.length.type == "\x00":
+            _consume(item.value)
+
+
+def _stage_iter_klv(stream):
+    _consume(parse.iter_klv(stream))
+
+
+def _stage_filter_klv(stream):
+    for item in parse.filter_klv(stream, "STRM"):
+        for _ in item.value:
+            pass
+
+
+def _stage_gps_blocks(stream):
+    return list(map(gps.parse_gps_block, gps.extract_gps_blocks(stream)))
+
+
+def _stage_make_pgx_segment(stream):
+    gps.make_pgx_segment(list(map(gps.parse_gps_block, gps.extract_gps_blocks(stream))))
+
+
+def _stage_write_gpx(stream):
+    gpx.write_gpx(gps.extract_gps(stream), io.StringIO())
+
+
+def _stage_to_dataframe(stream):
+    from .export import to_dataframe
+    to_dataframe(map(gps.parse_gps_block, gps.extract_gps_blocks(stream)))
+
+
+def _stage_sensors(stream):
+    sensors.extract_sensors(stream)
+
+
+def _stage_parallel_gps(stream):
+    parallel.extract_gps(stream)
+
+
+def _stage_parallel_sensors(stream):
+    parallel.extract_sensors(stream)
+
+
+def _stage_native_extraction(mp4_path):
+    gpmf_io.extract_gpmf_stream(mp4_path, cache=False)
+
+
+def _has_module(name):
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+# (name, function, sample kind, required module)
+STAGES = [
+    ("mp4_extraction", _stage_native_extraction, None, None),
+    ("iter_klv", _stage_iter_klv, None, None),
+    ("filter_klv", _stage_filter_klv, None, None),
+    ("build_index", parse.build_index, None, None),
+    ("parse_gps_block", _stage_gps_blocks, "gps", None),
+    ("extract_gps", gps.extract_gps, "gps", None),
+    ("extract_sensors", _stage_sensors, "imu", None),
+    ("parallel_gps", _stage_parallel_gps, "gps", None),
+    ("parallel_sensors", _stage_parallel_sensors, "imu", None),
+    ("make_pgx_segment", _stage_make_pgx_segment, "gps", "gpxpy"),
+    ("write_gpx", _stage_write_gpx, "gps", None),
+    ("to_dataframe", _stage_to_dataframe, "gps", "gpmf.export"),
+]
+
+
+# Import time budgets in a fresh interpreter, in seconds. numpy alone takes
+# about 0.1 s: the core path and the command line entry point must not load
+# pandas, pyarrow or the plotting modules.
+IMPORT_BUDGETS = OrderedDict([
+    ("gpmf.gps", 0.3),
+    ("gpmf.__main__", 0.3),
+])
+
+
+def measure(function, argument, repeat=3):
+    """ Measure the best wall time and the peak traced memory of a call
+
+    Parameters
+    ----------
+    function: callable
+        The function to measure.
+    argument: object
+        Its argument.
+    repeat: int, optional (default=3)
+        Number of timed runs. The memory is measured in a first run, as
+        tracing slows down the execution, which also serves as warm-up.
+
+    Returns
+    -------
+    seconds: float
+        The best wall time.
+    peak_memory: int
+        The peak memory allocated during the call, in bytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(argument)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+
+    return best, peak_memory
+
+
+def measure_import_time(module="gpmf.gps", repeat=3):
+    """ Measure the time needed to import a module in a fresh interpreter, in seconds """
+    code = "import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)" % module
+    return min(
+        float(subprocess.check_output([sys.executable, "-c", code]).decode())
+        for _ in range(repeat)
+    )
+
+
+def check_import_times(budgets=IMPORT_BUDGETS, repeat=3):
+    """ Measure the import times of modules and compare them to budgets
+
+    Parameters
+    ----------
+    budgets: dict, optional (default=IMPORT_BUDGETS)
+        The maximum import time of each module, in seconds.
+    repeat: int, optional (default=3)
+        Number of measures per module, the best one being kept.
+
+    Returns
+    -------
+    import_times: OrderedDict
+        The import time of each module, in seconds.
+    over_budget: list of str
+        The modules whose import time is greater than their budget.
+    """
+    import_times = OrderedDict((module, measure_import_time(module, repeat=repeat)) for module in budgets)
+    over_budget = [module for module, seconds in import_times.items() if seconds > budgets[module]]
+    return import_times, over_budget
+
+
+def run(durations=(60, 600), stages=None, repeat=3, gps_rate=18, imu_rate=200):
+    """ Run the benchmark
+
+    Parameters
+    ----------
+    durations: list of int, optional (default=(60, 600))
+        Durations of the synthetic streams in seconds.
+    stages: list of str, optional (default=None)
+        Names of the stages to run. All of them if None.
+    repeat: int, optional (default=3)
+        Number of timed runs per stage.
+    gps_rate: int, optional (default=18)
+        GPS sample rate of the synthetic streams.
+    imu_rate: int, optional (default=200)
+        Accelerometer and gyroscope sample rates of the synthetic streams.
+
+    Returns
+    -------
+    results: list of StageResult
+    """
+    results = []
+    for duration in durations:
+        payloads = synthetic.make_payloads(duration, gps_rate=gps_rate, accl_rate=imu_rate, gyro_rate=imu_rate)
+        stream = b"".join(payloads)
+        samples = {"gps": duration * gps_rate, "imu": 2 * duration * imu_rate}
+
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+            f.write(synthetic.make_mp4(payloads))
+        try:
+            for name, function, sample_kind, module in STAGES:
+                if stages is not None and name not in stages:
+                    continue
+                if module is not None and not _has_module(module):
+                    continue
+                argument = f.name if name == "mp4_extraction" else stream
+                seconds, peak_memory = measure(function, argument, repeat=repeat)
+                n_samples = samples.get(sample_kind, 0)
+                results.append(StageResult(
+                    stage=name,
+                    duration=duration,
+                    bytes=len(stream),
+                    seconds=seconds,
+                    mb_per_s=len(stream) / seconds / 1e6,
+                    samples=n_samples,
+                    samples_per_s=n_samples / seconds if n_samples else None,
+                    peak_memory=peak_memory
+                ))
+        finally:
+            os.unlink(f.name)
+    return results
+
+
+def format_results(results):
+    """ Format results as a text table """
+    lines = ["%-18s %8s %10s %10s %10s %14s %12s" % (
+        "stage", "duration", "size(MB)", "time(s)", "MB/s", "samples/s", "peak(MB)")]
+    for r in results:
+        lines.append("%-18s %8i %10.2f %10.4f %10.1f %14s %12.2f" % (
+            r.stage, r.duration, r.bytes / 1e6, r.seconds, r.mb_per_s,
+            "-" if r.samples_per_s is None else "%.0f" % r.samples_per_s,
+            r.peak_memory / 1e6))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-d", "--durations", type=int, nargs="+", default=[60, 600],
+                        help="Durations of the synthetic streams in seconds (default=60 600)")
+    parser.add_argument("-s", "--stages", nargs="+", default=None,
+                        choices=[stage[0] for stage in STAGES],
+                        help="Stages to run (default=all)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of timed runs per stage (default=3)")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.durations, stages=args.stages, repeat=args.repeat)
+    import_times, over_budget = check_import_times()
+
+    if args.json:
+        print(json.dumps({
+            "import_times": import_times,
+            "stages": [r._asdict() for r in results]
+        }, indent=2))
+    else:
+        print(format_results(results))
+        print()
+        for module, seconds in import_times.items():
+            print("import %s: %.3f s (budget %.3f s)" % (module, seconds, IMPORT_BUDGETS[module]))
+
+    for module in over_budget:
+        print("import %s is over budget: %.3f s > %.3f s" % (module, import_times[module], IMPORT_BUDGETS[module]),
+              file=sys.stderr)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import os
+import hashlib
+import logging
+import tempfile
+
+import numpy
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_VARIABLE = "GPMF_CACHE_DIR"
+# Part of the file keys, to be increased when the extracted data changes
+# (2: GPS9 streams are extracted)
+CACHE_VERSION = 2
+
+# Size of the chunks read at the start and at the end of files to identify them.
+HASH_CHUNK_SIZE = 1 << 16
+
+
+def file_key(fname):
+    """ Compute a key identifying the content of a file
+
+    The key depends on the path, size and modification time of the file,
+    along with a hash of its first and last bytes.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    key: str
+        An hexadecimal digest.
+    """
+    stat = os.stat(fname)
+    h = hashlib.sha1()
+    h.update(("%i|%s|%i|%i|" % (CACHE_VERSION, os.path.abspath(fname), stat.st_size, stat.st_mtime_ns)).encode())
+    with open(fname, "rb") as f:
+        h.update(f.read(HASH_CHUNK_SIZE))
+        if stat.st_size > HASH_CHUNK_SIZE:
+            f.seek(max(HASH_CHUNK_SIZE, stat.st_size - HASH_CHUNK_SIZE))
+            h.update(f.read(HASH_CHUNK_SIZE))
+    return h.hexdigest()
+
+
+class TelemetryCache(object):
+    """ On-disk cache of the telemetry extracted from video files
+
+    Raw GPMF streams are stored as binary files and parsed arrays as `.npy`
+    files. Entries are keyed by `file_key`, so a modified video file is
+    extracted again. When the total size of the cache exceeds `max_size`,
+    the least recently used entries are removed.
+
+    Parameters
+    ----------
+    directory: str
+        The cache directory. It is created if needed.
+    max_size: int, optional (default=1GiB)
+        The maximum size of the cache in bytes.
+    """
+
+    def __init__(self, directory, max_size=1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, name, value_type):
+        extension = ".npy" if value_type is numpy.ndarray else ".bin"
+        return os.path.join(self.directory, "%s-%s%s" % (key, name, extension))
+
+    def load(self, key, name, value_type=bytes):
+        """ Load an entry from the cache
+
+        Parameters
+        ----------
+        key: str
+            The file key, as returned by `file_key`.
+        name: str
+            The name of the entry, e.g. "gpmf" or "gps".
+        value_type: type, optional (default=bytes)
+            `bytes` or `numpy.ndarray`.
+
+        Returns
+        -------
+        value: bytes or numpy.ndarray
+            The cached value, or None if not found.
+        """
+        path = self._path(key, name, value_type)
+        try:
+            if value_type is numpy.ndarray:
+                value = numpy.load(path, allow_pickle=False)
+            else:
+                with open(path, "rb") as f:
+                    value = f.read()
+        except (OSError, ValueError):
+            return None
+        # The modification time tracks the last use of the entry. This is
+        # best effort: the entry may have been evicted by another process since,
+        # or the cache may be read-only.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def store(self, key, name, value):
+        """ Store an entry in the cache
+
+        Parameters
+        ----------
+        key: str
+            The file key, as returned by `file_key`.
+        name: str
+            The name of the entry.
+        value: bytes or numpy.ndarray
+            The value to store.
+        """
+        value_type = numpy.ndarray if isinstance(value, numpy.ndarray) else bytes
+        path = self._path(key, name, value_type)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if value_type is numpy.ndarray:
+                    numpy.save(f, value, allow_pickle=False)
+                else:
+                    f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def get(self, fname, name, compute, value_type=bytes):
+        """ Get an entry from the cache, computing and storing it if needed
+
+        Parameters
+        ----------
+        fname: str
+            The video file.
+        name: str
+            The name of the entry.
+        compute: callable
+            A function computing the value when it is not cached.
+        value_type: type, optional (default=bytes)
+            `bytes` or `numpy.ndarray`.
+
+        Returns
+        -------
+        value: bytes or numpy.ndarray
+            The cached or computed value.
+        """
+        key = file_key(fname)
+        value = self.load(key, name, value_type)
+        if value is None:
+            value = compute()
+            self.store(key, name, value)
+        else:
+            logger.debug("Cache hit for '%s' (%s)", fname, name)
+        return value
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith((".bin", ".npy")):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        evict_lru(entries, self.max_size)
+
+
+def evict_lru(entries, max_size):
+    """ Remove the least recently used files until their total size fits in `max_size`
+
+    Parameters
+    ----------
+    entries: list of tuple
+        (last use time, size, path) tuples describing the cached files.
+    max_size: int
+        The maximum total size in bytes.
+
+    Returns
+    -------
+    total_size: int
+        The total size of the remaining files.
+    """
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total_size -= size
+    return total_size
+
+
+def get_default_cache():
+    """ Get the cache configured by the `GPMF_CACHE_DIR` environment variable
+
+    Returns
+    -------
+    cache: TelemetryCache
+        The cache, or None if the variable is not set.
+    """
+    directory = os.environ.get(CACHE_DIR_VARIABLE)
+    if not directory:
+        return None
+    return TelemetryCache(directory)
+
+
+def resolve_cache(cache):
+    """Resolve the `cache` argument of extraction functions.
+
+    None means the default cache, False disables caching.
+    """
+    if cache is None:
+        return get_default_cache()
+    if cache is False:
+        return None
+    return cache
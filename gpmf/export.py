@@ -0,0 +1,277 @@
+""" Export of GPS and sensor data to columnar files
+
+The data is written by chunks of rows (one Parquet row group or Arrow record
+batch per chunk), so that the table of a long recording is never built at
+once. Parquet and Feather files require `pyarrow`.
+
+Example::
+
+    gps_data = gpmf.gps.extract_gps(stream)
+    gpmf.export.export(gps_data, "GH010215.gps.parquet", compression="zstd")
+"""
+import os
+import bz2
+import gzip
+import lzma
+from collections import OrderedDict
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from . import profiling
+from .gps import concatenate_gps_blocks, interpolate_times
+from .sensors import SensorData
+
+
+# Number of rows written at once
+CHUNK_SIZE = 100000
+
+FORMATS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "csv": ".csv",
+}
+
+FORMAT_EXTENSIONS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".csv": "csv",
+}
+
+# Compression used when none is given
+DEFAULT_COMPRESSION = {
+    "parquet": "snappy",
+    "feather": "lz4",
+    "csv": None,
+}
+
+CSV_COMPRESSIONS = {
+    "gzip": (gzip.open, ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+
+def gps_columns(gps_data):
+    """Get the columns of GPS data as they are exported.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray or seq of GPSData
+        A structured array as returned by `gpmf.gps.extract_gps` or
+        a sequence of GPSData objects
+
+    Returns
+    -------
+    columns: OrderedDict
+        The name and values of each column. The `time` column holds the sample
+        times interpolated between the timestamps of consecutive blocks.
+    """
+    if not isinstance(gps_data, numpy.ndarray):
+        gps_data = concatenate_gps_blocks(gps_data)
+
+    return OrderedDict([
+        ("latitude", gps_data["latitude"]),
+        ("longitude", gps_data["longitude"]),
+        ("altitude", gps_data["altitude"]),
+        ("time", interpolate_times(gps_data)),
+        ("speed_2d", gps_data["speed_2d"]),
+        ("speed_3d", gps_data["speed_3d"]),
+        ("precision", gps_data["precision"]),
+        ("fix", gps_data["fix"]),
+        ("block_id", gps_data["block_id"]),
+    ])
+
+
+def sensor_columns(sensor_data):
+    """Get the columns of sensor data as they are exported.
+
+    Parameters
+    ----------
+    sensor_data: gpmf.sensors.SensorData
+        The sensor data.
+
+    Returns
+    -------
+    columns: OrderedDict
+        The name and values of each column: `time` in seconds, `block_id` then
+        one column per axis, named from the FourCC code (e.g. accl_0, accl_1, accl_2).
+    """
+    columns = OrderedDict([
+        ("time", sensor_data.time),
+        ("block_id", sensor_data.block_id),
+    ])
+    values = sensor_data.values.reshape(len(sensor_data.values), -1)
+    for axis in range(values.shape[1]):
+        columns["%s_%i" % (sensor_data.fourcc.lower(), axis)] = values[:, axis]
+    return columns
+
+
+def to_dataframe(gps_data):
+    """Convert GPS data into pandas dataframe.
+
+    Each column is allocated once. The `time` column holds the sample times
+    interpolated between the timestamps of consecutive blocks.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray or seq of GPSData
+        A structured array as returned by `gpmf.gps.extract_gps` or
+        a sequence of GPSData objects
+    Returns
+    -------
+    df_gps: pandas.DataFrame
+        The output dataframe
+    """
+    import pandas
+
+    return pandas.DataFrame(gps_columns(gps_data))
+
+
+def guess_format(path):
+    """Guess the export format from the extension of a file name.
+
+    Raises
+    ------
+    ValueError: If the extension is not known.
+    """
+    root, extension = os.path.splitext(path)
+    if any(extension == csv_extension for _, csv_extension in CSV_COMPRESSIONS.values()):
+        extension = os.path.splitext(root)[1]
+    try:
+        return FORMAT_EXTENSIONS[extension.lower()]
+    except KeyError:
+        raise ValueError("Cannot guess the export format of '%s'" % path) from None
+
+
+def file_extension(format, compression=None):
+    """Get the extension of the files written in a format, e.g. ".parquet" or ".csv.gz"."""
+    extension = FORMATS[format]
+    if format == "csv" and compression in CSV_COMPRESSIONS:
+        extension += CSV_COMPRESSIONS[compression][1]
+    return extension
+
+
+def _chunks(columns, chunk_size):
+    n_rows = len(next(iter(columns.values())))
+    # An empty table is still written as one chunk, for its schema.
+    for start in range(0, max(n_rows, 1), chunk_size):
+        yield OrderedDict((name, values[start: start + chunk_size]) for name, values in columns.items())
+
+
+def _require_pyarrow(format):
+    if pyarrow is None:
+        raise RuntimeError("The 'pyarrow' module is required to write %s files" % format)
+
+
+def _write_parquet(chunks, path, compression):
+    _require_pyarrow("parquet")
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pyarrow.table(chunk)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema, compression=compression or "none")
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_feather(chunks, path, compression):
+    _require_pyarrow("feather")
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+    writer = None
+    with pyarrow.OSFile(path, "wb") as sink:
+        try:
+            for chunk in chunks:
+                batch = pyarrow.record_batch(chunk)
+                if writer is None:
+                    writer = pyarrow.ipc.new_file(sink, batch.schema, options=options)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def _write_csv(chunks, path, compression):
+    import pandas
+
+    if compression is None:
+        open_file = open
+    elif compression in CSV_COMPRESSIONS:
+        open_file = CSV_COMPRESSIONS[compression][0]
+    else:
+        raise ValueError("Unsupported CSV compression: %r" % compression)
+
+    with open_file(path, "wt") as out_file:
+        for i, chunk in enumerate(chunks):
+            pandas.DataFrame(chunk).to_csv(out_file, header=(i == 0), index=False)
+
+
+WRITERS = {
+    "parquet": _write_parquet,
+    "feather": _write_feather,
+    "csv": _write_csv,
+}
+
+
+def export(data, path, format=None, columns=None, compression=None, chunk_size=CHUNK_SIZE):
+    """Write GPS or sensor data to a columnar file.
+
+    Parameters
+    ----------
+    data: numpy.ndarray, seq of GPSData or gpmf.sensors.SensorData
+        GPS data as returned by `gpmf.gps.extract_gps` (see `gps_columns`),
+        or the data of a sensor (see `sensor_columns`).
+    path: str
+        The output file.
+    format: str, optional (default=None)
+        "parquet", "feather" or "csv". If None, it is guessed from the extension
+        of `path`.
+    columns: list of str, optional (default=None)
+        The columns written, in this order. All the columns if None.
+    compression: str, optional (default=None)
+        The compression codec: "snappy", "gzip", "brotli", "lz4" or "zstd" for
+        Parquet, "lz4" or "zstd" for Feather, "gzip", "bz2" or "xz" for CSV, or "none".
+        If None, Parquet is compressed with snappy, Feather with lz4 and CSV is
+        not compressed.
+    chunk_size: int, optional (default=CHUNK_SIZE)
+        The number of rows written at once, i.e. the size of the Parquet row
+        groups and of the Feather record batches.
+
+    Raises
+    ------
+    ValueError: If the format or a column is not known.
+    RuntimeError: If `pyarrow` is missing for the format.
+    """
+    if format is None:
+        format = guess_format(path)
+    if format not in WRITERS:
+        raise ValueError("Unknown export format: %r" % format)
+    if compression is None:
+        compression = DEFAULT_COMPRESSION[format]
+    elif compression == "none":
+        compression = None
+
+    if isinstance(data, SensorData):
+        table = sensor_columns(data)
+    else:
+        table = gps_columns(data)
+
+    if columns is not None:
+        unknown = [name for name in columns if name not in table]
+        if unknown:
+            raise ValueError("Unknown columns: %s (available: %s)" % (", ".join(unknown), ", ".join(table)))
+        table = OrderedDict((name, table[name]) for name in columns)
+
+    with profiling.stage("export", points=len(next(iter(table.values())))):
+        WRITERS[format](_chunks(table, chunk_size), path, compression)
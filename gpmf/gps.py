@@ -1,9 +1,15 @@
+import functools
+import struct
 from collections import namedtuple
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from xml.etree import ElementTree as ET
 
-import gpxpy
+import numpy
+from . import mp4
 from . import parse
+from . import profiling
+from .cache import resolve_cache
+from .io import extract_gpmf_stream
 
 
 GPSData = namedtuple("GPSData",
@@ -21,6 +27,25 @@ GPSData = namedtuple("GPSData",
                          "npoints"
                      ])
 
+GPS_DTYPE = numpy.dtype([
+    ("latitude", "f8"),
+    ("longitude", "f8"),
+    ("altitude", "f8"),
+    ("speed_2d", "f8"),
+    ("speed_3d", "f8"),
+    ("time", "datetime64[us]"),
+    ("precision", "f8"),
+    ("fix", "i4"),
+    ("block_id", "i8")
+])
+
+# Reference says the frequency is about 18 Hz and other GPS data about 1Hz
+GPS_FREQUENCY = 18.
+
+# GPS9 samples are dated in days since 2000-01-01 and seconds since midnight
+GPS9_EPOCH = numpy.datetime64("2000-01-01", "us")
+GPS9_FIELDS = ["latitude", "longitude", "altitude", "speed_2d", "speed_3d", "days", "seconds", "dop", "fix"]
+
 
 def extract_gps_blocks(stream):
     """ Extract GPS data blocks from binary stream
@@ -39,15 +64,17 @@ def extract_gps_blocks(stream):
     gps_items_generator: generator
         Generator of lists of `KVLItem` objects
     """
-    for s in parse.filter_klv(stream, "STRM"):
-        content = []
-        is_gps = False
-        for elt in s.value:
-            content.append(elt)
-            if elt.key == "GPS5":
-                is_gps = True
-        if is_gps:
-            yield content
+    if not profiling.is_active():
+        return _extract_gps_blocks(stream)
+    return profiling.timed_iter("extract_gps_blocks", _extract_gps_blocks(stream))
+
+
+def _extract_gps_blocks(stream):
+    index = parse.build_index(stream)
+    gps_items = parse.find_items(index, "GPS5", parent="STRM")
+
+    for strm in numpy.unique(index["parent"][gps_items]):
+        yield [parse.decode_item(stream, index, i) for i in parse.child_items(index, strm)]
 
 
 def parse_gps_block(gps_block):
@@ -63,6 +90,13 @@ def parse_gps_block(gps_block):
     gps_data: GPSData
         A GPSData object holding the GPS information of a block.
     """
+    with profiling.stage("parse_gps_block") as stage:
+        gps_data = _parse_gps_block(gps_block)
+        stage.count(points=gps_data.npoints)
+    return gps_data
+
+
+def _parse_gps_block(gps_block):
     block_dict = {
         s.key: s for s in gps_block
     }
@@ -86,6 +120,438 @@ def parse_gps_block(gps_block):
     )
 
 
+def _block_values(stream, index, strms, fourcc):
+    return [
+        None if i < 0 else parse.decode_item(stream, index, i).value
+        for i in parse.lookup_children(index, strms, fourcc).tolist()
+    ]
+
+
+def _block_scalars(stream, index, strms, fourcc, default):
+    # Blocks with the same layout are read at once
+    positions = parse.lookup_children(index, strms, fourcc)
+    if (positions >= 0).all():
+        try:
+            values = parse.stack_payloads(stream, index, positions)
+        except ValueError:
+            values = None
+        if values is not None and values.shape[1] == 1:
+            return values[:, 0]
+    return numpy.array([default if v is None else v for v in _block_values(stream, index, strms, fourcc)])
+
+
+# Positions of the characters of a GPSU timestamp (yymmddhhmmss.sss) in the
+# ISO 8601 format (20yy-mm-ddThh:mm:ss.sss)
+GPSU_ISO_COLUMNS = [2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 19, 20, 21, 22]
+
+
+def _block_timestamps(stream, index, strms):
+    positions = parse.lookup_children(index, strms, "GPSU")
+    if len(positions) > 0 and (positions >= 0).all():
+        try:
+            gpsu = parse.read_payloads(stream, index, positions)
+        except ValueError:
+            gpsu = None
+        if gpsu is not None and gpsu.shape[1] == 16:
+            iso = numpy.empty((len(gpsu), 23), dtype="u1")
+            iso[:] = numpy.frombuffer(b"20yy-mm-ddThh:mm:ss.sss", dtype="u1")
+            iso[:, GPSU_ISO_COLUMNS] = gpsu
+            try:
+                return iso.view("S23")[:, 0].astype("datetime64[us]")
+            except ValueError:
+                pass
+    return numpy.array(_block_values(stream, index, strms, "GPSU"), dtype="datetime64[us]")
+
+
+def extract_gps(stream):
+    """Extract all the GPS data of a stream into a single columnar array.
+
+    The GPS5 payloads of all the blocks are concatenated and scaled at once.
+    Streams of newer cameras (HERO11 and later) which only record GPS9 are
+    supported, the time, precision and fix then being given per sample.
+
+    Parameters
+    ----------
+    stream: bytes
+        The raw GPMF binary stream
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array with dtype `GPS_DTYPE` with one entry per GPS sample.
+        The time of a sample is the block timestamp (GPSU) shifted by the sample
+        position in the block at `GPS_FREQUENCY`. `block_id` is the index of the
+        block the sample comes from.
+    """
+    with profiling.stage("extract_gps", bytes=len(stream)) as stage:
+        gps_data = _extract_gps(stream)
+        stage.count(points=len(gps_data))
+    return gps_data
+
+
+def _extract_gps(stream):
+    return _extract_gps_counted(stream)[0]
+
+
+def _extract_gps_counted(stream):
+    # Also return the number of GPS blocks, including the empty ones, so
+    # that the block ids of consecutive pieces of a stream can be merged.
+    index = parse.build_index(stream)
+    gps_items = parse.find_items(index, "GPS5", parent="STRM")
+    if len(gps_items) == 0:
+        gps9_items = parse.find_items(index, "GPS9", parent="STRM")
+        if len(gps9_items) > 0:
+            return _extract_gps9(stream, index, gps9_items), len(gps9_items)
+    return _extract_gps5(stream, index, gps_items), len(gps_items)
+
+
+def _extract_gps5(stream, index, gps_items):
+    strms = index["parent"][gps_items]
+
+    values, counts = parse.concat_payloads(stream, index, gps_items)
+    gps_data = numpy.zeros(len(values), dtype=GPS_DTYPE)
+    if len(values) == 0:
+        return gps_data
+
+    block_id = numpy.repeat(numpy.arange(len(gps_items)), counts)
+    sample_id = numpy.arange(len(values)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    scales = parse.lookup_scales(stream, index, strms, values.shape[1])
+    values = values / scales[block_id]
+
+    timestamps = _block_timestamps(stream, index, strms)
+    precision = _block_scalars(stream, index, strms, "GPSP", numpy.nan) / 100.
+    fix = _block_scalars(stream, index, strms, "GPSF", 0)
+
+    for i, name in enumerate(["latitude", "longitude", "altitude", "speed_2d", "speed_3d"]):
+        gps_data[name] = values[:, i]
+    gps_data["time"] = timestamps[block_id] + sample_id * numpy.timedelta64(round(1e6 / GPS_FREQUENCY), "us")
+    gps_data["precision"] = precision[block_id]
+    gps_data["fix"] = fix[block_id]
+    gps_data["block_id"] = block_id
+    return gps_data
+
+
+def extract_gps_incremental(payloads, batch_size=parse.BATCH_SIZE):
+    """Extract the GPS data of a stream read by pieces into a single columnar array.
+
+    The pieces are parsed as they arrive, by groups of about `batch_size`
+    bytes, so that the whole stream is never held in memory.
+
+    Parameters
+    ----------
+    payloads: iterable of bytes
+        Buffers made of complete top-level items (DEVC), e.g. from
+        `gpmf.io.iter_gpmf_stream` or `gpmf.parse.read_klv_stream`.
+    batch_size: int, optional (default=gpmf.parse.BATCH_SIZE)
+        The number of bytes parsed at once, see `gpmf.parse.group_payloads`.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `extract_gps`.
+    """
+    parts = []
+    n_blocks = 0
+    with profiling.stage("extract_gps") as stage:
+        for group in parse.group_payloads(payloads, batch_size):
+            gps_data, group_blocks = _extract_gps_counted(group)
+            stage.count(bytes=len(group), points=len(gps_data))
+            gps_data["block_id"] += n_blocks
+            n_blocks += group_blocks
+            parts.append(gps_data)
+
+    if len(parts) == 0:
+        return numpy.zeros(0, dtype=GPS_DTYPE)
+    return numpy.concatenate(parts)
+
+
+def _extract_gps9(stream, index, gps_items):
+    strms = index["parent"][gps_items]
+    dtype = parse.lookup_type(stream, index, strms)
+    if len(dtype.names) != len(GPS9_FIELDS):
+        raise ValueError("Unexpected GPS9 type with %i fields" % len(dtype.names))
+
+    records, counts = parse.concat_payloads(stream, index, gps_items, dtype=dtype)
+    gps_data = numpy.zeros(len(records), dtype=GPS_DTYPE)
+    if len(records) == 0:
+        return gps_data
+
+    block_id = numpy.repeat(numpy.arange(len(gps_items)), counts)
+    values = numpy.column_stack([records[name].astype("f8") for name in dtype.names])
+    scales = parse.lookup_scales(stream, index, strms, values.shape[1])
+    values = dict(zip(GPS9_FIELDS, (values / scales[block_id]).T))
+
+    for name in ["latitude", "longitude", "altitude", "speed_2d", "speed_3d"]:
+        gps_data[name] = values[name]
+    microseconds = numpy.round((values["days"] * 86400. + values["seconds"]) * 1e6).astype("i8")
+    gps_data["time"] = GPS9_EPOCH + microseconds.astype("timedelta64[us]")
+    gps_data["precision"] = values["dop"]
+    gps_data["fix"] = values["fix"]
+    gps_data["block_id"] = block_id
+    return gps_data
+
+
+def extract_gps_from_file(fname, cache=None, jobs=1):
+    """Extract all the GPS data of a video file into a single columnar array.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    cache: gpmf.cache.TelemetryCache or bool, optional (default=None)
+        The cache storing extracted data. If None, the cache set by the
+        `GPMF_CACHE_DIR` environment variable is used, if any. If False,
+        no cache is used.
+    jobs: int, optional (default=1)
+        The number of processes decoding the stream, see `gpmf.parallel.extract_gps`.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `extract_gps`.
+    """
+    decode = extract_gps
+    if jobs > 1:
+        from . import parallel
+        decode = functools.partial(parallel.extract_gps, jobs=jobs)
+
+    cache = resolve_cache(cache)
+    if cache is None:
+        return decode(extract_gpmf_stream(fname, cache=False))
+    return cache.get(fname, "gps", lambda: decode(extract_gpmf_stream(fname, cache=cache)),
+                     value_type=numpy.ndarray)
+
+
+def _is_utc(t):
+    return isinstance(t, (str, datetime, numpy.datetime64))
+
+
+def _to_seconds(t, origin):
+    if t is None:
+        return None
+    if not _is_utc(t):
+        return float(t)
+    if isinstance(t, datetime) and t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    elif isinstance(t, str):
+        t = t.rstrip("Z")
+    return (numpy.datetime64(t, "us") - origin) / numpy.timedelta64(1, "s")
+
+
+def _video_origin(f, track, first=0):
+    # UTC time of the start of the video, from the first GPS timestamp found
+    for i in range(first, len(track.sizes)):
+        times = extract_gps(mp4.read_samples(f, track, i, i + 1))["time"]
+        times = times[~numpy.isnat(times)]
+        if len(times) > 0:
+            return times[0] - numpy.timedelta64(round(track.times[i] * 1e6), "us")
+    return None
+
+
+def extract_gps_window(fname, start=None, end=None):
+    """Extract the GPS data of a time window of a video file.
+
+    The window is mapped onto the samples of the GPMF track with the MP4
+    sample table, and only these samples are read and decoded.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    start: float, str, datetime.datetime or numpy.datetime64, optional (default=None)
+        Start of the window, either in seconds from the start of the video or as
+        a UTC time. If None, start at the beginning of the video.
+    end: float, str, datetime.datetime or numpy.datetime64, optional (default=None)
+        End of the window (excluded). If None, stop at the end of the video.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `extract_gps` with only the samples
+        of the window.
+    """
+    with open(fname, "rb") as f:
+        track = mp4.find_gpmf_track(f)
+        origin = None
+
+        if _is_utc(start) or _is_utc(end):
+            origin = _video_origin(f, track)
+            if origin is None:
+                return numpy.zeros(0, dtype=GPS_DTYPE)
+        start, end = _to_seconds(start, origin), _to_seconds(end, origin)
+
+        first, stop = mp4.sample_range(track, start, end)
+        gps_data = extract_gps(mp4.read_samples(f, track, first, stop))
+        if len(gps_data) == 0:
+            return gps_data
+        if origin is None:
+            origin = _video_origin(f, track, first)
+
+    video_time = (gps_data["time"] - origin) / numpy.timedelta64(1, "s")
+    mask = numpy.ones(len(gps_data), dtype=bool)
+    if start is not None:
+        mask &= video_time >= start
+    if end is not None:
+        mask &= video_time < end
+    return gps_data[mask]
+
+
+def _iter_sample_gps_blocks(fname):
+    with open(fname, "rb") as f:
+        track = mp4.find_gpmf_track(f)
+        for i in range(len(track.sizes)):
+            for gps_block in extract_gps_blocks(mp4.read_samples(f, track, i, i + 1)):
+                yield gps_block
+
+
+def find_first_gps(fname, skip_no_fix=False, min_fix=2, max_precision=None):
+    """Find the first GPS data block of a video file.
+
+    The samples of the GPMF track are read one at a time from the start of
+    the file and reading stops as soon as a suitable block is found, so the
+    cost does not depend on the length of the video.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    skip_no_fix: bool, optional (default=False)
+        If True, skip the blocks without a valid fix, i.e. with a fix (GPSF)
+        lower than `min_fix` or a precision greater than `max_precision`.
+    min_fix: int, optional (default=2)
+        The minimum fix type of a valid block (2: 2d, 3: 3d).
+    max_precision: float, optional (default=None)
+        The maximum precision (dilution of precision) of a valid block. If None
+        the precision is not checked.
+
+    Returns
+    -------
+    gps_data: GPSData
+        The first suitable block, or None if there is none.
+    """
+    try:
+        return _find_first_block(_iter_sample_gps_blocks(fname), skip_no_fix, min_fix, max_precision)
+    except (RuntimeError, ValueError, struct.error):
+        # Not a MP4 file we can read natively, or a first sample which cannot
+        # be decoded on its own (truncated or garbled).
+        return _find_first_block(extract_gps_blocks(extract_gpmf_stream(fname)),
+                                 skip_no_fix, min_fix, max_precision)
+
+
+def _find_first_block(gps_blocks, skip_no_fix, min_fix, max_precision):
+    for gps_block in gps_blocks:
+        gps_data = parse_gps_block(gps_block)
+        if not skip_no_fix:
+            return gps_data
+        if gps_data.fix >= min_fix and (max_precision is None or gps_data.precision <= max_precision):
+            return gps_data
+    return None
+
+
+def concatenate_gps_blocks(gps_data_blocks):
+    """Concatenate a sequence of GPSData objects into a single columnar array.
+
+    Parameters
+    ----------
+    gps_data_blocks: seq of GPSData
+        A sequence of GPSData objects
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array like the ones returned by `extract_gps`.
+    """
+    gps_data_blocks = list(gps_data_blocks)
+    counts = numpy.array([b.npoints for b in gps_data_blocks], dtype="i8")
+    gps_data = numpy.zeros(counts.sum(), dtype=GPS_DTYPE)
+    if len(gps_data) == 0:
+        return gps_data
+
+    block_id = numpy.repeat(numpy.arange(len(counts)), counts)
+    sample_id = numpy.arange(len(gps_data)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    for name in ["latitude", "longitude", "altitude", "speed_2d", "speed_3d"]:
+        gps_data[name] = numpy.concatenate([getattr(b, name) for b in gps_data_blocks])
+
+    timestamps = numpy.array([b.timestamp for b in gps_data_blocks], dtype="datetime64[us]")
+    gps_data["time"] = timestamps[block_id] + sample_id * numpy.timedelta64(round(1e6 / GPS_FREQUENCY), "us")
+    gps_data["precision"] = numpy.array([b.precision for b in gps_data_blocks])[block_id]
+    gps_data["fix"] = numpy.array([b.fix for b in gps_data_blocks])[block_id]
+    gps_data["block_id"] = block_id
+    return gps_data
+
+
+def interpolate_times(gps_data):
+    """Compute the time of each sample by interpolating between block timestamps.
+
+    The samples of a block are spread evenly between the timestamp (GPSU) of
+    the block and the one of the next block. The last block is given the
+    duration of the previous one.
+
+    Blocks without a timestamp (NaT) are skipped: their samples continue the
+    times of the previous block with a timestamp, i.e. they are interpolated
+    between the surrounding timestamps. The samples preceding the first
+    timestamp are NaT.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `extract_gps`.
+
+    Returns
+    -------
+    time: numpy.ndarray
+        The sample times as a `datetime64[ns]` array.
+    """
+    first = first_of_blocks(gps_data)
+    block_times = gps_data["time"][first].astype("datetime64[ns]")
+    valid = numpy.flatnonzero(~numpy.isnat(block_times))
+    time = numpy.full(len(gps_data), numpy.datetime64("NaT"), dtype="datetime64[ns]")
+    if len(valid) == 0:
+        return time
+
+    starts = block_times[valid].astype("i8")
+    block_start = numpy.flatnonzero(first)
+    counts = numpy.diff(numpy.append(block_start, len(gps_data)))
+    start_sample = block_start[valid]
+
+    # Time step of the samples following each timestamp
+    if len(valid) > 1:
+        steps = numpy.diff(starts) / numpy.diff(start_sample)
+        last_duration = (starts[-1] - starts[-2]) / (valid[-1] - valid[-2])
+    else:
+        steps = numpy.zeros(0)
+        last_duration = 1e9 * counts[valid[-1]] / GPS_FREQUENCY
+    steps = numpy.append(steps, last_duration / counts[valid[-1]])
+
+    sample_id = numpy.arange(start_sample[0], len(gps_data))
+    anchor = numpy.searchsorted(start_sample, sample_id, side="right") - 1
+    time[start_sample[0]:] = (
+        starts[anchor] + numpy.round((sample_id - start_sample[anchor]) * steps[anchor]).astype("i8")
+    ).astype("datetime64[ns]")
+    return time
+
+
+def first_of_blocks(gps_data):
+    """Select the first sample of each block of a columnar GPS array.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `extract_gps`.
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the first sample of each block.
+    """
+    block_id = gps_data["block_id"]
+    mask = numpy.ones(len(block_id), dtype=bool)
+    mask[1:] = block_id[1:] != block_id[:-1]
+    return mask
+
+
 FIX_TYPE = {
     0: "none",
     2: "2d",
@@ -109,7 +575,7 @@ def _make_speed_extensions(gps_data, i):
     return [speed_2d, speed_3d]
 
 
-def make_pgx_segment(gps_blocks, first_only=False, speeds_as_extensions=True):
+def make_pgx_segment(gps_blocks, first_only=False, speeds_as_extensions=True, mask=None):
     """Convert a list of GPSData objects into a GPX track segment.
 
     Parameters
@@ -122,21 +588,37 @@ def make_pgx_segment(gps_blocks, first_only=False, speeds_as_extensions=True):
         If True, include 2d and 3d speed values as exentensions of
         the GPX trackpoints. This is especially useful when saving
         to GPX 1.1 format.
+    mask: numpy.ndarray, optional (default=None)
+        A boolean mask over the samples of all the blocks selecting the
+        points to keep, e.g. as returned by `gpmf.simplify.decimate`.
 
     Returns
     -------
     gpx_segment: gpxpy.gpx.GPXTrackSegment
         A gpx track segment.
     """
+    with profiling.stage("make_pgx_segment") as stage:
+        track_segment = _make_pgx_segment(gps_blocks, first_only, speeds_as_extensions, mask)
+        stage.count(points=len(track_segment.points))
+    return track_segment
+
+
+def _make_pgx_segment(gps_blocks, first_only, speeds_as_extensions, mask):
+    import gpxpy.gpx
 
     track_segment = gpxpy.gpx.GPXTrackSegment()
     dt = timedelta(seconds=1.0 / 18.)
+    offset = 0
 
     for gps_data in gps_blocks:
         time = datetime.strptime(gps_data.timestamp, "%Y-%m-%d %H:%M:%S.%f")
         # Reference says the frequency is about 18 Hz and other GPS data about 1Hz
         stop = 1 if first_only else gps_data.npoints
-        for i in range(stop):
+        indices = range(stop)
+        if mask is not None:
+            indices = numpy.flatnonzero(mask[offset:offset + stop]).tolist()
+        offset += gps_data.npoints
+        for i in indices:
             tp = gpxpy.gpx.GPXTrackPoint(
                 latitude=gps_data.latitude[i],
                 longitude=gps_data.longitude[i],
@@ -151,7 +633,7 @@ def make_pgx_segment(gps_blocks, first_only=False, speeds_as_extensions=True):
 
             if speeds_as_extensions:
 
-                for e in _make_speed_extensions(gps_data, 0):
+                for e in _make_speed_extensions(gps_data, i):
                     tp.extensions.append(e)
 
             track_segment.points.append(tp)
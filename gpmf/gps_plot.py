@@ -2,45 +2,19 @@ import matplotlib.pyplot as plt
 import geopandas as gpd
 import contextily as ctx
 import numpy
-import pandas
 
 
-from .gps import extract_gps_blocks, parse_gps_block
+from . import profiling
+from . import tiles
+from .export import to_dataframe
+from .gps import extract_gps, first_of_blocks
+from .simplify import decimate
 
 
 LATLON = "EPSG:4326"
 LAMBERT93 = "EPSG:2154"
 
 
-def to_dataframe(gps_data_blocks):
-    """Convert a sequence of GPSData into pandas dataframe.
-
-    Parameters
-    ----------
-    gps_data_blocks: seq of GPSData
-        A sequence of GPSData objects
-    Returns
-    -------
-    df_gps: pandas.DataFrame
-        The output dataframe
-    """
-    df_blocks = []
-    for i, block in enumerate(gps_data_blocks):
-        df_block = pandas.DataFrame()
-        df_block["latitude"] = block.latitude
-        df_block["longitude"] = block.longitude
-        df_block["altitude"] = block.altitude
-        df_block["time"] = block.timestamp
-        df_block["speed_2d"] = block.speed_2d
-        df_block["speed_3d"] = block.speed_3d
-        df_block["precision"] = block.precision
-        df_block["fix"] = block.fix
-        df_block["block_id"] = i
-        df_blocks.append(df_block)
-
-    return pandas.concat(df_blocks)
-
-
 def filter_outliers(x):
     """Filter outliers based on 0.01 and 0.99 quantiles"""
     q01, q50, q99 = numpy.quantile(x, q=[0.01, 0.5, 0.99])
@@ -53,7 +27,9 @@ def plot_gps_trace(latlon,
                    zoom=12,
                    figsize=(10, 10),
                    proj_crs=LAMBERT93,
-                   color="tab:red"):
+                   color="tab:red",
+                   tile_cache=None,
+                   offline=False):
     """ Plot a (lat, lon) coordinates on a Map
 
     Parameters
@@ -62,8 +38,9 @@ def plot_gps_trace(latlon,
         Array of (latitude, longitude) coordinates
     min_tile_size: int, optional (default=10)
         Minimum size of the map in km
-    map_provider: dict
-        Dictionnary describing a map provider as given by `contextly.providers`. If None
+    map_provider: dict or tile provider
+        Dictionnary describing a map provider as given by `contextly.providers`, or a
+        tile provider from `gpmf.tiles` (e.g. an offline `MBTilesProvider`). If None
         `contextily.providers.GeoportailFrance["maps"]` is used.
     zoom: int, optional (default=12)
         The zoom level used.
@@ -74,10 +51,24 @@ def plot_gps_trace(latlon,
         corresponds to the Lambert 93 system.
     color: str, optional (default="tab:red")
         The color used to plot the track.
+    tile_cache: gpmf.tiles.TileCache or str, optional (default=None)
+        If given, the tiles of a `contextily` provider are downloaded through this
+        on-disk store and reused by later calls.
+    offline: bool, optional (default=False)
+        With `tile_cache`, only use the tiles already in the store, without
+        downloading any.
     """
+    with profiling.stage("plot_gps_trace", points=len(latlon)):
+        _plot_gps_trace(latlon, min_tile_size, map_provider, zoom, figsize, proj_crs, color, tile_cache, offline)
+
+
+def _plot_gps_trace(latlon, min_tile_size, map_provider, zoom, figsize, proj_crs, color, tile_cache, offline):
     if map_provider is None:
         map_provider = ctx.providers.GeoportailFrance["maps"]
 
+    if tile_cache is not None and not hasattr(map_provider, "get_tile"):
+        map_provider = tiles.CachedTileProvider(map_provider, tile_cache, offline=offline)
+
     min_tile_size *= 1000
 
     y, x = latlon.T
@@ -111,7 +102,11 @@ def plot_gps_trace(latlon,
         ymax = yc + min_tile_size / 2
         plt.ylim(ymin, ymax)
 
-    ctx.add_basemap(ax, source=map_provider, zoom=zoom, crs=proj_crs)
+    with profiling.stage("basemap"):
+        if hasattr(map_provider, "get_tile"):
+            tiles.add_basemap(ax, map_provider, zoom=zoom, crs=proj_crs)
+        else:
+            ctx.add_basemap(ax, source=map_provider, zoom=zoom, crs=proj_crs)
     ax.set_axis_off()
 
 
@@ -124,7 +119,11 @@ def plot_gps_trace_from_stream(stream,
                                proj_crs=LAMBERT93,
                                output_path=None,
                                precision_max=3.0,
-                               color="tab:red"):
+                               color="tab:red",
+                               tile_cache=None,
+                               tolerance=None,
+                               interval=None,
+                               offline=False):
     """ Plot GPS data from a string on a map.
 
         Parameters
@@ -145,24 +144,30 @@ def plot_gps_trace_from_stream(stream,
             corresponds to the Lambert 93 system.
         color: str, optional (default="tab:red")
             The color used to plot the track.
+        tile_cache: gpmf.tiles.TileCache or str, optional (default=None)
+            If given, the on-disk store used for the tiles of `contextily` providers.
+        tolerance: float, optional (default=None)
+            If given, the track is simplified with this tolerance in meters.
+        interval: float, optional (default=None)
+            If given, at most one GPS entry per interval in seconds is plotted.
+        offline: bool, optional (default=False)
+            With `tile_cache`, only use the tiles already in the store.
     """
-    gps_data_blocks = map(parse_gps_block, extract_gps_blocks(stream))
+    gps_data = extract_gps(stream)
+    gps_data = gps_data[gps_data["precision"] < precision_max]
 
     if first_only:
-        latlon = numpy.array([[b.latitude[0], b.longitude[0]]
-                              for b in gps_data_blocks
-                              if b.precision < precision_max])
-    else:
-        latlon = numpy.vstack([
-            numpy.vstack([b.latitude, b.longitude]).T
-            for b in gps_data_blocks
-            if b.precision < precision_max
-        ])
+        gps_data = gps_data[first_of_blocks(gps_data)]
+
+    if tolerance is not None or interval is not None:
+        gps_data = gps_data[decimate(gps_data, tolerance=tolerance, interval=interval)]
+
+    latlon = numpy.column_stack([gps_data["latitude"], gps_data["longitude"]])
 
     plot_gps_trace(latlon, min_tile_size=min_tile_size,
                    map_provider=map_provider,
                    zoom=zoom, figsize=figsize,
-                   proj_crs=proj_crs, color=color)
+                   proj_crs=proj_crs, color=color, tile_cache=tile_cache, offline=offline)
     plt.tight_layout()
 
     if output_path is not None:
@@ -0,0 +1,135 @@
+import numpy
+
+from . import profiling
+from .gps import FIX_TYPE
+
+
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx xmlns="http://www.topografix.com/GPX/{v}" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xsi:schemaLocation="http://www.topografix.com/GPX/{v} http://www.topografix.com/GPX/{v}/gpx.xsd" '
+    'version="{version}" creator="{creator}">\n'
+    '  <trk>\n'
+    '    <trkseg>\n'
+)
+GPX_FOOTER = (
+    '    </trkseg>\n'
+    '  </trk>\n'
+    '</gpx>'
+)
+
+CREATOR = "pygpmf -- https://github.com/alexis-mignon/pygpmf"
+
+TRACK_POINT = {
+    "1.0": (
+        '      <trkpt lat="%s" lon="%s">\n'
+        '        <ele>%s</ele>\n'
+        '        <time>%s</time>\n'
+        '        <speed>%s</speed>\n'
+        '        <sym>Square</sym>\n'
+        '        <fix>%s</fix>\n'
+        '        <pdop>%s</pdop>\n'
+        '      </trkpt>\n'
+    ),
+    "1.1": (
+        '      <trkpt lat="%s" lon="%s">\n'
+        '        <ele>%s</ele>\n'
+        '        <time>%s</time>\n'
+        '        <sym>Square</sym>\n'
+        '        <fix>%s</fix>\n'
+        '        <pdop>%s</pdop>\n'
+        '      </trkpt>\n'
+    ),
+    "1.1-extensions": (
+        '      <trkpt lat="%s" lon="%s">\n'
+        '        <ele>%s</ele>\n'
+        '        <time>%s</time>\n'
+        '        <sym>Square</sym>\n'
+        '        <fix>%s</fix>\n'
+        '        <pdop>%s</pdop>\n'
+        '        <extensions>\n'
+        '          <speed_2d>\n'
+        '            <value>%g</value>\n'
+        '            <unit>m/s</unit>\n'
+        '          </speed_2d>\n'
+        '          <speed_3d>\n'
+        '            <value>%g</value>\n'
+        '            <unit>m/s</unit>\n'
+        '          </speed_3d>\n'
+        '        </extensions>\n'
+        '      </trkpt>\n'
+    )
+}
+
+
+def _format_floats(x):
+    """Format floats the way gpxpy does, avoiding the scientific notation."""
+    strings = [repr(v) for v in x.tolist()]
+    return [
+        format(v, ".10f").rstrip("0").rstrip(".") if "e" in s else s
+        for s, v in zip(strings, x.tolist())
+    ]
+
+
+def _format_times(x):
+    strings = numpy.datetime_as_string(x, unit="us").tolist()
+    return [s[:-7] if s.endswith(".000000") else s for s in strings]
+
+
+def _format_points(gps_data, start, stop, template, version, speeds_as_extensions):
+    columns = [
+        _format_floats(gps_data["latitude"][start:stop]),
+        _format_floats(gps_data["longitude"][start:stop]),
+        _format_floats(gps_data["altitude"][start:stop]),
+        _format_times(gps_data["time"][start:stop]),
+    ]
+    if version == "1.0":
+        columns.append(_format_floats(gps_data["speed_3d"][start:stop]))
+    columns.append([FIX_TYPE.get(fix, "none") for fix in gps_data["fix"][start:stop].tolist()])
+    columns.append(_format_floats(gps_data["precision"][start:stop]))
+    if version != "1.0" and speeds_as_extensions:
+        columns.append(gps_data["speed_2d"][start:stop].tolist())
+        columns.append(gps_data["speed_3d"][start:stop].tolist())
+
+    return "".join([template % values for values in zip(*columns)])
+
+
+def write_gpx(gps_data, out_file, version="1.1", speeds_as_extensions=True, chunk_size=10000):
+    """Write GPS data as a GPX track to a file.
+
+    Points are formatted and written by chunks, without building the whole
+    document in memory. The output is the same as the one of `gpxpy` with
+    a segment built by `gpmf.gps.make_pgx_segment`.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    out_file: file object
+        The text file to write to.
+    version: str, optional (default="1.1")
+        The GPX version, "1.0" or "1.1".
+    speeds_as_extensions: bool, optional (default=True)
+        If True, include 2d and 3d speed values as extensions of
+        the GPX trackpoints. Extensions are not available in GPX 1.0,
+        which stores the 3d speed in the `speed` element instead.
+    chunk_size: int, optional (default=10000)
+        The number of points formatted at once.
+    """
+    if version not in ("1.0", "1.1"):
+        raise ValueError("Unsupported GPX version: %r" % version)
+
+    if version == "1.0":
+        template = TRACK_POINT["1.0"]
+    elif speeds_as_extensions:
+        template = TRACK_POINT["1.1-extensions"]
+    else:
+        template = TRACK_POINT["1.1"]
+
+    npoints = len(gps_data["latitude"])
+    with profiling.stage("write_gpx", points=npoints):
+        out_file.write(GPX_HEADER.format(v=version.replace(".", "/"), version=version, creator=CREATOR))
+        for start in range(0, npoints, chunk_size):
+            out_file.write(_format_points(gps_data, start, start + chunk_size, template, version, speeds_as_extensions))
+        out_file.write(GPX_FOOTER)
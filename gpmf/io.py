@@ -1,7 +1,128 @@
 import logging
+import struct
+
+from . import mp4
+from . import parse
+from . import profiling
+from .cache import resolve_cache
 
 logger = logging.getLogger(__name__)
 
+
+def extract_gpmf_stream_native(fname):
+    """Extract GPMF binary data from MP4/MOV files without ffmpeg
+
+    Only the byte ranges of the samples of the GPMF track are read from the file.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream
+
+    Raises
+    ------
+    RuntimeError: If no GPMF track is found.
+    """
+    return extract_gpmf_stream_with_track(fname)[0]
+
+
+def extract_gpmf_stream_with_track(fname):
+    """Extract GPMF binary data from MP4/MOV files along with the track information
+
+    The track information gives the time span of each payload, see `gpmf.sensors`.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream
+    track: gpmf.mp4.GPMFTrack
+        The sample table of the GPMF track.
+
+    Raises
+    ------
+    RuntimeError: If no GPMF track is found.
+    """
+    with profiling.stage("read_mp4") as stage, open(fname, "rb") as f:
+        track = mp4.find_gpmf_track(f)
+        gpmf_data = mp4.read_samples(f, track)
+        stage.count(bytes=len(gpmf_data))
+        return gpmf_data, track
+
+
+def extract_gpmf_stream_window(fname, start=None, end=None):
+    """Extract the GPMF binary data of a time window from MP4/MOV files
+
+    Only the samples of the GPMF track overlapping the window are read.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    start: float, optional (default=None)
+        Start of the window in seconds from the start of the video.
+        If None, start at the beginning of the video.
+    end: float, optional (default=None)
+        End of the window in seconds. If None, stop at the end of the video.
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream of the window
+    track: gpmf.mp4.GPMFTrack
+        The sample table of the samples read.
+
+    Raises
+    ------
+    RuntimeError: If no GPMF track is found.
+    """
+    with open(fname, "rb") as f:
+        track = mp4.find_gpmf_track(f)
+        first, stop = mp4.sample_range(track, start, end)
+        return mp4.read_samples(f, track, first, stop), mp4.slice_track(track, first, stop)
+
+
+def _iter_samples(f, track):
+    with f:
+        for i in range(len(track.sizes)):
+            yield mp4.read_samples(f, track, i, i + 1)
+
+
+def iter_gpmf_stream_native(fname):
+    """Read the GPMF binary data of MP4/MOV files sample by sample
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+
+    Returns
+    -------
+    payloads: generator
+        A generator of bytes, the payload of each sample of the GPMF track.
+
+    Raises
+    ------
+    RuntimeError: If no GPMF track is found.
+    """
+    f = open(fname, "rb")
+    try:
+        track = mp4.find_gpmf_track(f)
+    except BaseException:
+        f.close()
+        raise
+    return _iter_samples(f, track)
+
+
 try:
     import ffmpeg
 
@@ -30,8 +151,8 @@ try:
 
         raise RuntimeError("Could not find GPS stream")
 
-    def extract_gpmf_stream(fname, verbose=False):
-        """Extract GPMF binary data from video files
+    def extract_gpmf_stream_ffmpeg(fname, verbose=False):
+        """Extract GPMF binary data from video files using ffmpeg
 
         Parameters
         ----------
@@ -45,12 +166,144 @@ try:
         gpmf_data: bytes
             The raw GPMF binary stream
         """
-        stream_info = find_gpmf_stream(fname)
-        stream_index = stream_info["index"]
-        return ffmpeg.input(fname)\
-            .output("pipe:", format="rawvideo", map="0:%i" % stream_index, codec="copy")\
-            .run(capture_stdout=True, capture_stderr=not verbose)[0]
+        with profiling.stage("ffmpeg") as stage:
+            stream_info = find_gpmf_stream(fname)
+            stream_index = stream_info["index"]
+            gpmf_data = ffmpeg.input(fname)\
+                .output("pipe:", format="rawvideo", map="0:%i" % stream_index, codec="copy")\
+                .run(capture_stdout=True, capture_stderr=not verbose)[0]
+            stage.count(bytes=len(gpmf_data))
+            return gpmf_data
+
+    def iter_gpmf_stream_ffmpeg(fname, verbose=False, read_size=parse.READ_SIZE):
+        """Extract GPMF binary data from video files incrementally using ffmpeg
+
+        The output of ffmpeg is parsed while it runs instead of being captured
+        at once, see `gpmf.parse.read_klv_stream`. ffmpeg is killed if the
+        generator is closed before the end of the stream.
+
+        Parameters
+        ----------
+        fname: str
+            The input file
+        verbose: bool, optional (default=False)
+            If True, display ffmpeg messages.
+        read_size: int, optional (default=gpmf.parse.READ_SIZE)
+            The maximum number of bytes read at once from ffmpeg.
+
+        Returns
+        -------
+        payloads: generator
+            A generator of bytes, each holding one top-level item (DEVC).
+
+        Raises
+        ------
+        RuntimeError: If ffmpeg fails.
+        """
+        stream_index = find_gpmf_stream(fname)["index"]
+        node = ffmpeg.input(fname).output("pipe:", format="rawvideo", map="0:%i" % stream_index, codec="copy")
+        if not verbose:
+            node = node.global_args("-v", "error")
+        process = node.run_async(pipe_stdout=True)
+        try:
+            for payload in parse.read_klv_stream(process.stdout, read_size):
+                yield payload
+            if process.wait() != 0:
+                raise RuntimeError("ffmpeg failed with exit code %i" % process.returncode)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
 
 
 except ImportError:
     logger.info("The 'ffmpeg' module could not be loaded. The function 'find_gpmf_stream' will not be available.")
+    extract_gpmf_stream_ffmpeg = None
+    iter_gpmf_stream_ffmpeg = None
+
+
+def extract_gpmf_stream(fname, verbose=False, use_ffmpeg=False, cache=None):
+    """Extract GPMF binary data from video files
+
+    The MP4/MOV container is read natively. If this fails and the 'ffmpeg'
+    module is available, ffmpeg is used as a fallback.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    verbose: bool, optional (default=False)
+        If True, display ffmpeg messages.
+    use_ffmpeg: bool, optional (default=False)
+        If True, always use ffmpeg to extract the stream.
+    cache: gpmf.cache.TelemetryCache or bool, optional (default=None)
+        The cache storing extracted streams. If None, the cache set by the
+        `GPMF_CACHE_DIR` environment variable is used, if any. If False,
+        no cache is used.
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The raw GPMF binary stream
+    """
+    cache = resolve_cache(cache)
+    with profiling.stage("extract_gpmf_stream") as stage:
+        if cache is not None:
+            gpmf_data = cache.get(fname, "gpmf", lambda: _extract_gpmf_stream(fname, verbose, use_ffmpeg))
+        else:
+            gpmf_data = _extract_gpmf_stream(fname, verbose, use_ffmpeg)
+        stage.count(bytes=len(gpmf_data))
+    return gpmf_data
+
+
+def iter_gpmf_stream(fname, verbose=False, use_ffmpeg=False):
+    """Read GPMF binary data from video files incrementally
+
+    The stream is yielded by pieces, so that it can be parsed while it is read
+    without holding all of it in memory. The MP4/MOV container is read natively.
+    If it cannot be parsed and the 'ffmpeg' module is available, the output
+    of ffmpeg is read instead.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    verbose: bool, optional (default=False)
+        If True, display ffmpeg messages.
+    use_ffmpeg: bool, optional (default=False)
+        If True, always use ffmpeg to extract the stream.
+
+    Returns
+    -------
+    payloads: generator
+        A generator of bytes made of complete top-level items (DEVC), whose
+        concatenation is the stream returned by `extract_gpmf_stream`.
+    """
+    if use_ffmpeg:
+        if iter_gpmf_stream_ffmpeg is None:
+            raise RuntimeError("The 'ffmpeg' module is not available")
+        return iter_gpmf_stream_ffmpeg(fname, verbose=verbose)
+
+    try:
+        return iter_gpmf_stream_native(fname)
+    except (RuntimeError, struct.error, ValueError) as e:
+        if iter_gpmf_stream_ffmpeg is None:
+            raise
+        logger.info("Native extraction of '%s' failed (%s), falling back to ffmpeg.", fname, e)
+        return iter_gpmf_stream_ffmpeg(fname, verbose=verbose)
+
+
+def _extract_gpmf_stream(fname, verbose, use_ffmpeg):
+    if use_ffmpeg:
+        if extract_gpmf_stream_ffmpeg is None:
+            raise RuntimeError("The 'ffmpeg' module is not available")
+        return extract_gpmf_stream_ffmpeg(fname, verbose=verbose)
+
+    try:
+        return extract_gpmf_stream_native(fname)
+    except (RuntimeError, struct.error, ValueError) as e:
+        if extract_gpmf_stream_ffmpeg is None:
+            raise
+        logger.info("Native extraction of '%s' failed (%s), falling back to ffmpeg.", fname, e)
+        return extract_gpmf_stream_ffmpeg(fname, verbose=verbose)
@@ -0,0 +1,265 @@
+from collections import namedtuple
+import struct
+import logging
+import numpy
+
+
+logger = logging.getLogger(__name__)
+
+GPMFTrack = namedtuple("GPMFTrack", ["track_id", "timescale", "offsets", "sizes", "times", "durations"])
+Box = namedtuple("Box", ["type", "offset", "size", "header_size"])
+
+
+def iter_boxes(f, start, end):
+    """ Iterate on the ISO-BMFF boxes found between two file positions.
+
+    Parameters
+    ----------
+    f: file object
+        A binary file object opened for reading.
+    start: int
+        Position of the first box header.
+    end: int
+        Position where the iteration stops.
+
+    Returns
+    -------
+    box_gen: generator
+        A generator of `Box` objects.
+    """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise RuntimeError("Invalid box size at offset %i" % pos)
+        yield Box(box_type.decode("latin1"), pos, size, header_size)
+        pos += size
+
+
+def _read_payload(f, box):
+    f.seek(box.offset + box.header_size)
+    return f.read(box.size - box.header_size)
+
+
+def _children(f, box):
+    return {
+        child.type: child
+        for child in iter_boxes(f, box.offset + box.header_size, box.offset + box.size)
+    }
+
+
+def _find_path(f, box, path):
+    for box_type in path:
+        box = _children(f, box).get(box_type)
+        if box is None:
+            return None
+    return box
+
+
+def _require(boxes, box_type):
+    if box_type not in boxes:
+        raise RuntimeError("Missing '%s' box in GPMF track" % box_type)
+    return boxes[box_type]
+
+
+def _parse_table(data, dtype, ncols=1):
+    count, = struct.unpack(">I", data[4:8])
+    table = numpy.frombuffer(data, dtype=dtype, count=count * ncols, offset=8)
+    if ncols > 1:
+        table = table.reshape(count, ncols)
+    return table.astype("int64")
+
+
+def _parse_stsz(data):
+    sample_size, count = struct.unpack(">II", data[4:12])
+    if sample_size != 0:
+        return numpy.full(count, sample_size, dtype="int64")
+    return numpy.frombuffer(data, dtype=">u4", count=count, offset=12).astype("int64")
+
+
+def _parse_timescale(data):
+    version = data[0]
+    if version == 1:
+        return struct.unpack(">I", data[20:24])[0]
+    return struct.unpack(">I", data[12:16])[0]
+
+
+def _sample_offsets(chunk_offsets, sample_to_chunk, sizes):
+    n_chunks = len(chunk_offsets)
+    first_chunks = sample_to_chunk[:, 0] - 1
+    runs = numpy.diff(numpy.append(first_chunks, n_chunks))
+    samples_per_chunk = numpy.repeat(sample_to_chunk[:, 1], runs)
+    chunk_of_sample = numpy.repeat(numpy.arange(n_chunks), samples_per_chunk)[:len(sizes)]
+    sample_starts = numpy.cumsum(sizes) - sizes
+    first_sample_of_chunk = (numpy.cumsum(samples_per_chunk) - samples_per_chunk)[chunk_of_sample]
+    return chunk_offsets[chunk_of_sample] + sample_starts - sample_starts[first_sample_of_chunk]
+
+
+def _parse_track(f, trak):
+    stsd = _find_path(f, trak, ["mdia", "minf", "stbl", "stsd"])
+    if stsd is None:
+        return None
+
+    data = _read_payload(f, stsd)
+    if len(data) < 16 or data[12:16] != b"gpmd":
+        return None
+
+    tkhd = _children(f, trak).get("tkhd")
+    track_id = None
+    if tkhd is not None:
+        tkhd_data = _read_payload(f, tkhd)
+        track_id = struct.unpack(">I", tkhd_data[20:24] if tkhd_data[0] == 1 else tkhd_data[12:16])[0]
+
+    mdia = _require(_children(f, trak), "mdia")
+    timescale = _parse_timescale(_read_payload(f, _require(_children(f, mdia), "mdhd")))
+
+    stbl = _children(f, _find_path(f, mdia, ["minf", "stbl"]))
+    sizes = _parse_stsz(_read_payload(f, _require(stbl, "stsz")))
+    if "co64" in stbl:
+        chunk_offsets = _parse_table(_read_payload(f, stbl["co64"]), ">u8")
+    else:
+        chunk_offsets = _parse_table(_read_payload(f, _require(stbl, "stco")), ">u4")
+    sample_to_chunk = _parse_table(_read_payload(f, _require(stbl, "stsc")), ">u4", ncols=3)
+    time_to_sample = _parse_table(_read_payload(f, _require(stbl, "stts")), ">u4", ncols=2)
+
+    durations = numpy.repeat(time_to_sample[:, 1], time_to_sample[:, 0])[:len(sizes)]
+    times = numpy.cumsum(durations) - durations
+
+    return GPMFTrack(
+        track_id=track_id,
+        timescale=timescale,
+        offsets=_sample_offsets(chunk_offsets, sample_to_chunk, sizes),
+        sizes=sizes,
+        times=times / timescale,
+        durations=durations / timescale
+    )
+
+
+def find_gpmf_track(f):
+    """ Find the GPMF track in a MP4/MOV file and read its sample table.
+
+    Parameters
+    ----------
+    f: file object
+        A binary file object opened for reading.
+
+    Returns
+    -------
+    track: GPMFTrack
+        The track information: the byte offsets and sizes of every sample
+        along with their start times and durations in seconds.
+
+    Raises
+    ------
+    RuntimeError: If no GPMF track is found.
+    """
+    f.seek(0, 2)
+    file_size = f.tell()
+
+    for box in iter_boxes(f, 0, file_size):
+        if box.type != "moov":
+            continue
+        for trak in iter_boxes(f, box.offset + box.header_size, box.offset + box.size):
+            if trak.type != "trak":
+                continue
+            track = _parse_track(f, trak)
+            if track is not None:
+                return track
+
+    raise RuntimeError("Could not find GPS stream")
+
+
+def read_samples(f, track, start=0, stop=None):
+    """ Read the raw bytes of a range of samples of the GPMF track
+
+    Parameters
+    ----------
+    f: file object
+        A binary file object opened for reading.
+    track: GPMFTrack
+        The track information as returned by `find_gpmf_track`.
+    start: int, optional (default=0)
+        Index of the first sample to read.
+    stop: int, optional (default=None)
+        Index after the last sample to read. If None, read up to the last sample.
+
+    Returns
+    -------
+    gpmf_data: bytes
+        The concatenated payloads of the samples.
+    """
+    offsets = track.offsets[start:stop]
+    sizes = track.sizes[start:stop]
+
+    if len(offsets) == 0:
+        return b""
+
+    # Merge samples stored back to back so that they are read at once.
+    breaks = numpy.flatnonzero(offsets[1:] != offsets[:-1] + sizes[:-1]) + 1
+    run_starts = numpy.concatenate([[0], breaks])
+    run_ends = numpy.concatenate([breaks, [len(offsets)]])
+
+    chunks = []
+    for i, j in zip(run_starts, run_ends):
+        f.seek(int(offsets[i]))
+        chunks.append(f.read(int(offsets[j - 1] + sizes[j - 1] - offsets[i])))
+    return b"".join(chunks)
+
+
+def sample_range(track, start=None, end=None):
+    """ Find the samples of the GPMF track overlapping a time window
+
+    Parameters
+    ----------
+    track: GPMFTrack
+        The track information as returned by `find_gpmf_track`.
+    start: float, optional (default=None)
+        Start of the window in seconds from the start of the video.
+        If None, start at the first sample.
+    end: float, optional (default=None)
+        End of the window in seconds. If None, stop at the last sample.
+
+    Returns
+    -------
+    first: int
+        Index of the first sample overlapping the window.
+    stop: int
+        Index after the last sample overlapping the window.
+    """
+    first = 0 if start is None else int(numpy.searchsorted(track.times + track.durations, start, side="right"))
+    stop = len(track.times) if end is None else int(numpy.searchsorted(track.times, end, side="left"))
+    return first, max(first, stop)
+
+
+def slice_track(track, first, stop):
+    """ Restrict the track information to a range of samples
+
+    Parameters
+    ----------
+    track: GPMFTrack
+        The track information as returned by `find_gpmf_track`.
+    first: int
+        Index of the first sample.
+    stop: int
+        Index after the last sample.
+
+    Returns
+    -------
+    track: GPMFTrack
+        The information of the selected samples. The sample times are unchanged.
+    """
+    return GPMFTrack(
+        track_id=track.track_id,
+        timescale=track.timescale,
+        offsets=track.offsets[first:stop],
+        sizes=track.sizes[first:stop],
+        times=track.times[first:stop],
+        durations=track.durations[first:stop]
+    )
@@ -0,0 +1,236 @@
+""" Parallel decoding of a single GPMF stream
+
+The stream is split at the boundaries of its top-level items (DEVC) into
+chunks of similar sizes, which are decoded by a pool of processes. The stream
+is placed in shared memory, so that only the bounds of the chunks are sent to
+the workers, and the columnar results of the chunks are merged in order::
+
+    gps_data = gpmf.parallel.extract_gps(stream, jobs=8)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+
+from . import gps
+from . import mp4
+from . import parse
+from . import profiling
+from . import sensors as gpmf_sensors
+from .sensors import SENSORS, SensorData
+
+
+# Number of chunks per process, to balance the load between processes
+CHUNKS_PER_JOB = 4
+# Minimum size of the chunks in bytes, smaller streams are decoded in fewer chunks
+MIN_CHUNK_SIZE = 1 << 20
+
+# The shared memory holding the stream, in the worker processes
+_shared = None
+
+
+def split_stream(x, n_chunks, boundaries=None):
+    """ Split a stream into chunks of similar sizes made of complete top-level items
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The input stream
+    n_chunks: int
+        The maximum number of chunks.
+    boundaries: numpy.ndarray, optional (default=None)
+        The offsets where the stream may be split, in addition to being the
+        start of a top-level item.
+
+    Returns
+    -------
+    bounds: numpy.ndarray
+        The offsets of the start of the chunks followed by the end of the stream.
+        Each chunk holds at least two top-level items, so a stream which cannot
+        be split is returned as a single chunk.
+    """
+    items = parse._top_level_items(memoryview(x))
+    if items is None or len(items) < 4 or n_chunks < 2:
+        return numpy.array([0, len(x)], dtype="i8")
+    allowed = items if boundaries is None else items[numpy.isin(items, boundaries)]
+    if len(allowed) == 0:
+        return numpy.array([0, len(x)], dtype="i8")
+
+    # Cut at the allowed offsets following evenly spaced positions, keeping
+    # at least two items in each chunk.
+    targets = numpy.arange(1, n_chunks) * (len(x) / n_chunks)
+    cuts = numpy.unique(allowed[numpy.searchsorted(allowed, targets).clip(0, len(allowed) - 1)])
+    kept = [0]
+    previous = 0
+    for cut, position in zip(cuts.tolist(), numpy.searchsorted(items, cuts).tolist()):
+        if position - previous >= 2 and len(items) - position >= 2:
+            kept.append(cut)
+            previous = position
+    return numpy.array(kept + [len(x)], dtype="i8")
+
+
+def _attach(name):
+    global _shared
+    _shared = shared_memory.SharedMemory(name=name)
+
+
+def _run_chunk(function, start, end, args):
+    view = _shared.buf[start:end]
+    try:
+        return function(view, *args)
+    finally:
+        view.release()
+
+
+def map_chunks(function, x, chunks, jobs=None):
+    """ Apply a function to chunks of a stream in a pool of processes
+
+    Parameters
+    ----------
+    function: callable
+        A module level function called as `function(chunk, *args)` with
+        `chunk` a memoryview on the shared copy of the stream. Its result must
+        not reference the chunk.
+    x: bytes, memoryview or mmap.mmap
+        The input stream
+    chunks: list of tuple
+        The (start, end, args) of each chunk.
+    jobs: int, optional (default=None)
+        The number of processes. The number of CPUs if None.
+
+    Returns
+    -------
+    results: list
+        The results of the chunks, in order.
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(len(x), 1))
+    try:
+        memory.buf[:len(x)] = x
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_attach, initargs=(memory.name,)) as executor:
+            futures = [executor.submit(_run_chunk, function, start, end, args) for start, end, args in chunks]
+            return [future.result() for future in futures]
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def _n_chunks(x, jobs):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    return jobs, min(jobs * CHUNKS_PER_JOB, len(x) // MIN_CHUNK_SIZE) if jobs > 1 else 1
+
+
+def extract_gps(stream, jobs=None):
+    """Extract all the GPS data of a stream with a pool of processes.
+
+    Parameters
+    ----------
+    stream: bytes, memoryview or mmap.mmap
+        The raw GPMF binary stream
+    jobs: int, optional (default=None)
+        The number of processes. The number of CPUs if None.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    """
+    jobs, n_chunks = _n_chunks(stream, jobs)
+    bounds = split_stream(stream, n_chunks)
+    if len(bounds) <= 2:
+        return gps.extract_gps(stream)
+
+    with profiling.stage("extract_gps", bytes=len(stream)) as stage:
+        parts = map_chunks(gps._extract_gps_counted, stream,
+                           [(start, end, ()) for start, end in zip(bounds[:-1], bounds[1:])], jobs)
+        n_blocks = 0
+        for gps_data, chunk_blocks in parts:
+            gps_data["block_id"] += n_blocks
+            n_blocks += chunk_blocks
+        gps_data = numpy.concatenate([gps_data for gps_data, _ in parts])
+        stage.count(points=len(gps_data))
+    return gps_data
+
+
+def _extract_chunk_sensors(chunk, length, fourccs, track, origin):
+    # The chunk is followed by the first item of the next chunk, so that the
+    # duration of its last block is known as in the whole stream. Only the
+    # blocks starting before `length` are kept. The times are relative to
+    # `origin`, the first STMP of the whole stream.
+    index = parse.build_index(chunk)
+    sensors = {}
+    for fourcc in fourccs:
+        sensor_data = gpmf_sensors._extract_sensor(chunk, fourcc, track, index, origin)
+        items = parse.find_items(index, fourcc, parent="STRM")
+        n_blocks = int((index["offset"][items] < length).sum())
+        keep = sensor_data.block_id < n_blocks
+        sensors[fourcc] = (sensor_data._replace(
+            values=sensor_data.values[keep], time=sensor_data.time[keep], block_id=sensor_data.block_id[keep]
+        ), n_blocks)
+    return sensors
+
+
+def extract_sensors(stream, fourccs=SENSORS, track=None, jobs=None):
+    """Extract several sensor streams with a pool of processes.
+
+    The result is the one of `gpmf.sensors.extract_sensors`. When `track`
+    is given, the stream is only split between MP4 samples.
+
+    Parameters
+    ----------
+    stream: bytes, memoryview or mmap.mmap
+        The raw GPMF binary stream
+    fourccs: list of str, optional (default=SENSORS)
+        The FourCC codes of the sensors.
+    track: gpmf.mp4.GPMFTrack, optional (default=None)
+        The MP4 track the stream was read from.
+    jobs: int, optional (default=None)
+        The number of processes. The number of CPUs if None.
+
+    Returns
+    -------
+    sensors: dict
+        A dictionary mapping the FourCC codes of the sensors found in the stream
+        to `SensorData` objects.
+    """
+    jobs, n_chunks = _n_chunks(stream, jobs)
+    sample_starts = None if track is None else numpy.cumsum(track.sizes) - track.sizes
+    bounds = split_stream(stream, n_chunks, boundaries=sample_starts)
+    if len(bounds) <= 2:
+        return gpmf_sensors.extract_sensors(stream, fourccs=fourccs, track=track)
+
+    items = parse._top_level_items(memoryview(stream))
+    stmp = next(parse.filter_klv(stream, ["STMP"], lazy=True), None)
+    origin = 0. if stmp is None else float(stmp.value) * 1e-6
+    chunks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # Add the next top-level item
+        position = numpy.searchsorted(items, end)
+        lookahead = items[position + 1] if position + 1 < len(items) else len(stream)
+        chunk_track = None
+        if track is not None:
+            first, stop = numpy.searchsorted(sample_starts, [start, lookahead])
+            chunk_track = mp4.slice_track(track, first, stop)
+        chunks.append((start, lookahead, (end - start, fourccs, chunk_track, origin)))
+
+    with profiling.stage("extract_sensors", bytes=len(stream)) as stage:
+        parts = map_chunks(_extract_chunk_sensors, stream, chunks, jobs)
+        sensors = {}
+        for fourcc in fourccs:
+            n_blocks = [part[fourcc][1] for part in parts]
+            block_offsets = numpy.cumsum(n_blocks) - n_blocks
+            found = [(part[fourcc][0], offset) for part, offset in zip(parts, block_offsets)
+                     if len(part[fourcc][0].values) > 0]
+            if len(found) == 0:
+                continue
+            sensors[fourcc] = SensorData(
+                fourcc=fourcc,
+                description=next((p.description for p, _ in found if p.description is not None), None),
+                units=next((p.units for p, _ in found if p.units is not None), None),
+                values=numpy.concatenate([p.values for p, _ in found]),
+                time=numpy.concatenate([p.time for p, _ in found]),
+                block_id=numpy.concatenate([p.block_id + offset for p, offset in found])
+            )
+            stage.count(points=len(sensors[fourcc].values))
+    return sensors
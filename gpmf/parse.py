@@ -2,13 +2,32 @@ from collections import namedtuple
 import types
 import struct
 import logging
+import functools
 import numpy
 
+from . import profiling
+
 
 logger = logging.getLogger(__name__)
 
 KLVItem = namedtuple("KLVItem", ["key", "length", "value"])
 KLVLength = namedtuple("KLVLength", ["type", "size", "repeat"])
+KLV_HEADER = struct.Struct(">4scBH")
+
+# Number of bytes requested at once when reading a stream incrementally
+READ_SIZE = 65536
+# Minimum number of bytes of the groups of payloads parsed together
+BATCH_SIZE = 262144
+
+KLV_INDEX_DTYPE = numpy.dtype([
+    ("fourcc", "S4"),
+    ("type", "S1"),
+    ("size", "u1"),
+    ("repeat", "u2"),
+    ("offset", "i8"),
+    ("depth", "i2"),
+    ("parent", "i8")
+])
 
 
 def ceil4(x):
@@ -41,13 +60,79 @@ num_types = {
 }
 
 
-def parse_payload(x, fourcc, type_str, size, repeat):
+# Types of the fields of complex ("?") values, as described by `TYPE` items.
+# Fixed point numbers (q: Q15.16, Q: Q31.32) are left as integers.
+complex_types = {
+    "b": "i1",
+    "B": "u1",
+    "c": "S1",
+    "d": ">f8",
+    "f": ">f4",
+    "F": "S4",
+    "G": "V16",
+    "j": ">i8",
+    "J": ">u8",
+    "l": ">i4",
+    "L": ">u4",
+    "q": ">i4",
+    "Q": ">i8",
+    "s": ">i2",
+    "S": ">u2",
+    "U": "S16"
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_type(type_str):
+    """ Compile the description of a complex type into a structured dtype
+
+    Compiled types are cached, as the same `TYPE` is found in every block.
+
+    Parameters
+    ----------
+    type_str: str
+        The value of a `TYPE` item, e.g. "lllllllSS" for GPS9. Arrays are
+        written with their size in brackets, e.g. "f[4]".
+
+    Returns
+    -------
+    dtype: numpy.dtype
+        A structured dtype with one field (f0, f1, ...) per value of the type.
+
+    Raises
+    ------
+    ValueError: If the description is not supported.
+    """
+    fields = []
+    i = 0
+    while i < len(type_str):
+        char = type_str[i]
+        if char not in complex_types:
+            raise ValueError("Unsupported type in complex type %r: %r" % (type_str, char))
+        i += 1
+        count = None
+        if type_str.startswith("[", i):
+            end = type_str.index("]", i)
+            count = int(type_str[i + 1:end])
+            i = end + 1
+
+        name = "f%i" % len(fields)
+        if count is None:
+            fields.append((name, complex_types[char]))
+        elif char == "c":
+            fields.append((name, "S%i" % count))
+        else:
+            fields.append((name, complex_types[char], (count,)))
+    return numpy.dtype(fields)
+
+
+def parse_payload(x, fourcc, type_str, size, repeat, complex_type=None):
     """ Parse the payload
 
     Parameters
     ----------
-    x: byte
-        The byte array corresponding to the payload
+    x: memoryview
+        The buffer corresponding to the payload
     fourcc: str
         The fourcc code
     type_str: str
@@ -56,11 +141,16 @@ def parse_payload(x, fourcc, type_str, size, repeat):
         The size of the value
     repeat: int
         The number of times the value is repeated.
+    complex_type: str, optional (default=None)
+        For complex values ("?" type), the value of the `TYPE` item of the
+        enclosing stream.
 
     Returns
     -------
     payload: object
         The parsed payload. the actual type depends on the type_str and the size and repeat values.
+        Numeric arrays are views on the input buffer. Complex values are structured
+        arrays with one record per value.
     """
     if type_str == "\x00":
         return iter_klv(x)
@@ -71,7 +161,7 @@ def parse_payload(x, fourcc, type_str, size, repeat):
                 x = list(numpy.frombuffer(x, dtype="S%i" % size))
                 return [s.decode("latin1") for s in x]
             else:
-                return x.decode("latin1")
+                return str(x, "latin1")
 
         elif type_str in num_types:
             dtype, stype = num_types[type_str]
@@ -86,7 +176,7 @@ def parse_payload(x, fourcc, type_str, size, repeat):
                 a = a.reshape(repeat, dim1)
             return a
         elif type_str == "U":
-            x = x.decode()
+            x = str(x, "utf-8")
             year = "20" + x[:2]
             month = x[2:4]
             day = x[4:6]
@@ -94,65 +184,183 @@ def parse_payload(x, fourcc, type_str, size, repeat):
             mins = x[8:10]
             seconds = x[10:]
             return "%s-%s-%s %s:%s:%s" % (year, month, day, hours, mins, seconds)
+        elif type_str == "?" and complex_type is not None:
+            try:
+                dtype = compile_type(complex_type)
+            except ValueError:
+                return bytes(x)
+            if dtype.itemsize != size:
+                return bytes(x)
+            return numpy.frombuffer(x, dtype=dtype)
         else:
-            return x
+            return bytes(x)
 
 
-def iter_klv(x):
+class LazyKLVItem(object):
+    """KLV item whose payload is only decoded when `value` is first accessed.
+
+    The decoded value is cached. Like `KLVItem`, it can be unpacked into
+    (key, length, value).
+
+    Parameters
+    ----------
+    key: str
+        The fourcc code
+    length: KLVLength
+        The (type, size, repeat) information
+    payload: memoryview
+        The raw payload, padding included.
+    complex_type: str, optional (default=None)
+        For complex values, the `TYPE` of the enclosing stream.
+    """
+    __slots__ = ("key", "length", "payload", "complex_type", "_value")
+
+    def __init__(self, key, length, payload, complex_type=None):
+        self.key = key
+        self.length = length
+        self.payload = payload
+        self.complex_type = complex_type
+        self._value = _NOT_DECODED
+
+    @property
+    def value(self):
+        if self._value is _NOT_DECODED:
+            self._value = parse_payload(self.payload, self.key, *self.length, complex_type=self.complex_type)
+            if profiling.is_active() and self.length.type != "\x00":
+                profiling.record("decode_payload", items_decoded=1)
+        return self._value
+
+    def __iter__(self):
+        return iter((self.key, self.length, self.value))
+
+    def to_klv_item(self):
+        """Convert to a `KLVItem`, decoding the payload if needed."""
+        return KLVItem(self.key, self.length, self.value)
+
+    def __repr__(self):
+        return "LazyKLVItem(key=%r, length=%r)" % (self.key, self.length)
+
+
+_NOT_DECODED = object()
+
+
+def iter_klv(x, lazy=False):
     """ Iterate on KLV items.
 
+    The input is wrapped into a `memoryview` so that nested containers and
+    numeric payloads are views on the same buffer rather than copies.
+
     Parameters
     ----------
-    x: byte
-        The byte array corresponding to the stream.
+    x: bytes, memoryview or mmap.mmap
+        The buffer corresponding to the stream.
+    lazy: bool, optional (default=False)
+        If True, yield `LazyKLVItem` objects whose payload is decoded on demand.
 
     Returns
     -------
     klv_gen: generator
         A generator of (fourcc, (type_str, size, repeat), payload) tuples.
     """
+    if not profiling.is_active():
+        return _iter_klv(x, lazy)
+    counters = dict.fromkeys(["bytes", "items_visited", "items_decoded"], 0)
+    return profiling.timed_iter("iter_klv", _iter_klv(x, lazy, counters), counters)
+
+
+def _iter_klv(x, lazy=False, counters=None):
+    x = memoryview(x)
     start = 0
+    end = len(x)
+    # The TYPE item describing the complex values of the container
+    complex_type = None
 
-    while start < len(x):
-        head = struct.unpack(">cccccBH", x[start: start + 8])
-        fourcc = (b"".join(head[:4])).decode()
-        type_str, size, repeat = head[4:]
+    while start < end:
+        fourcc, type_str, size, repeat = KLV_HEADER.unpack_from(x, start)
+        fourcc = fourcc.decode()
         type_str = type_str.decode()
         start += 8
         payload_size = ceil4(size * repeat)
-        payload = parse_payload(x[start: start + payload_size], fourcc, type_str, size, repeat)
+        payload = x[start: start + payload_size]
         start += payload_size
 
-        yield KLVItem(fourcc, KLVLength(type_str, size, repeat), payload)
+        if counters is not None:
+            _count_item(counters, type_str, payload_size, decoded=not lazy)
+        if fourcc == "TYPE":
+            complex_type = _type_string(payload[:size * repeat])
+
+        if lazy:
+            yield LazyKLVItem(fourcc, KLVLength(type_str, size, repeat), payload, complex_type)
+        else:
+            yield KLVItem(fourcc, KLVLength(type_str, size, repeat),
+                          parse_payload(payload, fourcc, type_str, size, repeat, complex_type))
+
+
+def _type_string(x):
+    return str(x, "latin1").rstrip("\x00")
+
+
+def _count_item(counters, type_str, payload_size, decoded):
+    # Containers are only counted for their header, their content being
+    # counted when it is iterated.
+    is_container = type_str == "\x00"
+    counters["items_visited"] += 1
+    counters["bytes"] += 8 if is_container else 8 + payload_size
+    if decoded and not is_container:
+        counters["items_decoded"] += 1
 
 
-def filter_klv(x, filter_fourcc):
+def filter_klv(x, filter_fourcc, lazy=False):
     """Filter only KLV items with chosen fourcc code.
 
+    The payloads of the items which are not selected are never decoded.
+
     Parameters
     ----------
-    x: byte
+    x: bytes, memoryview or mmap.mmap
         The input stream
     filter_fourcc: list of str
         A list of FourCC codes
+    lazy: bool, optional (default=False)
+        If True, yield `LazyKLVItem` objects.
 
     Returns
     -------
     klv_gen: generator
         De-nested generator of (fourcc, (type_str, size, repeat), payload) with only chosen fourcc
     """
-    generators = [iter(iter_klv(x))]
+    if not profiling.is_active():
+        return _filter_klv(x, filter_fourcc, lazy)
+    counters = dict.fromkeys(["bytes", "items_visited"], 0)
+    return profiling.timed_iter("filter_klv", _filter_klv(x, filter_fourcc, lazy, counters), counters)
+
+
+def _filter_klv(x, filter_fourcc, lazy=False, counters=None):
+    generators = [_iter_klv(x, lazy=True, counters=counters)]
 
     while len(generators) > 0:
-        it = generators[-1]
         try:
-            (fourcc, (type_str, size, repeat), payload) = next(it)
-            if fourcc in filter_fourcc:
-                yield KLVItem(fourcc, KLVLength(type_str, size, repeat), payload)
-            if type_str == "\x00":
-                generators.append(iter(payload))
+            item = next(generators[-1])
         except StopIteration:
-            generators = generators[:-1]
+            generators.pop()
+            continue
+
+        children = None
+        if item.length.type == "\x00":
+            children = _iter_klv(item.payload, lazy=True, counters=counters)
+
+        if item.key in filter_fourcc:
+            if lazy:
+                yield item
+            elif children is not None:
+                # The yielded generator and the one we descend into share
+                # the same underlying iterator, as with `iter_klv`.
+                yield KLVItem(item.key, item.length, (child.to_klv_item() for child in children))
+            else:
+                yield item.to_klv_item()
+
+        if children is not None:
+            generators.append(children)
 
 
 def _expand_klv(x):
@@ -180,3 +388,558 @@ def expand_klv(x):
 
     """
     return _expand_klv(iter_klv(x))
+
+
+def read_klv_stream(f, read_size=READ_SIZE):
+    """Read the top-level KLV items (DEVC) of a stream incrementally.
+
+    The stream is read by chunks, and each item is yielded as soon as all its
+    bytes have been read, items spanning several chunks being carried over.
+    Only one item and one chunk are held in memory at a time, so this can
+    parse the output of ffmpeg while it is running, or the standard input.
+
+    Parameters
+    ----------
+    f: file-like object
+        A binary file or pipe, e.g. `sys.stdin.buffer`. `read1` is used when
+        available, so that items are not delayed until a whole chunk is read.
+    read_size: int, optional (default=READ_SIZE)
+        The maximum number of bytes read at once.
+
+    Returns
+    -------
+    payloads: generator
+        A generator of bytes, each holding one complete top-level item.
+    """
+    read = getattr(f, "read1", f.read)
+    buffer = bytearray()
+    while True:
+        chunk = read(read_size)
+        if not chunk:
+            break
+        buffer += chunk
+
+        start = 0
+        while len(buffer) - start >= 8:
+            _, _, size, repeat = KLV_HEADER.unpack_from(buffer, start)
+            end = start + 8 + ceil4(size * repeat)
+            if end > len(buffer):
+                break
+            yield bytes(buffer[start: end])
+            start = end
+        del buffer[:start]
+
+    if buffer:
+        logger.warning("Truncated stream: the last %i bytes are ignored.", len(buffer))
+
+
+def group_payloads(payloads, batch_size=BATCH_SIZE):
+    """Join consecutive payloads into groups of at least `batch_size` bytes.
+
+    Parsing a few large buffers is much faster than parsing many small ones,
+    while the memory used stays bounded by the size of a group.
+
+    Parameters
+    ----------
+    payloads: iterable of bytes
+        Buffers holding complete top-level items, e.g. from `read_klv_stream`.
+    batch_size: int, optional (default=BATCH_SIZE)
+        The number of bytes from which a group is yielded.
+
+    Returns
+    -------
+    groups: generator
+        A generator of bytes.
+    """
+    group = []
+    group_size = 0
+    for payload in payloads:
+        group.append(payload)
+        group_size += len(payload)
+        if group_size >= batch_size:
+            yield b"".join(group)
+            group = []
+            group_size = 0
+    if group:
+        yield b"".join(group)
+
+
+def build_index(x):
+    """Build a flat index of all the KLV items of a stream.
+
+    Only the 8 bytes headers are read, no payload is decoded.
+
+    The top level containers (DEVC) of a stream mostly share the same layout.
+    The layouts are learnt from the first blocks having them and the index of
+    the blocks matching a layout, checked by comparing all their item headers
+    at once, is derived from the one of the first block. The other blocks are
+    walked item by item.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The input stream
+
+    Returns
+    -------
+    index: numpy.ndarray
+        A structured array with dtype `KLV_INDEX_DTYPE` with one entry per KLV item
+        in stream order. `offset` is the position of the item header in the stream,
+        `depth` its nesting level and `parent` the index of the enclosing container
+        (-1 for top level items).
+    """
+    with profiling.stage("build_index", bytes=len(x)) as stage:
+        index = _build_index_by_layout(x)
+        if index is None:
+            index = _build_index(x)
+        stage.count(items_visited=len(index))
+    return index
+
+
+def _build_index(x):
+    x = memoryview(x)
+    records = []
+    containers = []
+    start = 0
+    end = len(x)
+
+    while start < end:
+        while containers and start >= containers[-1][0]:
+            containers.pop()
+        fourcc, type_str, size, repeat = KLV_HEADER.unpack_from(x, start)
+        parent = containers[-1][1] if containers else -1
+        records.append((fourcc, type_str, size, repeat, start, len(containers), parent))
+        payload_size = ceil4(size * repeat)
+        if type_str == b"\x00":
+            containers.append((start + 8 + payload_size, len(records) - 1))
+            start += 8
+        else:
+            start += 8 + payload_size
+
+    return numpy.array(records, dtype=KLV_INDEX_DTYPE)
+
+
+# Maximum number of block layouts learnt from a stream. The blocks matching
+# none of them are walked item by item.
+MAX_LAYOUTS = 64
+# Number of blocks whose headers are compared at once
+MATCH_CHUNK_SIZE = 1024
+
+
+def _top_level_items(x):
+    offsets = []
+    start = 0
+    end = len(x)
+    while start < end:
+        _, _, size, repeat = KLV_HEADER.unpack_from(x, start)
+        offsets.append(start)
+        start += 8 + ceil4(size * repeat)
+    if start != end:
+        return None
+    return numpy.array(offsets, dtype="i8")
+
+
+def _match_headers(buffer, offsets, columns, header_bytes):
+    matches = [
+        (buffer[offsets[i:i + MATCH_CHUNK_SIZE, None] + columns] == header_bytes).all(axis=1)
+        for i in range(0, len(offsets), MATCH_CHUNK_SIZE)
+    ]
+    return numpy.concatenate(matches) if matches else numpy.zeros(0, dtype=bool)
+
+
+def _build_index_by_layout(x):
+    # Returns None when the stream cannot be split into blocks, the generic
+    # walk then gives the same result as for malformed streams before.
+    x = memoryview(x)
+    try:
+        offsets = _top_level_items(x)
+    except struct.error:
+        return None
+    if offsets is None or len(offsets) < 2:
+        return None
+
+    ends = numpy.append(offsets[1:], len(x))
+    sizes = ends - offsets
+    buffer = numpy.frombuffer(x, dtype="u1")
+
+    templates = []
+    layout_id = numpy.full(len(offsets), -1, dtype="i8")
+    remaining = numpy.arange(len(offsets))
+    while len(remaining) > 0:
+        first = remaining[0]
+        try:
+            template = _build_index(x[offsets[first]:ends[first]])
+        except struct.error:
+            return None
+        if (payload_end(template) > sizes[first]).any():
+            return None
+
+        if len(templates) < MAX_LAYOUTS:
+            candidates = remaining[sizes[remaining] == sizes[first]]
+            columns = (template["offset"][:, None] + numpy.arange(8)).ravel()
+            header_bytes = buffer[offsets[first] + columns]
+            matched = candidates[_match_headers(buffer, offsets[candidates], columns, header_bytes)]
+        else:
+            matched = remaining[:1]
+
+        layout_id[matched] = len(templates)
+        templates.append(template)
+        remaining = remaining[layout_id[remaining] < 0]
+
+    counts = numpy.array([len(template) for template in templates])[layout_id]
+    bases = numpy.cumsum(counts) - counts
+    index = numpy.empty(counts.sum(), dtype=KLV_INDEX_DTYPE)
+    for i, template in enumerate(templates):
+        blocks = numpy.flatnonzero(layout_id == i)
+        n_items = len(template)
+        entries = numpy.tile(template, len(blocks))
+        entries["offset"] += numpy.repeat(offsets[blocks], n_items)
+        has_parent = entries["parent"] >= 0
+        entries["parent"][has_parent] += numpy.repeat(bases[blocks], n_items)[has_parent]
+        index[(bases[blocks][:, None] + numpy.arange(n_items)).ravel()] = entries
+    return index
+
+
+def payload_end(index):
+    """Compute the end offsets of the payloads of indexed items.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        An index, or a subset of an index, built by `build_index`.
+
+    Returns
+    -------
+    end: numpy.ndarray
+        The stream positions right after each item payload (padding included).
+    """
+    payload_size = index["size"].astype("i8") * index["repeat"]
+    return index["offset"] + 8 + (((payload_size + 3) >> 2) << 2)
+
+
+def find_items(index, fourcc, parent=None):
+    """Find the items with a given fourcc code.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        An index built by `build_index`.
+    fourcc: str
+        The FourCC code of the items.
+    parent: str, optional (default=None)
+        If given, keep only the items directly contained in a container
+        with this FourCC code.
+
+    Returns
+    -------
+    positions: numpy.ndarray
+        The positions of the matching items in the index.
+    """
+    mask = index["fourcc"] == fourcc.encode()
+    if parent is not None:
+        parents = index["parent"]
+        mask &= (parents >= 0) & (index["fourcc"][parents] == parent.encode())
+    return numpy.flatnonzero(mask)
+
+
+def items_between(index, start, end):
+    """Find the items whose header lies in a range of the stream.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        An index built by `build_index`.
+    start: int
+        Start position in the stream.
+    end: int
+        End position (excluded) in the stream.
+
+    Returns
+    -------
+    positions: numpy.ndarray
+        The positions of the matching items in the index.
+    """
+    lo, hi = numpy.searchsorted(index["offset"], [start, end])
+    return numpy.arange(lo, hi)
+
+
+def child_items(index, i):
+    """Find the items directly contained in a container.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        An index built by `build_index`.
+    i: int
+        The position of the container in the index.
+
+    Returns
+    -------
+    positions: numpy.ndarray
+        The positions of the children in the index.
+    """
+    positions = items_between(index, index["offset"][i] + 8, payload_end(index[i:i + 1])[0])
+    return positions[index["parent"][positions] == i]
+
+
+def decode_item(x, index, i):
+    """Decode an indexed item.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    i: int
+        The position of the item in the index.
+
+    Returns
+    -------
+    klv_item: KLVItem
+        The decoded item, the same as the one produced by `iter_klv`.
+    """
+    fourcc, type_str, size, repeat, offset = index[["fourcc", "type", "size", "repeat", "offset"]][i]
+    fourcc = fourcc.decode()
+    # numpy strips the trailing null bytes of "S" fields, container types come back empty
+    type_str = type_str.decode() or "\x00"
+    size = int(size)
+    repeat = int(repeat)
+    start = int(offset) + 8
+    payload = memoryview(x)[start: start + ceil4(size * repeat)]
+    complex_type = _lookup_type(x, index, i) if type_str == "?" else None
+    if profiling.is_active():
+        profiling.record("decode_item", items_decoded=1)
+    return KLVItem(fourcc, KLVLength(type_str, size, repeat),
+                   parse_payload(payload, fourcc, type_str, size, repeat, complex_type))
+
+
+def _lookup_type(x, index, i):
+    # The last TYPE item preceding an item in its container
+    types = find_items(index, "TYPE")
+    types = types[(index["parent"][types] == index["parent"][i]) & (types < i)]
+    if len(types) == 0:
+        return None
+    item = index[types[-1]]
+    start = int(item["offset"]) + 8
+    return _type_string(memoryview(x)[start: start + int(item["size"]) * int(item["repeat"])])
+
+
+def lookup_type(x, index, parents):
+    """Find the complex type (`TYPE`) shared by containers.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    parents: numpy.ndarray
+        Sorted positions of containers (STRM) in the index.
+
+    Returns
+    -------
+    dtype: numpy.dtype
+        The structured dtype of the complex values of the containers, see `compile_type`.
+
+    Raises
+    ------
+    ValueError: If a container has no `TYPE` or if the types differ.
+    """
+    positions = lookup_children(index, parents, "TYPE")
+    if (positions < 0).any():
+        raise ValueError("Complex values without TYPE")
+    types = numpy.unique(read_payloads(x, index, positions), axis=0)
+    if len(types) > 1:
+        raise ValueError("Complex values of different types")
+    return compile_type(_type_string(types[0].tobytes()))
+
+
+def lookup_children(index, parents, fourcc):
+    """Find, for each container, its first child with a given fourcc code.
+
+    The index does not need to be sorted by offset, as when it is filtered or
+    concatenated: the first child of a container is the first one in the
+    order of the index.
+
+    Parameters
+    ----------
+    index: numpy.ndarray
+        An index built by `build_index`.
+    parents: numpy.ndarray
+        Positions of containers in the index.
+    fourcc: str
+        The FourCC code of the children.
+
+    Returns
+    -------
+    positions: numpy.ndarray
+        The positions of the children in the index, aligned with `parents`.
+        -1 when a container has no such child.
+    """
+    parents = numpy.asarray(parents)
+    candidates = find_items(index, fourcc)
+    candidate_parents = index["parent"][candidates]
+    positions = numpy.full(len(parents), -1, dtype="i8")
+    if len(candidates) == 0:
+        return positions
+    order = numpy.argsort(candidate_parents, kind="stable")
+    candidates = candidates[order]
+    candidate_parents = candidate_parents[order]
+    i = numpy.minimum(numpy.searchsorted(candidate_parents, parents), len(candidates) - 1)
+    found = candidate_parents[i] == parents
+    positions[found] = candidates[i[found]]
+    return positions
+
+
+def concat_payloads(x, index, positions, dtype=None):
+    """Concatenate the numeric payloads of indexed items into one array.
+
+    All the items must share the same type and size, as is the case for
+    the successive samples of a sensor stream.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    positions: numpy.ndarray
+        The positions of the items in the index.
+    dtype: numpy.dtype, optional (default=None)
+        For complex ("?") items, the structured dtype of their values, as
+        returned by `lookup_type`.
+
+    Returns
+    -------
+    values: numpy.ndarray
+        A (n_samples, dim) array with the values of all the items, in big-endian byte order.
+        For complex items, a structured array with one record per sample.
+    counts: numpy.ndarray
+        The number of samples (repeat) of each item.
+    """
+    x = memoryview(x)
+    items = index[positions]
+    counts = items["repeat"].astype("i8")
+
+    if len(items) == 0:
+        return numpy.zeros((0, 0)), counts
+
+    type_str = items["type"][0].decode()
+    size = int(items["size"][0])
+    if (items["type"] != items["type"][0]).any() or (items["size"] != size).any():
+        raise ValueError("Payloads of different types or sizes cannot be concatenated")
+    if dtype is not None:
+        if type_str != "?" or dtype.itemsize != size:
+            raise ValueError("Payloads do not match the complex type")
+    elif type_str not in num_types:
+        raise ValueError("Unsupported type for concatenation: %r" % type_str)
+
+    starts = items["offset"] + 8
+    data = b"".join([x[start: start + size * count] for start, count in zip(starts.tolist(), counts.tolist())])
+    if dtype is not None:
+        return numpy.frombuffer(data, dtype=dtype), counts
+
+    dtype = numpy.dtype(">" + num_types[type_str][1])
+    values = numpy.frombuffer(data, dtype=dtype).reshape(-1, size // dtype.itemsize)
+    return values, counts
+
+
+def read_payloads(x, index, positions):
+    """Read the raw payloads of indexed items of the same size at once.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    positions: numpy.ndarray
+        The positions of the items in the index.
+
+    Returns
+    -------
+    payloads: numpy.ndarray
+        A (n_items, size * repeat) array of bytes, padding excluded.
+
+    Raises
+    ------
+    ValueError: If the payloads do not have the same size.
+    """
+    items = index[positions]
+    nbytes = items["size"].astype("i8") * items["repeat"]
+    if len(items) == 0:
+        return numpy.zeros((0, 0), dtype="u1")
+    if (nbytes != nbytes[0]).any():
+        raise ValueError("Payloads of different sizes cannot be read at once")
+    buffer = numpy.frombuffer(memoryview(x), dtype="u1")
+    return buffer[(items["offset"] + 8)[:, None] + numpy.arange(nbytes[0])]
+
+
+def stack_payloads(x, index, positions):
+    """Read the numeric payloads of indexed items with the same layout at once.
+
+    This is a fixed-stride read of items sharing the same type, size and
+    repeat, like the `SCAL` items of the successive blocks of a stream.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    positions: numpy.ndarray
+        The positions of the items in the index.
+
+    Returns
+    -------
+    values: numpy.ndarray
+        A (n_items, n_values) array with the values of each item, in big-endian byte order.
+
+    Raises
+    ------
+    ValueError: If the items do not share the same numeric type, size and repeat.
+    """
+    items = index[positions]
+    if len(items) == 0:
+        return numpy.zeros((0, 0))
+    type_str = items["type"][0].decode()
+    if (items["type"] != items["type"][0]).any() or (items["repeat"] != items["repeat"][0]).any():
+        raise ValueError("Payloads of different types or sizes cannot be stacked")
+    if type_str not in num_types:
+        raise ValueError("Unsupported type for stacking: %r" % type_str)
+    return read_payloads(x, index, positions).view(">" + num_types[type_str][1])
+
+
+def lookup_scales(x, index, parents, dim):
+    """Find the scale (`SCAL`) of the values of each container.
+
+    Parameters
+    ----------
+    x: bytes, memoryview or mmap.mmap
+        The stream the index was built from.
+    index: numpy.ndarray
+        An index built by `build_index`.
+    parents: numpy.ndarray
+        Sorted positions of containers (STRM) in the index.
+    dim: int
+        The number of values of a sample.
+
+    Returns
+    -------
+    scales: numpy.ndarray
+        A (n_parents, dim) array of scales, 1 when a container has no `SCAL` item.
+    """
+    positions = lookup_children(index, parents, "SCAL")
+    if len(positions) > 0 and (positions >= 0).all():
+        try:
+            scales = stack_payloads(x, index, positions)
+        except ValueError:
+            scales = None
+        if scales is not None and scales.shape[1] in (1, dim):
+            return numpy.array(numpy.broadcast_to(scales, (len(positions), dim)), dtype="f8")
+
+    return numpy.array([
+        numpy.broadcast_to(1 if i < 0 else decode_item(x, index, i).value, (dim,))
+        for i in positions.tolist()
+    ], dtype="f8").reshape(-1, dim)
@@ -0,0 +1,185 @@
+""" Instrumentation of the extraction, parsing and export stages
+
+Statistics are only collected inside a `Profile` context::
+
+    with gpmf.profiling.Profile() as profile:
+        gps_data = gpmf.gps.extract_gps_from_file("GH010215.MP4")
+    print(profile.to_json())
+
+Outside of it, instrumented functions only check whether a profile is active.
+Stage times are inclusive: the time of a stage includes the time of the
+stages it calls. The time of generators (`iter_klv`, `filter_klv`, ...) only
+counts the time spent producing their items.
+"""
+import json
+import time
+
+
+COUNTERS = ("bytes", "items_visited", "items_decoded", "points")
+
+# Stack of the active profiles
+_profiles = []
+
+
+class Profile(object):
+    """ Collect per stage statistics of the instrumented functions
+
+    Parameters
+    ----------
+    callback: callable, optional (default=None)
+        A function called as `callback(stage, seconds, counters)` each time a
+        stage completes, with `counters` a dict of the counters of `COUNTERS`
+        recorded by the stage.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}
+        self.wall_time = 0.
+        self._start = None
+
+    def __enter__(self):
+        _profiles.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time += time.perf_counter() - self._start
+        _profiles.remove(self)
+
+    def record(self, stage, seconds, counters):
+        """ Add the statistics of a completed stage """
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = dict(calls=0, seconds=0., **dict.fromkeys(COUNTERS, 0))
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        for name, value in counters.items():
+            stats[name] += value
+        if self.callback is not None:
+            self.callback(stage, seconds, counters)
+
+    def report(self):
+        """ Get the statistics as a dict
+
+        Returns
+        -------
+        report: dict
+            The `wall_time` of the profile context and the `stages` statistics:
+            number of `calls`, `seconds`, and the counters of `COUNTERS`.
+        """
+        return {
+            "wall_time": self.wall_time,
+            "stages": {name: dict(stats) for name, stats in sorted(self.stages.items())}
+        }
+
+    def to_json(self, **kwargs):
+        """ Format the report as JSON """
+        return json.dumps(self.report(), **kwargs)
+
+
+def is_active():
+    """ Check whether statistics are being collected """
+    return len(_profiles) > 0
+
+
+def record(stage, seconds=0., **counters):
+    """ Record a completed stage in the active profiles """
+    for profile in _profiles:
+        profile.record(stage, seconds, counters)
+
+
+class _Stage(object):
+    __slots__ = ("name", "counters", "profiles", "start")
+
+    def __init__(self, name, counters):
+        self.name = name
+        self.counters = counters
+        self.profiles = list(_profiles)
+
+    def count(self, **counters):
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        for profile in self.profiles:
+            profile.record(self.name, seconds, self.counters)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def count(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, **counters):
+    """ Time a block of code as a stage
+
+    Parameters
+    ----------
+    name: str
+        The name of the stage.
+    **counters: int
+        Initial values of the counters. More can be added with the `count`
+        method of the returned object.
+
+    Returns
+    -------
+    stage: context manager
+        A no-op object when no profile is active.
+    """
+    if not _profiles:
+        return _NULL_STAGE
+    return _Stage(name, counters)
+
+
+def timed_iter(name, iterator, counters=None):
+    """ Time the production of the items of an iterator as a stage
+
+    The stage is recorded when the iterator is exhausted or closed.
+
+    Parameters
+    ----------
+    name: str
+        The name of the stage.
+    iterator: iterator
+        The instrumented iterator.
+    counters: dict, optional (default=None)
+        Counters updated by the iterator while it runs.
+
+    Returns
+    -------
+    generator: generator
+        A generator yielding the items of `iterator`.
+    """
+    profiles = list(_profiles)
+    counters = {} if counters is None else counters
+    seconds = 0.
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds += time.perf_counter() - start
+                return
+            seconds += time.perf_counter() - start
+            yield item
+    finally:
+        for profile in profiles:
+            profile.record(name, seconds, counters)
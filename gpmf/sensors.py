@@ -0,0 +1,158 @@
+from collections import namedtuple
+
+import numpy
+from . import parse
+from . import profiling
+
+
+SensorData = namedtuple("SensorData",
+                        [
+                            "fourcc",
+                            "description",
+                            "units",
+                            "values",
+                            "time",
+                            "block_id"
+                        ])
+
+SENSORS = ["ACCL", "GYRO", "MAGN", "GRAV", "CORI", "IORI"]
+
+
+def _first_value(stream, index, positions):
+    positions = positions[positions >= 0]
+    if len(positions) == 0:
+        return None
+    return parse.decode_item(stream, index, positions[0]).value
+
+
+def _stmp_origin(stream, index):
+    # The first STMP of the stream in seconds, the origin of the sample times
+    items = parse.find_items(index, "STMP", parent="STRM")
+    if len(items) == 0:
+        return 0.
+    return float(parse.decode_item(stream, index, items[0]).value) * 1e-6
+
+
+def _block_bounds(stream, index, strms, counts, track, origin):
+    if track is not None:
+        sample_starts = numpy.cumsum(track.sizes) - track.sizes
+        payload = numpy.searchsorted(sample_starts, index["offset"][strms], side="right") - 1
+        starts = track.times[payload]
+        return starts, starts + track.durations[payload]
+
+    stmp = parse.lookup_children(index, strms, "STMP")
+    if len(strms) > 1 and (stmp >= 0).all():
+        starts = parse.concat_payloads(stream, index, stmp)[0][:, 0] * 1e-6 - origin
+        durations = numpy.diff(starts)
+        # The last block is assumed to have the average rate of the previous
+        # ones, given by the total sample counts (TSMP) when available, or
+        # else the rate of the block before it.
+        tsmp = parse.lookup_children(index, strms, "TSMP")
+        if (tsmp >= 0).all():
+            totals = parse.concat_payloads(stream, index, tsmp)[0][:, 0].astype("f8")
+            last = (starts[-1] - starts[0]) * counts[-1] / (totals[-2] - totals[0] + counts[0])
+        else:
+            last = durations[-1] * counts[-1] / counts[-2]
+        return starts, starts + numpy.append(durations, last)
+
+    # Without timing information, payloads are assumed to last one second.
+    starts = numpy.arange(len(strms), dtype="f8")
+    return starts, starts + 1.
+
+
+def extract_sensor(stream, fourcc, track=None, index=None):
+    """Extract all the samples of a sensor stream into a single array.
+
+    The payloads of all the STRM containers holding `fourcc` are concatenated,
+    scaled by their `SCAL` values and timestamped at once.
+
+    The samples of a block are spread evenly over the time span of the block.
+    This time span is given by the MP4 sample holding the block when `track`
+    is given, the times being then relative to the start of the video.
+    Otherwise, it is given by the `STMP` timestamps of consecutive blocks,
+    the times being relative to the first `STMP` of the stream, and the
+    span of the last block by the sample rate computed from the `TSMP`
+    sample counts.
+
+    Parameters
+    ----------
+    stream: bytes
+        The raw GPMF binary stream
+    fourcc: str
+        The FourCC code of the sensor, e.g. "ACCL" or "GYRO".
+    track: gpmf.mp4.GPMFTrack, optional (default=None)
+        The MP4 track the stream was read from, as returned by
+        `gpmf.io.extract_gpmf_stream_with_track`.
+    index: numpy.ndarray, optional (default=None)
+        The index of the stream as returned by `gpmf.parse.build_index`.
+        Pass it to avoid scanning the stream again when extracting several sensors.
+
+    Returns
+    -------
+    sensor_data: SensorData
+        The sensor data. `values` is a (n_samples, n_axes) array, `time` gives the
+        time of each sample in seconds and `block_id` the block it comes from.
+    """
+    if index is None:
+        index = parse.build_index(stream)
+    return _extract_sensor(stream, fourcc, track, index, _stmp_origin(stream, index))
+
+
+def _extract_sensor(stream, fourcc, track, index, origin):
+    items = parse.find_items(index, fourcc, parent="STRM")
+    strms = index["parent"][items]
+    values, counts = parse.concat_payloads(stream, index, items)
+
+    if len(values) == 0:
+        return SensorData(fourcc, None, None, numpy.zeros((0, 0)), numpy.zeros(0), numpy.zeros(0, dtype="i8"))
+
+    block_id = numpy.repeat(numpy.arange(len(items)), counts)
+    sample_id = numpy.arange(len(values)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+    scales = parse.lookup_scales(stream, index, strms, values.shape[1])
+
+    starts, ends = _block_bounds(stream, index, strms, counts, track, origin)
+    time = starts[block_id] + sample_id * ((ends - starts) / counts)[block_id]
+
+    units = _first_value(stream, index, parse.lookup_children(index, strms, "SIUN"))
+    if units is None:
+        units = _first_value(stream, index, parse.lookup_children(index, strms, "UNIT"))
+
+    return SensorData(
+        fourcc=fourcc,
+        description=_first_value(stream, index, parse.lookup_children(index, strms, "STNM")),
+        units=units,
+        values=values / scales[block_id],
+        time=time,
+        block_id=block_id
+    )
+
+
+def extract_sensors(stream, fourccs=SENSORS, track=None):
+    """Extract several sensor streams.
+
+    Parameters
+    ----------
+    stream: bytes
+        The raw GPMF binary stream
+    fourccs: list of str, optional (default=SENSORS)
+        The FourCC codes of the sensors.
+    track: gpmf.mp4.GPMFTrack, optional (default=None)
+        The MP4 track the stream was read from.
+
+    Returns
+    -------
+    sensors: dict
+        A dictionary mapping the FourCC codes of the sensors found in the stream
+        to `SensorData` objects.
+    """
+    with profiling.stage("extract_sensors", bytes=len(stream)) as stage:
+        index = parse.build_index(stream)
+        origin = _stmp_origin(stream, index)
+        sensors = {}
+        for fourcc in fourccs:
+            sensor_data = _extract_sensor(stream, fourcc, track, index, origin)
+            if len(sensor_data.values) > 0:
+                sensors[fourcc] = sensor_data
+                stage.count(points=len(sensor_data.values))
+    return sensors
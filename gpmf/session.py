@@ -0,0 +1,257 @@
+import os
+import re
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from . import mp4
+from .gps import GPS_DTYPE, _is_utc, extract_gps_from_file, extract_gps_window
+from .io import extract_gpmf_stream_with_track
+from .sensors import SENSORS, SensorData, extract_sensors
+
+
+# GoPro file names: GOPRxxxx (first chapter) then GP01xxxx, GP02xxxx, ... for the
+# HERO5 and older, GH01xxxx, GH02xxxx, ... (AVC) or GX01xxxx, ... (HEVC) for newer
+# cameras, where xxxx is the recording number.
+CHAPTER_PATTERN = re.compile(r"^(GH|GX|GP)(\d\d)(\d{4})$", re.IGNORECASE)
+FIRST_CHAPTER_PATTERN = re.compile(r"^GOPR(\d{4})$", re.IGNORECASE)
+
+
+Session = namedtuple("Session", ["name", "files"])
+
+
+def parse_chapter_name(fname):
+    """ Parse the name of a GoPro video file
+
+    Parameters
+    ----------
+    fname: str
+        The file name.
+
+    Returns
+    -------
+    recording: tuple
+        A key identifying the recording: (directory, encoding, recording number).
+        None if the name does not follow the GoPro naming scheme.
+    chapter: int
+        The chapter number, starting from 0 or 1.
+    """
+    directory, basename = os.path.split(os.path.abspath(fname))
+    stem = os.path.splitext(basename)[0]
+
+    match = FIRST_CHAPTER_PATTERN.match(stem)
+    if match is not None:
+        return (directory, "GP", match.group(1)), 0
+
+    match = CHAPTER_PATTERN.match(stem)
+    if match is not None:
+        return (directory, match.group(1).upper(), match.group(3)), int(match.group(2))
+
+    return None, 0
+
+
+def find_sessions(files):
+    """ Group the chapters of the same recordings
+
+    Parameters
+    ----------
+    files: list of str
+        The video files.
+
+    Returns
+    -------
+    sessions: list of Session
+        The sessions, in the order of their first file in `files`. The files of
+        a session are sorted by chapter. Files not following the GoPro naming
+        scheme make a session on their own.
+    """
+    sessions = OrderedDict()
+    for fname in files:
+        recording, chapter = parse_chapter_name(fname)
+        key = fname if recording is None else recording
+        sessions.setdefault(key, []).append((chapter, fname))
+
+    result = []
+    for chapters in sessions.values():
+        chapter_files = [fname for _, fname in sorted(chapters)]
+        result.append(Session(
+            name=os.path.splitext(os.path.basename(chapter_files[0]))[0],
+            files=chapter_files
+        ))
+    return result
+
+
+def chapter_offsets(files):
+    """ Compute the start time of the chapters of a session
+
+    Parameters
+    ----------
+    files: list of str
+        The chapters, in order.
+
+    Returns
+    -------
+    offsets: numpy.ndarray
+        The time of the start of each chapter from the start of the session, in seconds,
+        given by the durations of the GPMF tracks of the previous chapters.
+    durations: numpy.ndarray
+        The duration of each chapter in seconds.
+    """
+    durations = numpy.zeros(len(files))
+    for i, fname in enumerate(files):
+        with open(fname, "rb") as f:
+            track = mp4.find_gpmf_track(f)
+        if len(track.times) > 0:
+            durations[i] = track.times[-1] + track.durations[-1]
+    return numpy.cumsum(durations) - durations, durations
+
+
+def _map(function, jobs, *iterables):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(function, *iterables))
+    return list(map(function, *iterables))
+
+
+def _extract_chapter_gps(fname, start, end, cache):
+    if start is None and end is None:
+        return extract_gps_from_file(fname, cache=cache)
+    return extract_gps_window(fname, start, end)
+
+
+def _chapter_window(t, offset):
+    # Times in seconds are relative to the session, UTC times are left as is
+    if t is None or _is_utc(t):
+        return t
+    return float(t) - offset
+
+
+def stitch_gps(chapters):
+    """ Concatenate the GPS data of consecutive chapters into one timeline
+
+    Block numbers are renumbered to keep increasing across chapters, and the
+    samples of a chapter which are not later than the last sample of the
+    previous chapters (a block repeated at the boundary) are dropped.
+
+    Parameters
+    ----------
+    chapters: list of numpy.ndarray
+        Structured arrays as returned by `gpmf.gps.extract_gps`, one per chapter.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    """
+    parts = []
+    n_blocks = 0
+    last_time = None
+    for gps_data in chapters:
+        if last_time is not None:
+            gps_data = gps_data[~(gps_data["time"] <= last_time)]
+        if len(gps_data) == 0:
+            continue
+
+        gps_data = gps_data.copy()
+        gps_data["block_id"] += n_blocks - gps_data["block_id"][0]
+        n_blocks = gps_data["block_id"][-1] + 1
+
+        times = gps_data["time"][~numpy.isnat(gps_data["time"])]
+        if len(times) > 0:
+            last_time = times.max() if last_time is None else max(last_time, times.max())
+        parts.append(gps_data)
+
+    if len(parts) == 0:
+        return numpy.zeros(0, dtype=GPS_DTYPE)
+    return numpy.concatenate(parts)
+
+
+def extract_session_gps(files, start=None, end=None, jobs=1, cache=None):
+    """ Extract the GPS data of all the chapters of a session
+
+    The chapters are extracted and parsed in parallel, then stitched into a
+    single timeline with `stitch_gps`.
+
+    Parameters
+    ----------
+    files: list of str
+        The chapters, in order, e.g. the `files` of a `Session`.
+    start: float, str, datetime.datetime or numpy.datetime64, optional (default=None)
+        Start of a time window, either in seconds from the start of the session or
+        as a UTC time. See `gpmf.gps.extract_gps_window`.
+    end: float, str, datetime.datetime or numpy.datetime64, optional (default=None)
+        End of the time window (excluded).
+    jobs: int, optional (default=1)
+        The number of chapters processed in parallel.
+    cache: gpmf.cache.TelemetryCache or bool, optional (default=None)
+        The cache storing extracted data, see `gpmf.gps.extract_gps_from_file`.
+
+    Returns
+    -------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    """
+    starts = [start] * len(files)
+    ends = [end] * len(files)
+    if (start is not None and not _is_utc(start)) or (end is not None and not _is_utc(end)):
+        offsets, durations = chapter_offsets(files)
+        starts = [_chapter_window(start, offset) for offset in offsets]
+        ends = [_chapter_window(end, offset) for offset in offsets]
+        # Skip the chapters outside of the window
+        selected = [
+            i for i in range(len(files))
+            if (not isinstance(ends[i], float) or ends[i] > 0)
+            and (not isinstance(starts[i], float) or starts[i] < durations[i])
+        ]
+        files = [files[i] for i in selected]
+        starts = [starts[i] for i in selected]
+        ends = [ends[i] for i in selected]
+
+    chapters = _map(_extract_chapter_gps, jobs, files, starts, ends, [cache] * len(files))
+    return stitch_gps(chapters)
+
+
+def _extract_chapter_sensors(fname, fourccs):
+    stream, track = extract_gpmf_stream_with_track(fname)
+    return extract_sensors(stream, fourccs=fourccs, track=track)
+
+
+def extract_session_sensors(files, fourccs=SENSORS, jobs=1):
+    """ Extract the sensor data of all the chapters of a session
+
+    The sample times of each chapter are shifted by the start time of the
+    chapter, so that they are expressed in seconds from the start of the session.
+
+    Parameters
+    ----------
+    files: list of str
+        The chapters, in order.
+    fourccs: list of str, optional (default=SENSORS)
+        The FourCC codes of the sensors.
+    jobs: int, optional (default=1)
+        The number of chapters processed in parallel.
+
+    Returns
+    -------
+    sensors: dict
+        A dictionary mapping the FourCC codes of the sensors found to `SensorData` objects.
+    """
+    offsets, _ = chapter_offsets(files)
+    chapters = _map(_extract_chapter_sensors, jobs, files, [fourccs] * len(files))
+
+    sensors = {}
+    for fourcc in fourccs:
+        parts = [(offset, chapter[fourcc]) for offset, chapter in zip(offsets, chapters) if fourcc in chapter]
+        if len(parts) == 0:
+            continue
+        block_offsets = numpy.cumsum([0] + [p.block_id[-1] - p.block_id[0] + 1 for _, p in parts[:-1]])
+        sensors[fourcc] = SensorData(
+            fourcc=fourcc,
+            description=parts[0][1].description,
+            units=parts[0][1].units,
+            values=numpy.concatenate([p.values for _, p in parts]),
+            time=numpy.concatenate([p.time + offset for offset, p in parts]),
+            block_id=numpy.concatenate([p.block_id - p.block_id[0] + n for (_, p), n in zip(parts, block_offsets)])
+        )
+    return sensors
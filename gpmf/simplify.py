@@ -0,0 +1,241 @@
+import numpy
+
+from .gps import interpolate_times
+
+
+# Mean radius of the Earth in meters
+EARTH_RADIUS = 6371008.8
+
+
+def project_local(latitude, longitude):
+    """ Project coordinates onto a local plane, in meters
+
+    An equirectangular projection centered on the mean latitude is used,
+    which is accurate enough for the extent of a single track.
+
+    Parameters
+    ----------
+    latitude, longitude: numpy.ndarray
+        The coordinates in degrees.
+
+    Returns
+    -------
+    x, y: numpy.ndarray
+        The coordinates in meters.
+    """
+    latitude = numpy.radians(latitude)
+    longitude = numpy.radians(longitude)
+    scale = numpy.cos(numpy.mean(latitude)) if len(latitude) else 1.
+    return EARTH_RADIUS * scale * longitude, EARTH_RADIUS * latitude
+
+
+def _segment_distances(x, y, points, starts, ends):
+    # Distance of each point to the segment [start, end] it belongs to
+    x0, y0 = x[starts], y[starts]
+    dx, dy = x[ends] - x0, y[ends] - y0
+    px, py = x[points] - x0, y[points] - y0
+    length2 = dx * dx + dy * dy
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        t = numpy.where(length2 > 0, (px * dx + py * dy) / length2, 0.).clip(0, 1)
+    return numpy.hypot(px - t * dx, py - t * dy)
+
+
+def douglas_peucker(x, y, tolerance):
+    """ Simplify a line with the Douglas-Peucker algorithm
+
+    All the segments of a level of the recursion are processed at once, so
+    the number of Python iterations is the depth of the recursion.
+
+    Parameters
+    ----------
+    x, y: numpy.ndarray
+        The coordinates of the points, in meters.
+    tolerance: float
+        The maximum distance in meters between the input points and the
+        simplified line.
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the points kept.
+    """
+    n = len(x)
+    mask = numpy.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+    mask[[0, -1]] = True
+
+    starts = numpy.array([0])
+    ends = numpy.array([n - 1])
+    while len(starts):
+        sizes = ends - starts - 1
+        keep = sizes > 0
+        starts, ends, sizes = starts[keep], ends[keep], sizes[keep]
+        if len(starts) == 0:
+            break
+
+        # Indices of the inner points of all the segments, grouped by segment
+        offsets = numpy.cumsum(sizes) - sizes
+        segment = numpy.repeat(numpy.arange(len(starts)), sizes)
+        points = numpy.arange(sizes.sum()) - offsets[segment] + starts[segment] + 1
+
+        distances = numpy.nan_to_num(_segment_distances(x, y, points, starts[segment], ends[segment]))
+        max_distances = numpy.maximum.reduceat(distances, offsets)
+
+        # First point reaching the maximum distance of each segment
+        is_max = numpy.flatnonzero(distances == max_distances[segment])
+        _, first = numpy.unique(segment[is_max], return_index=True)
+        farthest = points[is_max[first]]
+
+        split = max_distances > tolerance
+        mask[farthest[split]] = True
+        starts, ends = (
+            numpy.concatenate([starts[split], farthest[split]]),
+            numpy.concatenate([farthest[split], ends[split]])
+        )
+    return mask
+
+
+def visvalingam(x, y, tolerance):
+    """ Simplify a line with the Visvalingam-Whyatt algorithm
+
+    Points are removed by rounds: in each round, every point whose triangle
+    with its neighbours is smaller than the ones of its neighbours and than
+    `tolerance ** 2` is removed at once.
+
+    Parameters
+    ----------
+    x, y: numpy.ndarray
+        The coordinates of the points, in meters.
+    tolerance: float
+        The side in meters of the square whose area is the smallest area of
+        the triangles kept.
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the points kept.
+    """
+    n = len(x)
+    min_area = tolerance ** 2
+    # Deterministic pseudo-random order breaking the ties between equal
+    # areas, so that straight or stationary parts are reduced in a few rounds.
+    tie_breaker = (numpy.arange(n, dtype="u8") * 2654435761) % (1 << 32)
+
+    remaining = numpy.arange(n)
+    while len(remaining) > 2:
+        prev, point, next_ = remaining[:-2], remaining[1:-1], remaining[2:]
+        areas = 0.5 * numpy.abs(
+            (x[prev] - x[next_]) * (y[point] - y[prev]) - (x[prev] - x[point]) * (y[next_] - y[prev])
+        )
+        ranks = numpy.empty(len(areas), dtype="i8")
+        ranks[numpy.lexsort((tie_breaker[point], areas))] = numpy.arange(len(areas))
+
+        # Inner points are removed if they are local minima of the areas
+        ranks = numpy.concatenate([[-1], ranks, [-1]])
+        removed = (
+            (areas < min_area)
+            & ((ranks[1:-1] < ranks[:-2]) | (ranks[:-2] < 0))
+            & ((ranks[1:-1] < ranks[2:]) | (ranks[2:] < 0))
+        )
+        if not removed.any():
+            break
+        remaining = numpy.concatenate([remaining[:1], point[~removed], remaining[-1:]])
+
+    mask = numpy.zeros(n, dtype=bool)
+    mask[remaining] = True
+    return mask
+
+
+METHODS = {
+    "douglas-peucker": douglas_peucker,
+    "visvalingam": visvalingam,
+}
+
+
+def simplify(gps_data, tolerance, method="douglas-peucker"):
+    """ Select the samples describing the shape of a GPS track
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    tolerance: float
+        The tolerance in meters.
+    method: str, optional (default="douglas-peucker")
+        "douglas-peucker" or "visvalingam".
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the samples kept.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown simplification method: %r" % method)
+    x, y = project_local(gps_data["latitude"], gps_data["longitude"])
+    return METHODS[method](x, y, tolerance)
+
+
+def resample(gps_data, interval):
+    """ Select at most one sample per time interval
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    interval: float
+        The interval in seconds.
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the first sample of each interval.
+
+    Raises
+    ------
+    ValueError: If the interval is not positive.
+    """
+    if not interval > 0:
+        raise ValueError("The resampling interval must be positive, got %r" % interval)
+    # Times are in nanoseconds
+    step = max(int(round(interval * 1e9)), 1)
+    time = interpolate_times(gps_data).astype("i8")
+    mask = numpy.zeros(len(time), dtype=bool)
+    valid = numpy.flatnonzero(time != numpy.iinfo("i8").min)
+    if len(valid) == 0:
+        return mask
+    bins = (time[valid] - time[valid[0]]) // step
+    first = numpy.ones(len(valid), dtype=bool)
+    first[1:] = bins[1:] != bins[:-1]
+    mask[valid[first]] = True
+    return mask
+
+
+def decimate(gps_data, tolerance=None, interval=None, method="douglas-peucker"):
+    """ Reduce the number of samples of a GPS track
+
+    The track is first resampled in time, then simplified.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    tolerance: float, optional (default=None)
+        The simplification tolerance in meters. No simplification if None.
+    interval: float, optional (default=None)
+        The resampling interval in seconds. No resampling if None.
+    method: str, optional (default="douglas-peucker")
+        The simplification method, "douglas-peucker" or "visvalingam".
+
+    Returns
+    -------
+    mask: numpy.ndarray
+        A boolean mask selecting the samples kept.
+    """
+    mask = numpy.ones(len(gps_data), dtype=bool)
+    if interval is not None:
+        mask &= resample(gps_data, interval)
+    if tolerance is not None:
+        selected = numpy.flatnonzero(mask)
+        mask[selected] = simplify(gps_data[selected], tolerance, method=method)
+    return mask
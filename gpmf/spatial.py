@@ -0,0 +1,500 @@
+""" Spatial index of the GPS tracks of a library of video files
+
+The tracks are decimated into segments stored in an SQLite R-tree, along with
+the bounding box and time span of each file, so that the files passing near
+a place are found without opening any video::
+
+    with gpmf.spatial.SpatialIndex("gpmf-index.db") as index:
+        index.update(glob.glob("DCIM/*/*.MP4"))
+        for match in index.query_point(45.05, 5.02, radius=100):
+            print(match.path, match.offset)
+
+Files are identified by their path, size and modification time: updating the
+index only extracts the GPS data of the new and modified files.
+"""
+import os
+import sqlite3
+import logging
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from . import mp4
+from .gps import _to_seconds, _video_origin, extract_gps
+from .simplify import EARTH_RADIUS, decimate
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_FILE = "gpmf-index.db"
+# Simplification tolerance of the indexed tracks, in meters
+DEFAULT_TOLERANCE = 10.
+# Samples further apart in time, in seconds, are not joined by a segment
+MAX_GAP = 10.
+
+EPOCH = numpy.datetime64(0, "us")
+# Time bounds of the queries without time range, in microseconds
+MIN_TIME = -(1 << 62)
+MAX_TIME = 1 << 62
+
+SEGMENT_DTYPE = numpy.dtype([
+    ("lat0", "f8"),
+    ("lon0", "f8"),
+    ("lat1", "f8"),
+    ("lon1", "f8"),
+    ("offset0", "f8"),
+    ("offset1", "f8"),
+    ("time0", "i8"),
+    ("time1", "i8")
+])
+
+CANDIDATE_DTYPE = numpy.dtype([("file_id", "i8")] + SEGMENT_DTYPE.descr)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    n_segments INTEGER NOT NULL,
+    start_time INTEGER,
+    end_time INTEGER,
+    min_lat REAL,
+    max_lat REAL,
+    min_lon REAL,
+    max_lon REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    lat0 REAL,
+    lon0 REAL,
+    lat1 REAL,
+    lon1 REAL,
+    offset0 REAL,
+    offset1 REAL,
+    time0 INTEGER,
+    time1 INTEGER
+);
+CREATE INDEX IF NOT EXISTS segments_file ON segments (file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+
+Match = namedtuple("Match", ["path", "start", "end", "offset", "time", "distance"])
+
+
+def track_segments(gps_data, video_time, tolerance=DEFAULT_TOLERANCE, max_gap=MAX_GAP):
+    """ Decimate a GPS track into the segments stored in the index
+
+    Only the samples with a time and a 2d or 3d fix are used. The track is
+    split where samples are missing, then simplified (see `gpmf.simplify.decimate`)
+    and the consecutive points kept are joined by segments. Isolated points
+    give segments of null length.
+
+    Parameters
+    ----------
+    gps_data: numpy.ndarray
+        A structured array as returned by `gpmf.gps.extract_gps`.
+    video_time: numpy.ndarray
+        The time of each sample in seconds from the start of the video.
+    tolerance: float, optional (default=DEFAULT_TOLERANCE)
+        The simplification tolerance in meters.
+    max_gap: float, optional (default=MAX_GAP)
+        The maximum time in seconds between two samples joined by a segment.
+
+    Returns
+    -------
+    segments: numpy.ndarray
+        A structured array with dtype `SEGMENT_DTYPE`: the coordinates, video
+        times (offset) and UTC times in microseconds (time) of the ends of each segment.
+    """
+    valid = (
+        ~numpy.isnat(gps_data["time"]) & (gps_data["fix"] >= 2)
+        & numpy.isfinite(gps_data["latitude"]) & numpy.isfinite(gps_data["longitude"])
+    )
+    gps_data, video_time = gps_data[valid], video_time[valid]
+    if len(gps_data) == 0:
+        return numpy.zeros(0, dtype=SEGMENT_DTYPE)
+
+    time = (gps_data["time"] - EPOCH).astype("i8")
+    steps = numpy.diff(time)
+    breaks = numpy.flatnonzero((steps < 0) | (steps > max_gap * 1e6)) + 1
+    starts = numpy.concatenate([[0], breaks])
+    ends = numpy.concatenate([breaks, [len(gps_data)]])
+
+    first, second = [], []
+    for start, end in zip(starts, ends):
+        kept = start + numpy.flatnonzero(decimate(gps_data[start:end], tolerance=tolerance))
+        if len(kept) == 1:
+            first.append(kept)
+            second.append(kept)
+        else:
+            first.append(kept[:-1])
+            second.append(kept[1:])
+    first, second = numpy.concatenate(first), numpy.concatenate(second)
+
+    segments = numpy.zeros(len(first), dtype=SEGMENT_DTYPE)
+    for suffix, points in (("0", first), ("1", second)):
+        segments["lat" + suffix] = gps_data["latitude"][points]
+        segments["lon" + suffix] = gps_data["longitude"][points]
+        segments["offset" + suffix] = video_time[points]
+        segments["time" + suffix] = time[points]
+    return segments
+
+
+def file_segments(fname, tolerance=DEFAULT_TOLERANCE):
+    """ Extract the segments of the GPS track of a video file
+
+    The video times are computed as in `gpmf.gps.extract_gps_window`, so
+    that they can be used as its `start` and `end` arguments.
+
+    Parameters
+    ----------
+    fname: str
+        The input file
+    tolerance: float, optional (default=DEFAULT_TOLERANCE)
+        The simplification tolerance in meters.
+
+    Returns
+    -------
+    segments: numpy.ndarray
+        A structured array as returned by `track_segments`.
+    """
+    with open(fname, "rb") as f:
+        track = mp4.find_gpmf_track(f)
+        gps_data = extract_gps(mp4.read_samples(f, track))
+        origin = _video_origin(f, track) if len(gps_data) > 0 else None
+
+    if origin is None:
+        return numpy.zeros(0, dtype=SEGMENT_DTYPE)
+    video_time = (gps_data["time"] - origin) / numpy.timedelta64(1, "s")
+    return track_segments(gps_data, video_time, tolerance=tolerance)
+
+
+def _index_file(fname, tolerance):
+    # Errors are returned to be stored in the index, the file is then not
+    # extracted again until it is modified.
+    try:
+        return file_segments(fname, tolerance=tolerance), None
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+
+
+def _time_window(start, end):
+    # Bounds of a query in microseconds since the epoch
+    start = MIN_TIME if start is None else int(round(_to_seconds(start, EPOCH) * 1e6))
+    end = MAX_TIME if end is None else int(round(_to_seconds(end, EPOCH) * 1e6))
+    return start, end
+
+
+def _window_positions(candidates, start, end):
+    # Range of the positions along each segment recorded within the time
+    # window, the segments being fully kept when they have no duration.
+    time0 = candidates["time0"].astype("f8")
+    duration = candidates["time1"] - time0
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        first = numpy.where(duration > 0, (start - time0) / duration, 0.).clip(0, 1)
+        last = numpy.where(duration > 0, (end - time0) / duration, 1.).clip(0, 1)
+    return first, last
+
+
+def _point_distances(candidates, latitude, longitude, first, last):
+    # Distance from the point to each segment, in a local projection centered
+    # on the point, and position of the closest point along the segment,
+    # between the positions `first` and `last`.
+    scale = EARTH_RADIUS * numpy.cos(numpy.radians(latitude))
+    x0 = scale * numpy.radians(candidates["lon0"] - longitude)
+    y0 = EARTH_RADIUS * numpy.radians(candidates["lat0"] - latitude)
+    dx = scale * numpy.radians(candidates["lon1"] - candidates["lon0"])
+    dy = EARTH_RADIUS * numpy.radians(candidates["lat1"] - candidates["lat0"])
+    length2 = dx * dx + dy * dy
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        t = numpy.where(length2 > 0, -(x0 * dx + y0 * dy) / length2, 0.).clip(first, last)
+    return numpy.hypot(x0 + t * dx, y0 + t * dy), t
+
+
+def _clip_segments(candidates, min_lat, min_lon, max_lat, max_lon, first, last):
+    # Liang-Barsky clipping: whether the part of each segment between the
+    # positions `first` and `last` crosses the box, and the position along the
+    # segment where it enters it.
+    x0, y0 = candidates["lon0"], candidates["lat0"]
+    dx, dy = candidates["lon1"] - x0, candidates["lat1"] - y0
+    enter = first.copy()
+    leave = last.copy()
+    outside = numpy.zeros(len(candidates), dtype=bool)
+    for p, q in ((-dx, x0 - min_lon), (dx, max_lon - x0), (-dy, y0 - min_lat), (dy, max_lat - y0)):
+        outside |= (p == 0) & (q < 0)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            r = q / p
+        enter = numpy.where(p < 0, numpy.maximum(enter, r), enter)
+        leave = numpy.where(p > 0, numpy.minimum(leave, r), leave)
+    return ~outside & (enter <= leave), enter
+
+
+class SpatialIndex(object):
+    """ Persistent spatial index of the GPS tracks of video files
+
+    Parameters
+    ----------
+    path: str
+        The SQLite file of the index. It is created if needed.
+    tolerance: float, optional (default=DEFAULT_TOLERANCE)
+        The simplification tolerance in meters of the tracks indexed.
+    """
+
+    def __init__(self, path, tolerance=DEFAULT_TOLERANCE):
+        self.path = path
+        self.tolerance = tolerance
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            row = self.connection.execute("SELECT value FROM metadata WHERE name='version'").fetchone()
+            if row is None:
+                self.connection.execute("INSERT INTO metadata VALUES ('version', ?)", (str(INDEX_VERSION),))
+            elif int(row[0]) != INDEX_VERSION:
+                raise RuntimeError("Unsupported index version %s in '%s'" % (row[0], path))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _is_current(self, path, stat):
+        row = self.connection.execute("SELECT size, mtime_ns FROM files WHERE path=?", (path,)).fetchone()
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns
+
+    def _delete(self, path):
+        row = self.connection.execute("SELECT id FROM files WHERE path=?", (path,)).fetchone()
+        if row is None:
+            return False
+        self.connection.execute(
+            "DELETE FROM segments_rtree WHERE id IN (SELECT id FROM segments WHERE file_id=?)", row)
+        self.connection.execute("DELETE FROM segments WHERE file_id=?", row)
+        self.connection.execute("DELETE FROM files WHERE id=?", row)
+        return True
+
+    def _store(self, path, stat, segments, error):
+        self._delete(path)
+        if segments is None or len(segments) == 0:
+            self.connection.execute(
+                "INSERT INTO files (path, size, mtime_ns, n_segments, error) VALUES (?, ?, ?, 0, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, error))
+            return
+
+        latitudes = numpy.concatenate([segments["lat0"], segments["lat1"]])
+        longitudes = numpy.concatenate([segments["lon0"], segments["lon1"]])
+        file_id = self.connection.execute(
+            "INSERT INTO files (path, size, mtime_ns, n_segments, start_time, end_time, "
+            "min_lat, max_lat, min_lon, max_lon) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, len(segments),
+             int(segments["time0"].min()), int(segments["time1"].max()),
+             latitudes.min(), latitudes.max(), longitudes.min(), longitudes.max())
+        ).lastrowid
+
+        first_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM segments").fetchone()[0]
+        ids = range(first_id, first_id + len(segments))
+        self.connection.executemany(
+            "INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(i, file_id) + row for i, row in zip(ids, segments.tolist())])
+        self.connection.executemany(
+            "INSERT INTO segments_rtree VALUES (?, ?, ?, ?, ?)",
+            zip(ids,
+                numpy.minimum(segments["lat0"], segments["lat1"]).tolist(),
+                numpy.maximum(segments["lat0"], segments["lat1"]).tolist(),
+                numpy.minimum(segments["lon0"], segments["lon1"]).tolist(),
+                numpy.maximum(segments["lon0"], segments["lon1"]).tolist()))
+
+    def update(self, files, jobs=1):
+        """ Index the new and modified files
+
+        Parameters
+        ----------
+        files: list of str
+            The video files.
+        jobs: int, optional (default=1)
+            The number of files processed in parallel.
+
+        Returns
+        -------
+        stats: dict
+            The number of files `indexed`, `unchanged` and `failed`. Files whose
+            GPS data could not be extracted are recorded as failed, and are only
+            tried again once modified.
+        """
+        stats = dict(indexed=0, unchanged=0, failed=0)
+        todo = []
+        for path in OrderedDict.fromkeys(os.path.abspath(fname) for fname in files):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning("Cannot index '%s': %s", path, e)
+                stats["failed"] += 1
+                continue
+            if self._is_current(path, stat):
+                stats["unchanged"] += 1
+            else:
+                todo.append((path, stat))
+
+        paths = [path for path, _ in todo]
+        tolerances = [self.tolerance] * len(todo)
+        if jobs > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                self._store_all(todo, executor.map(_index_file, paths, tolerances), stats)
+        else:
+            self._store_all(todo, map(_index_file, paths, tolerances), stats)
+        return stats
+
+    def _store_all(self, todo, results, stats):
+        for (path, stat), (segments, error) in zip(todo, results):
+            if error is not None:
+                logger.warning("Cannot index '%s': %s", path, error)
+                stats["failed"] += 1
+            else:
+                logger.info("Indexed '%s' (%i segments)", path, len(segments))
+                stats["indexed"] += 1
+            with self.connection:
+                self._store(path, stat, segments, error)
+
+    def remove(self, files):
+        """ Remove files from the index
+
+        Returns
+        -------
+        n_removed: int
+            The number of files removed.
+        """
+        with self.connection:
+            return sum(self._delete(os.path.abspath(fname)) for fname in files)
+
+    def prune(self):
+        """ Remove the files which do not exist anymore from the index
+
+        Returns
+        -------
+        n_removed: int
+            The number of files removed.
+        """
+        paths = [row[0] for row in self.connection.execute("SELECT path FROM files")]
+        return self.remove([path for path in paths if not os.path.exists(path)])
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon, start, end):
+        rows = self.connection.execute(
+            "SELECT s.file_id, s.lat0, s.lon0, s.lat1, s.lon1, s.offset0, s.offset1, s.time0, s.time1 "
+            "FROM segments_rtree AS r JOIN segments AS s ON s.id = r.id "
+            "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? "
+            "AND s.time1 >= ? AND s.time0 < ?",
+            (min_lat, max_lat, min_lon, max_lon, start, end)
+        ).fetchall()
+        return numpy.array(rows, dtype=CANDIDATE_DTYPE)
+
+    def _matches(self, candidates, positions, distances, first, last):
+        # Group the matching segments of each file into passes
+        order = numpy.lexsort((candidates["offset0"], candidates["file_id"]))
+        candidates, positions, distances = candidates[order], positions[order], distances[order]
+        first, last = first[order], last[order]
+        durations = candidates["offset1"] - candidates["offset0"]
+        offsets = candidates["offset0"] + positions * durations
+        # Bounds of the parts of the segments within the time window
+        starts = candidates["offset0"] + first * durations
+        ends = candidates["offset0"] + last * durations
+        times = candidates["time0"] + numpy.round(positions * (candidates["time1"] - candidates["time0"]))
+
+        paths = dict(self.connection.execute(
+            "SELECT id, path FROM files WHERE id IN (%s)" % ",".join(map(str, set(candidates["file_id"].tolist())))))
+
+        new_pass = numpy.ones(len(candidates), dtype=bool)
+        new_pass[1:] = (
+            (candidates["file_id"][1:] != candidates["file_id"][:-1])
+            | (candidates["offset0"][1:] > candidates["offset1"][:-1])
+        )
+        bounds = numpy.append(numpy.flatnonzero(new_pass), len(candidates))
+
+        matches = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            best = start + numpy.argmin(distances[start:stop]) if numpy.isfinite(distances[start]) else start
+            matches.append(Match(
+                path=paths[candidates["file_id"][start]],
+                start=float(starts[start]),
+                end=float(ends[start:stop].max()),
+                offset=float(offsets[best]),
+                time=EPOCH + numpy.timedelta64(int(times[best]), "us"),
+                distance=float(distances[best])
+            ))
+        return sorted(matches, key=lambda m: (m.path, m.start))
+
+    def query_point(self, latitude, longitude, radius, start=None, end=None):
+        """ Find the passages of the indexed tracks near a point
+
+        Parameters
+        ----------
+        latitude, longitude: float
+            The coordinates of the point in degrees.
+        radius: float
+            The maximum distance in meters to the point.
+        start: str, datetime.datetime or numpy.datetime64, optional (default=None)
+            Only the parts of the tracks recorded from this UTC time are searched.
+        end: str, datetime.datetime or numpy.datetime64, optional (default=None)
+            Only the parts of the tracks recorded before this UTC time are searched.
+
+        Returns
+        -------
+        matches: list of Match
+            One match for each passage of a file within `radius` of the point
+            (measured on the indexed track, simplified within the tolerance),
+            sorted by file and time. `start` and `end` are the times in seconds
+            from the start of the video of the indexed segments of the passage,
+            `offset` and `time` give the video time and the UTC time of the
+            closest approach, and `distance` its distance in meters. With a time
+            window, the segments are cut to the window.
+        """
+        start, end = _time_window(start, end)
+        radius_deg = numpy.degrees(radius / EARTH_RADIUS)
+        lon_radius = radius_deg / max(numpy.cos(numpy.radians(latitude)), 1e-6)
+        candidates = self._candidates(latitude - radius_deg, longitude - lon_radius,
+                                      latitude + radius_deg, longitude + lon_radius, start, end)
+        first, last = _window_positions(candidates, start, end)
+        distances, positions = _point_distances(candidates, latitude, longitude, first, last)
+        near = distances <= radius
+        if not near.any():
+            return []
+        return self._matches(candidates[near], positions[near], distances[near], first[near], last[near])
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon, start=None, end=None):
+        """ Find the passages of the indexed tracks through a bounding box
+
+        Parameters
+        ----------
+        min_lat, min_lon, max_lat, max_lon: float
+            The bounds of the box in degrees.
+        start: str, datetime.datetime or numpy.datetime64, optional (default=None)
+            Only the parts of the tracks recorded from this UTC time are searched.
+        end: str, datetime.datetime or numpy.datetime64, optional (default=None)
+            Only the parts of the tracks recorded before this UTC time are searched.
+
+        Returns
+        -------
+        matches: list of Match
+            One match for each passage of a file through the box, see `query_point`.
+            `offset` and `time` are the ones of the entry into the box, and
+            `distance` is NaN.
+        """
+        start, end = _time_window(start, end)
+        candidates = self._candidates(min_lat, min_lon, max_lat, max_lon, start, end)
+        first, last = _window_positions(candidates, start, end)
+        inside, positions = _clip_segments(candidates, min_lat, min_lon, max_lat, max_lon, first, last)
+        if not inside.any():
+            return []
+        return self._matches(candidates[inside], positions[inside], numpy.full(inside.sum(), numpy.nan),
+                             first[inside], last[inside])
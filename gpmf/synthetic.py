@@ -0,0 +1,233 @@
+from datetime import datetime, timedelta
+import struct
+
+import numpy
+from .parse import KLV_HEADER, ceil4, compile_type, num_types
+
+
+def make_klv(fourcc, type_str, payload, size=None, repeat=None):
+    """ Encode a KLV item
+
+    Parameters
+    ----------
+    fourcc: str
+        The fourcc code
+    type_str: str
+        The type of the value, "\\x00" for containers.
+    payload: bytes or numpy.ndarray
+        The payload. Numeric arrays are encoded in big-endian order, a 2d array
+        giving one sample per row.
+    size: int, optional (default=None)
+        The size of the value. Inferred from the payload if None.
+    repeat: int, optional (default=None)
+        The number of times the value is repeated. Inferred from the payload if None.
+
+    Returns
+    -------
+    klv: bytes
+        The encoded item, padded to a multiple of 4 bytes.
+    """
+    if isinstance(payload, numpy.ndarray):
+        payload = numpy.atleast_1d(payload)
+        if size is None:
+            size = payload.dtype.itemsize * (payload.shape[1] if payload.ndim > 1 else 1)
+        payload = payload.astype(payload.dtype.newbyteorder(">")).tobytes()
+    if type_str == "\x00":
+        size = 4
+    elif size is None:
+        size = len(payload)
+    if repeat is None:
+        repeat = len(payload) // size
+    padding = b"\x00" * (ceil4(len(payload)) - len(payload))
+    return KLV_HEADER.pack(fourcc.encode(), type_str.encode(), size, repeat) + payload + padding
+
+
+def make_container(fourcc, items):
+    """ Encode a container (DEVC, STRM) holding already encoded items """
+    return make_klv(fourcc, "\x00", b"".join(items))
+
+
+def _numeric(type_str, values):
+    return numpy.asarray(values, dtype=">" + num_types[type_str][1])
+
+
+def _sensor_stream(fourcc, name, units, scale, values, stmp, tsmp, type_str="s"):
+    return make_container("STRM", [
+        make_klv("STMP", "J", _numeric("J", stmp)),
+        make_klv("TSMP", "L", _numeric("L", tsmp)),
+        make_klv("STNM", "c", name.encode("latin1")),
+        make_klv("SIUN", "c", units.encode("latin1")),
+        make_klv("SCAL", type_str, _numeric(type_str, scale)),
+        make_klv(fourcc, type_str, _numeric(type_str, numpy.round(values * scale))),
+    ])
+
+
+def _gps_stream(values, timestamp, stmp, tsmp, fix=3, precision=150):
+    scale = numpy.array([10000000, 10000000, 1000, 1000, 100])
+    units = b"degdegm\x00\x00m/sm/s"
+    return make_container("STRM", [
+        make_klv("STMP", "J", _numeric("J", stmp)),
+        make_klv("TSMP", "L", _numeric("L", tsmp)),
+        make_klv("STNM", "c", b"GPS (Lat., Long., Alt., 2D speed, 3D speed)"),
+        make_klv("GPSF", "L", _numeric("L", fix)),
+        make_klv("GPSU", "U", timestamp.strftime("%y%m%d%H%M%S.%f")[:16].encode()),
+        make_klv("GPSP", "S", _numeric("S", precision)),
+        make_klv("UNIT", "c", units, size=3, repeat=5),
+        make_klv("SCAL", "l", _numeric("l", scale)),
+        make_klv("GPS5", "l", _numeric("l", numpy.round(values * scale))),
+    ])
+
+
+def _gps9_stream(values, timestamp, gps_rate, stmp, tsmp, fix=3, precision=150):
+    scale = numpy.array([10000000, 10000000, 1000, 1000, 100, 1, 1000, 100, 1])
+    units = b"degdegm\x00\x00m/sm/s\x00\x00\x00s\x00\x00\x00\x00\x00\x00"
+    times = (timestamp - datetime(2000, 1, 1)).total_seconds() + numpy.arange(len(values)) / gps_rate
+    records = numpy.zeros(len(values), dtype=compile_type("lllllllSS"))
+    for j in range(5):
+        records["f%i" % j] = numpy.round(values[:, j] * scale[j])
+    records["f5"] = times // 86400
+    records["f6"] = numpy.round(times % 86400 * 1000)
+    records["f7"] = precision
+    records["f8"] = fix
+    return make_container("STRM", [
+        make_klv("STMP", "J", _numeric("J", stmp)),
+        make_klv("TSMP", "L", _numeric("L", tsmp)),
+        make_klv("STNM", "c", b"GPS (Lat., Long., Alt., 2D, 3D, days, secs, DOP, fix)"),
+        make_klv("UNIT", "c", units, size=3, repeat=9),
+        make_klv("TYPE", "c", b"lllllllSS"),
+        make_klv("SCAL", "l", _numeric("l", scale)),
+        make_klv("GPS9", "?", records),
+    ])
+
+
+def make_payloads(duration=60, gps_rate=18, accl_rate=200, gyro_rate=200,
+                  start_time=datetime(2020, 7, 3, 12, 0, 0), seed=0, gps_fourcc="GPS5"):
+    """ Generate the payloads of a synthetic GPMF stream
+
+    Each payload is one DEVC container covering one second, holding an
+    ACCL, a GYRO and a GPS5 stream, with the nesting and the metadata
+    (STMP, TSMP, STNM, SIUN/UNIT, SCAL, GPSF, GPSU, GPSP) found in GoPro files.
+    The GPS track is a random walk. The output only depends on the parameters.
+
+    Parameters
+    ----------
+    duration: int, optional (default=60)
+        The duration in seconds, i.e. the number of payloads.
+    gps_rate: int, optional (default=18)
+        The number of GPS samples per second.
+    accl_rate: int, optional (default=200)
+        The number of accelerometer samples per second.
+    gyro_rate: int, optional (default=200)
+        The number of gyroscope samples per second.
+    start_time: datetime.datetime, optional
+        The UTC time of the first GPS sample.
+    seed: int, optional (default=0)
+        The seed of the random generator.
+    gps_fourcc: str, optional (default="GPS5")
+        "GPS5", or "GPS9" for a GPS stream of complex values (with a TYPE)
+        dating each sample, as recorded by the HERO11 and later.
+
+    Returns
+    -------
+    payloads: list of bytes
+        The encoded DEVC containers, one per second.
+    """
+    rng = numpy.random.RandomState(seed)
+
+    n_gps = duration * gps_rate
+    speed = 5 + numpy.cumsum(rng.normal(0, 0.05, n_gps)).clip(-5, 25)
+    heading = numpy.cumsum(rng.normal(0, 0.02, n_gps))
+    step = speed / gps_rate / 111320.
+    gps = numpy.empty((n_gps, 5))
+    gps[:, 0] = 45. + numpy.cumsum(step * numpy.cos(heading))
+    gps[:, 1] = 5. + numpy.cumsum(step * numpy.sin(heading) / numpy.cos(numpy.radians(45.)))
+    gps[:, 2] = 800. + numpy.cumsum(rng.normal(0, 0.1, n_gps))
+    gps[:, 3] = speed
+    gps[:, 4] = speed * 1.01
+
+    accl = rng.normal(0, 1, (duration * accl_rate, 3)) + [0, 0, 9.81]
+    gyro = rng.normal(0, 0.1, (duration * gyro_rate, 3))
+
+    if gps_fourcc == "GPS5":
+        gps_stream = _gps_stream
+    elif gps_fourcc == "GPS9":
+        def gps_stream(values, timestamp, stmp, tsmp):
+            return _gps9_stream(values, timestamp, gps_rate, stmp, tsmp)
+    else:
+        raise ValueError("Unsupported GPS stream: %r" % gps_fourcc)
+
+    payloads = []
+    for i in range(duration):
+        stmp = i * 1000000
+        payloads.append(make_container("DEVC", [
+            make_klv("DVID", "L", _numeric("L", 1)),
+            make_klv("DVNM", "c", b"Synthetic camera"),
+            _sensor_stream("ACCL", "Accelerometer", "m/s\xb2", 418,
+                           accl[i * accl_rate:(i + 1) * accl_rate], stmp, (i + 1) * accl_rate),
+            _sensor_stream("GYRO", "Gyroscope", "rad/s", 939,
+                           gyro[i * gyro_rate:(i + 1) * gyro_rate], stmp, (i + 1) * gyro_rate),
+            gps_stream(gps[i * gps_rate:(i + 1) * gps_rate], start_time + timedelta(seconds=i),
+                       stmp, (i + 1) * gps_rate),
+        ]))
+    return payloads
+
+
+def make_stream(duration=60, **kwargs):
+    """ Generate a synthetic GPMF stream
+
+    See `make_payloads` for the parameters.
+
+    Returns
+    -------
+    stream: bytes
+        The raw GPMF binary stream.
+    """
+    return b"".join(make_payloads(duration, **kwargs))
+
+
+def make_mp4(payloads, timescale=1000, sample_duration=1001):
+    """ Wrap GPMF payloads into a minimal MP4 file with a single gpmd track
+
+    Parameters
+    ----------
+    payloads: list of bytes
+        The samples of the track, e.g. as returned by `make_payloads`.
+    timescale: int, optional (default=1000)
+        The time scale of the track.
+    sample_duration: int, optional (default=1001)
+        The duration of each sample in `timescale` units.
+
+    Returns
+    -------
+    mp4_data: bytes
+        The content of the MP4 file.
+    """
+    def box(box_type, *children):
+        content = b"".join(children)
+        return struct.pack(">I4s", 8 + len(content), box_type.encode()) + content
+
+    def full_box(box_type, *children):
+        return box(box_type, b"\x00\x00\x00\x00", *children)
+
+    ftyp = box("ftyp", b"mp41", b"\x00\x00\x00\x00", b"mp41")
+    offsets = len(ftyp) + 8 + numpy.cumsum([0] + [len(p) for p in payloads[:-1]])
+    mdat = box("mdat", *payloads)
+    n = len(payloads)
+
+    stbl = box(
+        "stbl",
+        full_box("stsd", struct.pack(">I", 1), box("gpmd", b"\x00" * 8)),
+        full_box("stts", struct.pack(">III", 1, n, sample_duration)),
+        full_box("stsc", struct.pack(">IIII", 1, 1, 1, 1)),
+        full_box("stsz", struct.pack(">II", 0, n), numpy.array([len(p) for p in payloads], ">u4").tobytes()),
+        full_box("co64", struct.pack(">I", n), numpy.asarray(offsets, ">u8").tobytes()),
+    )
+    trak = box(
+        "trak",
+        full_box("tkhd", struct.pack(">III", 0, 0, 1), b"\x00" * 68),
+        box("mdia",
+            full_box("mdhd", struct.pack(">IIII", 0, 0, timescale, n * sample_duration), b"\x00" * 4),
+            full_box("hdlr", b"\x00" * 4, b"meta", b"\x00" * 12),
+            box("minf", stbl)),
+    )
+    return ftyp + mdat + box("moov", full_box("mvhd", b"\x00" * 96), trak)
@@ -0,0 +1,326 @@
+import os
+import io
+import math
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import urllib.request
+
+import numpy
+
+from .cache import evict_lru
+
+
+logger = logging.getLogger(__name__)
+
+# Half the size of the Web Mercator (EPSG:3857) square, in meters
+MERCATOR_ORIGIN = 20037508.342789244
+WEB_MERCATOR = "EPSG:3857"
+
+
+class TileCache(object):
+    """ On-disk store of map tiles keyed by (provider, z, x, y)
+
+    When the total size of the store exceeds `max_size`, the least recently
+    used tiles are removed. A store can be seeded beforehand and used on
+    machines without network access through `CachedTileProvider`.
+
+    Parameters
+    ----------
+    directory: str
+        The store directory. It is created if needed.
+    max_size: int, optional (default=512MiB)
+        The maximum size of the store in bytes.
+    """
+
+    def __init__(self, directory, max_size=512 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._size = None
+
+    def _path(self, provider, z, x, y):
+        return os.path.join(self.directory, provider, str(z), str(x), str(y))
+
+    def load(self, provider, z, x, y):
+        """ Load a tile, returns its raw bytes or None if not found """
+        path = self._path(provider, z, x, y)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # The modification time tracks the last use of the tile. This is
+        # best effort: the tile may have been evicted by another process since,
+        # or the cache may be read-only.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def store(self, provider, z, x, y, data):
+        """ Store the raw bytes of a tile """
+        path = self._path(provider, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += len(data)
+            if self._size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used tiles until the store fits in `max_size`."""
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        self._size = evict_lru(entries, self.max_size)
+
+
+class DirectoryTileProvider(object):
+    """ Tiles read from a local directory tree, e.g. `{z}/{x}/{y}.png`
+
+    Parameters
+    ----------
+    directory: str
+        The root directory.
+    pattern: str, optional (default="{z}/{x}/{y}.png")
+        The path of the tiles relative to the root directory.
+    name: str, optional (default=None)
+        The provider name. The directory base name if None.
+    """
+
+    def __init__(self, directory, pattern="{z}/{x}/{y}.png", name=None):
+        self.directory = directory
+        self.pattern = pattern
+        self.name = name or os.path.basename(os.path.normpath(directory))
+
+    def get_tile(self, z, x, y):
+        """ Get the raw bytes of a tile, or None if not available """
+        try:
+            with open(os.path.join(self.directory, self.pattern.format(z=z, x=x, y=y)), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+class MBTilesProvider(object):
+    """ Tiles read from a MBTiles (SQLite) file
+
+    Parameters
+    ----------
+    path: str
+        The MBTiles file.
+    name: str, optional (default=None)
+        The provider name. The file base name if None.
+    """
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self._connection = None
+
+    def get_tile(self, z, x, y):
+        """ Get the raw bytes of a tile, or None if not available """
+        if self._connection is None:
+            self._connection = sqlite3.connect("file:%s?mode=ro" % self.path, uri=True)
+        # MBTiles rows follow the TMS scheme, with y going up.
+        row = self._connection.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (z, x, (1 << z) - 1 - y)
+        ).fetchone()
+        return None if row is None else bytes(row[0])
+
+
+class CachedTileProvider(object):
+    """ Tiles downloaded from a web provider and kept in a `TileCache`
+
+    Parameters
+    ----------
+    source: str, dict or xyzservices.TileProvider
+        A URL template with `{z}`, `{x}` and `{y}` placeholders or a provider
+        as given by `contextily.providers`.
+    cache: TileCache or str
+        The tile store, or its directory.
+    name: str, optional (default=None)
+        The provider name used in the store. Taken from `source` if None.
+    offline: bool, optional (default=False)
+        If True, never download tiles: only the tiles of the store are used.
+    timeout: float, optional (default=30)
+        The download timeout in seconds.
+    """
+
+    def __init__(self, source, cache, name=None, offline=False, timeout=30):
+        self.source = source
+        self.cache = cache if isinstance(cache, TileCache) else TileCache(cache)
+        if name is None:
+            name = source.get("name") if isinstance(source, dict) else None
+        if name is None:
+            name = hashlib.sha1(str(source).encode()).hexdigest()[:16]
+        self.name = name.replace("/", "_").replace(" ", "_")
+        self.offline = offline
+        self.timeout = timeout
+
+    def url(self, z, x, y):
+        if hasattr(self.source, "build_url"):
+            return self.source.build_url(x=x, y=y, z=z)
+        template = self.source["url"] if isinstance(self.source, dict) else self.source
+        return template.format(z=z, x=x, y=y, s="a")
+
+    def get_tile(self, z, x, y):
+        """ Get the raw bytes of a tile, or None if not available """
+        data = self.cache.load(self.name, z, x, y)
+        if data is not None or self.offline:
+            return data
+
+        request = urllib.request.Request(self.url(z, x, y), headers={"User-Agent": "pygpmf"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+        except OSError as e:
+            logger.warning("Could not download tile %i/%i/%i: %s", z, x, y, e)
+            return None
+
+        self.cache.store(self.name, z, x, y, data)
+        return data
+
+
+def open_tile_provider(source, cache_dir=None, offline=False):
+    """ Make a tile provider from a path or an URL
+
+    Parameters
+    ----------
+    source: str
+        A `.mbtiles` file, a directory of `{z}/{x}/{y}.png` tiles or a URL template.
+    cache_dir: str, optional (default=None)
+        For URL templates, the directory of the tile store.
+    offline: bool, optional (default=False)
+        For URL templates, only use the tiles of the store.
+
+    Returns
+    -------
+    provider: object
+        A tile provider with a `get_tile(z, x, y)` method.
+    """
+    if source.endswith(".mbtiles"):
+        return MBTilesProvider(source)
+    if os.path.isdir(source):
+        return DirectoryTileProvider(source)
+    if cache_dir is None:
+        raise ValueError("A cache directory is needed for web tiles")
+    return CachedTileProvider(source, cache_dir, offline=offline)
+
+
+def tile_range(left, bottom, right, top, zoom):
+    """ Find the tiles covering a Web Mercator bounding box
+
+    Returns
+    -------
+    x_range, y_range: tuple of int
+        The (first, last) tile indices along each axis.
+    """
+    n = 1 << zoom
+    tile_size = 2 * MERCATOR_ORIGIN / n
+
+    def clip(v):
+        return min(max(v, 0), n - 1)
+
+    x0 = clip(int(math.floor((left + MERCATOR_ORIGIN) / tile_size)))
+    x1 = clip(int(math.floor((right + MERCATOR_ORIGIN) / tile_size)))
+    y0 = clip(int(math.floor((MERCATOR_ORIGIN - top) / tile_size)))
+    y1 = clip(int(math.floor((MERCATOR_ORIGIN - bottom) / tile_size)))
+    return (x0, x1), (y0, y1)
+
+
+def _decode_tile(data):
+    from PIL import Image
+    return numpy.asarray(Image.open(io.BytesIO(data)).convert("RGBA"))
+
+
+def tiles_to_image(provider, left, bottom, right, top, zoom):
+    """ Assemble the tiles covering a Web Mercator bounding box into an image
+
+    Parameters
+    ----------
+    provider: object
+        A tile provider with a `get_tile(z, x, y)` method.
+    left, bottom, right, top: float
+        The bounding box in Web Mercator coordinates.
+    zoom: int
+        The zoom level.
+
+    Returns
+    -------
+    image: numpy.ndarray
+        The RGBA image. Missing tiles are transparent.
+    extent: tuple of float
+        The (left, right, bottom, top) extent of the image in Web Mercator coordinates.
+    """
+    (x0, x1), (y0, y1) = tile_range(left, bottom, right, top, zoom)
+
+    tiles = {}
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            data = provider.get_tile(zoom, x, y)
+            if data is not None:
+                tiles[x, y] = _decode_tile(data)
+
+    size = next(iter(tiles.values())).shape[0] if tiles else 256
+    image = numpy.zeros(((y1 - y0 + 1) * size, (x1 - x0 + 1) * size, 4), dtype="uint8")
+    for (x, y), tile in tiles.items():
+        image[(y - y0) * size:(y - y0 + 1) * size, (x - x0) * size:(x - x0 + 1) * size] = tile
+
+    tile_size = 2 * MERCATOR_ORIGIN / (1 << zoom)
+    extent = (
+        x0 * tile_size - MERCATOR_ORIGIN,
+        (x1 + 1) * tile_size - MERCATOR_ORIGIN,
+        MERCATOR_ORIGIN - (y1 + 1) * tile_size,
+        MERCATOR_ORIGIN - y0 * tile_size,
+    )
+    return image, extent
+
+
+def add_basemap(ax, provider, zoom, crs):
+    """ Draw the tiles of a provider as the background of matplotlib axes
+
+    This is the equivalent of `contextily.add_basemap` for the providers of
+    this module.
+
+    Parameters
+    ----------
+    ax: matplotlib.axes.Axes
+        The axes, whose limits are expressed in `crs`.
+    provider: object
+        A tile provider with a `get_tile(z, x, y)` method.
+    zoom: int
+        The zoom level.
+    crs: str or pyproj.CRS
+        The coordinate system of the axes.
+    """
+    import contextily as ctx
+    from pyproj import Transformer
+
+    xmin, xmax, ymin, ymax = ax.axis()
+    transformer = Transformer.from_crs(crs, WEB_MERCATOR, always_xy=True)
+    left, bottom, right, top = transformer.transform_bounds(xmin, ymin, xmax, ymax)
+
+    image, extent = tiles_to_image(provider, left, bottom, right, top, zoom)
+    image, extent = ctx.warp_tiles(image, extent, t_crs=crs)
+    ax.imshow(image, extent=extent, interpolation="bilinear", zorder=0)
+    ax.axis((xmin, xmax, ymin, ymax))
@@ -20,5 +20,8 @@ if __name__ == "__main__":
             "python-ffmpeg", "geopandas",
             "contextily", "descartes"
         ],
+        extras_require={
+            "export": ["pyarrow"]
+        },
         url="https://github.com/alexis-mignon/pygpmf"
     )
@@ -0,0 +1,39 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from gpmf import synthetic
+
+
+START_TIME = datetime(2020, 7, 3, 12, 0, 0)
+
+
+@pytest.fixture(scope="session")
+def payloads():
+    """ The payloads of a 30 s synthetic stream, one DEVC per second """
+    return synthetic.make_payloads(30, start_time=START_TIME)
+
+
+@pytest.fixture(scope="session")
+def stream(payloads):
+    """ A 30 s synthetic GPMF stream """
+    return b"".join(payloads)
+
+
+@pytest.fixture
+def make_video(tmp_path):
+    """ Write synthetic MP4 files, e.g. `make_video("GX010001.MP4", duration=10)` """
+    def make_video(name="video.mp4", duration=30, **kwargs):
+        kwargs.setdefault("start_time", START_TIME)
+        path = os.path.join(str(tmp_path), name)
+        with open(path, "wb") as f:
+            f.write(synthetic.make_mp4(synthetic.make_payloads(duration, **kwargs)))
+        return path
+    return make_video
+
+
+@pytest.fixture(autouse=True)
+def no_default_cache(monkeypatch):
+    """ Keep the tests independent of a cache configured in the environment """
+    monkeypatch.delenv("GPMF_CACHE_DIR", raising=False)
@@ -0,0 +1,65 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from gpmf import aio, cache, gps
+
+
+def test_extract_gps(make_video, tmp_path):
+    video = make_video()
+    expected = gps.extract_gps_from_file(video, cache=False)
+    telemetry_cache = cache.TelemetryCache(str(tmp_path / "cache"))
+
+    async def main():
+        return await asyncio.gather(
+            aio.extract_gps(video, cache=False),
+            aio.extract_gps(video, cache=telemetry_cache, timeout=30),
+            aio.extract_gps(video, cache=telemetry_cache),
+        )
+
+    for gps_data in asyncio.run(main()):
+        assert (gps_data == expected).all()
+
+
+def test_extract_gpmf_stream(make_video, stream):
+    assert asyncio.run(aio.extract_gpmf_stream(make_video(), cache=False)) == stream
+
+
+def test_concurrency_limit(make_video, monkeypatch):
+    video = make_video(duration=2)
+    running = []
+    peak = []
+
+    async def extract(fname, use_ffmpeg):
+        running.append(fname)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(fname)
+        return b""
+
+    monkeypatch.setattr(aio, "_extract_gpmf_stream", extract)
+    aio.set_concurrency(2)
+    try:
+        async def main():
+            return await asyncio.gather(*[aio.extract_gpmf_stream(video, cache=False) for _ in range(6)])
+        assert asyncio.run(main()) == [b""] * 6
+    finally:
+        aio.set_concurrency(aio.DEFAULT_CONCURRENCY)
+    assert max(peak) == 2
+
+
+def test_timeout_kills_subprocess():
+    async def main():
+        await asyncio.wait_for(aio._communicate(sys.executable, "-c", "import time; time.sleep(60)"), 0.5)
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert time.perf_counter() - start < 30
+
+
+def test_subprocess_error():
+    with pytest.raises(RuntimeError):
+        asyncio.run(aio._communicate(sys.executable, "-c", "import sys; sys.exit(3)"))
@@ -0,0 +1,71 @@
+import os
+
+import numpy
+import pytest
+
+from gpmf import cache, gps
+
+
+def test_get_computes_once(tmp_path, make_video):
+    video = make_video()
+    telemetry_cache = cache.TelemetryCache(str(tmp_path / "cache"))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return numpy.arange(10)
+
+    for _ in range(2):
+        value = telemetry_cache.get(video, "values", compute, value_type=numpy.ndarray)
+        numpy.testing.assert_array_equal(value, numpy.arange(10))
+    assert len(calls) == 1
+
+
+def test_modified_file_is_extracted_again(tmp_path, make_video):
+    video = make_video(duration=5)
+    key = cache.file_key(video)
+    assert cache.file_key(video) == key
+
+    make_video(duration=6)
+    assert cache.file_key(video) != key
+
+
+def test_evict_lru(tmp_path):
+    telemetry_cache = cache.TelemetryCache(str(tmp_path), max_size=250)
+    for i, name in enumerate(["a", "b", "c"]):
+        telemetry_cache.store("key", name, b"x" * 100)
+        path = os.path.join(str(tmp_path), "key-%s.bin" % name)
+        os.utime(path, (i, i))
+    telemetry_cache.evict()
+
+    assert telemetry_cache.load("key", "a") is None
+    assert telemetry_cache.load("key", "c") == b"x" * 100
+
+
+@pytest.mark.parametrize("error", [FileNotFoundError, PermissionError])
+def test_load_when_touching_fails(tmp_path, monkeypatch, error):
+    # Evicted by another process after the read, or a read-only cache
+    telemetry_cache = cache.TelemetryCache(str(tmp_path))
+    telemetry_cache.store("key", "a", b"x" * 100)
+
+    def utime(path, *args, **kwargs):
+        raise error(path)
+    monkeypatch.setattr(os, "utime", utime)
+    assert telemetry_cache.load("key", "a") == b"x" * 100
+
+
+def test_extract_gps_from_file(tmp_path, make_video):
+    video = make_video()
+    telemetry_cache = cache.TelemetryCache(str(tmp_path / "cache"))
+    expected = gps.extract_gps_from_file(video, cache=False)
+
+    for _ in range(2):
+        numpy.testing.assert_array_equal(gps.extract_gps_from_file(video, cache=telemetry_cache), expected)
+    assert len(os.listdir(str(tmp_path / "cache"))) > 0
+
+
+def test_default_cache(tmp_path, monkeypatch):
+    assert cache.resolve_cache(None) is None
+    monkeypatch.setenv(cache.CACHE_DIR_VARIABLE, str(tmp_path))
+    assert cache.resolve_cache(None).directory == str(tmp_path)
+    assert cache.resolve_cache(False) is None
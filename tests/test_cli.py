@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_cli(*args, **kwargs):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("GPMF_CACHE_DIR", None)
+    return subprocess.run([sys.executable, "-m", "gpmf"] + list(args), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+
+def test_gps_extract(make_video, tmp_path):
+    video = make_video()
+    result = run_cli("gps-extract", video, "-o", str(tmp_path / "track.gpx"))
+    assert result.returncode == 0
+    assert (tmp_path / "track.gpx").read_text().count("<trkpt") == 30 * 18
+
+
+def test_gps_first(make_video):
+    result = run_cli("gps-first", make_video())
+    assert result.returncode == 0
+    assert json.loads(result.stdout.decode())["latitude"] == pytest.approx(45.0000025)
+
+
+@pytest.mark.parametrize("command", ["gps-extract", "gps-first"])
+def test_single_file_error(tmp_path, command):
+    result = run_cli(command, str(tmp_path / "missing.mp4"))
+    assert result.returncode == 1
+    assert b"No such file" in result.stderr
+    assert b"Traceback" not in result.stderr
+
+
+def test_truncated_file(make_video, tmp_path):
+    video = make_video()
+    truncated = str(tmp_path / "truncated.mp4")
+    with open(video, "rb") as f, open(truncated, "wb") as out_file:
+        out_file.write(f.read(3000))
+    result = run_cli("gps-extract", truncated)
+    assert result.returncode == 1
+    assert b"Traceback" not in result.stderr
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch(make_video, tmp_path, jobs):
+    videos = [make_video("a.mp4"), make_video("b.mp4", seed=1)]
+    missing = str(tmp_path / "missing.mp4")
+    result = run_cli("gps-first", "--jobs", jobs, videos[0], missing, videos[1])
+
+    assert result.returncode == 1
+    lines = [json.loads(line) for line in result.stdout.decode().splitlines()]
+    assert [line["file"] for line in lines] == [videos[0], missing, videos[1]]
+    assert ["error" in line for line in lines] == [False, True, False]
+    assert b"3 files processed, 1 failed" in result.stderr
+
+
+def test_gps_extract_window(make_video, tmp_path):
+    result = run_cli("gps-extract", make_video(), "--start", "5", "--end", "2020-07-03T12:00:10",
+                     "-o", str(tmp_path / "track.gpx"))
+    assert result.returncode == 0
+    assert (tmp_path / "track.gpx").read_text().count("<trkpt") == 5 * 18
+
+
+def test_offline_requires_tiles(make_video):
+    result = run_cli("gps-plot", make_video(), "--offline")
+    assert result.returncode == 2
+    assert b"--offline requires" in result.stderr
+
+
+def test_profile(make_video):
+    result = run_cli("gps-first", make_video(), "--profile")
+    assert result.returncode == 0
+    assert "stages" in json.loads(result.stderr.decode())
+
+
+def test_gps_extract_stdin(make_video, stream, tmp_path):
+    video = make_video()
+    expected = run_cli("gps-extract", video, "-o", str(tmp_path / "track.gpx"))
+    assert expected.returncode == 0
+
+    result = run_cli("gps-extract", "-", input=stream)
+    assert result.returncode == 0
+    assert result.stdout.decode() == (tmp_path / "track.gpx").read_text()
+
+
+def test_stdin_rejected(make_video):
+    result = run_cli("gps-first", "-", input=b"")
+    assert result.returncode == 2
+    assert b"standard input" in result.stderr
+
+
+def test_index_and_query(make_video, tmp_path):
+    index_file = str(tmp_path / "index.db")
+    video = make_video()
+    result = run_cli("index", video, "-x", index_file)
+    assert result.returncode == 0
+    assert json.loads(result.stdout.decode()) == {"indexed": 1, "unchanged": 0, "failed": 0}
+
+    result = run_cli("query", "-x", index_file, "-b", "44.9", "4.9", "45.1", "5.1", "--start", "2020-07-03T12:00:10")
+    assert result.returncode == 0
+    matches = [json.loads(line) for line in result.stdout.decode().splitlines()]
+    assert len(matches) == 1
+    assert matches[0]["file"] == os.path.abspath(video)
+    assert matches[0]["start"] == pytest.approx(10., abs=1e-3)
+    assert matches[0]["offset"] == pytest.approx(10., abs=1e-3)
+
+    assert run_cli("query", "-x", str(tmp_path / "missing.db"), "-p", "45", "5").returncode == 1
+
+
+@pytest.mark.parametrize("interval", ["0", "-1"])
+def test_interval_must_be_positive(make_video, interval):
+    result = run_cli("gps-extract", make_video(), "-i", interval)
+    assert result.returncode == 2
+    assert b"must be positive" in result.stderr
@@ -0,0 +1,78 @@
+import numpy
+import pytest
+
+from gpmf import __main__ as cli
+from gpmf import export, gps, sensors
+
+
+@pytest.fixture
+def pandas():
+    return pytest.importorskip("pandas")
+
+
+@pytest.fixture
+def gps_data(stream):
+    return gps.extract_gps(stream)
+
+
+def test_cli_defaults():
+    # The command line keeps its own copy, so as not to import gpmf.export
+    assert cli.EXPORT_FORMATS == tuple(sorted(export.FORMATS))
+    assert cli.EXPORT_CHUNK_SIZE == export.CHUNK_SIZE
+
+
+def test_to_dataframe(gps_data, pandas):
+    df = export.to_dataframe(gps_data)
+    assert list(df.columns) == list(export.gps_columns(gps_data))
+    numpy.testing.assert_array_equal(df["latitude"], gps_data["latitude"])
+    numpy.testing.assert_array_equal(df["time"], gps.interpolate_times(gps_data))
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "bz2"])
+def test_csv(gps_data, tmp_path, compression, pandas):
+    path = str(tmp_path / ("gps" + export.file_extension("csv", compression)))
+    export.export(gps_data, path, compression=compression, chunk_size=100)
+    df = pandas.read_csv(path, compression="infer")
+    assert len(df) == len(gps_data)
+    numpy.testing.assert_allclose(df["latitude"], gps_data["latitude"])
+    numpy.testing.assert_array_equal(df["block_id"], gps_data["block_id"])
+
+
+def test_sensor_columns(stream, tmp_path, pandas):
+    accl = sensors.extract_sensor(stream, "ACCL")
+    path = str(tmp_path / "accl.csv")
+    export.export(accl, path, columns=["time", "accl_2"])
+    df = pandas.read_csv(path)
+    assert list(df.columns) == ["time", "accl_2"]
+    numpy.testing.assert_allclose(df["accl_2"], accl.values[:, 2])
+
+
+def test_errors(gps_data, tmp_path):
+    with pytest.raises(ValueError):
+        export.export(gps_data, str(tmp_path / "gps.txt"))
+    with pytest.raises(ValueError):
+        export.export(gps_data, str(tmp_path / "gps.csv"), columns=["unknown"])
+    with pytest.raises(ValueError):
+        export.export(gps_data, str(tmp_path / "gps.csv"), compression="zip")
+
+
+def test_guess_format():
+    assert export.guess_format("a.gps.parquet") == "parquet"
+    assert export.guess_format("a.arrow") == "feather"
+    assert export.guess_format("a.csv.gz") == "csv"
+
+
+@pytest.mark.parametrize("format", ["parquet", "feather"])
+def test_arrow_formats(gps_data, tmp_path, format):
+    pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    path = str(tmp_path / ("gps" + export.FORMATS[format]))
+    export.export(gps_data, path, compression="zstd", chunk_size=100)
+    if format == "parquet":
+        assert pyarrow.parquet.ParquetFile(path).num_row_groups == -(-len(gps_data) // 100)
+        table = pyarrow.parquet.read_table(path)
+    else:
+        table = pyarrow.feather.read_table(path)
+    numpy.testing.assert_array_equal(table.column("latitude").to_numpy(), gps_data["latitude"])
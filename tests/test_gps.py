@@ -0,0 +1,155 @@
+import io
+import struct
+
+import numpy
+import pytest
+
+from gpmf import gps, parse, synthetic
+from gpmf.io import iter_gpmf_stream
+
+
+def test_extract_gps_matches_blocks(stream):
+    gps_data = gps.extract_gps(stream)
+    blocks = list(map(gps.parse_gps_block, gps.extract_gps_blocks(stream)))
+    expected = gps.concatenate_gps_blocks(blocks)
+
+    assert len(gps_data) == 30 * 18
+    assert gps_data.dtype == gps.GPS_DTYPE
+    for name in gps.GPS_DTYPE.names:
+        numpy.testing.assert_array_equal(gps_data[name], expected[name], err_msg=name)
+    numpy.testing.assert_array_equal(numpy.bincount(gps_data["block_id"]), [b.npoints for b in blocks])
+
+
+def test_extract_gps_values(stream):
+    gps_data = gps.extract_gps(stream)
+    assert gps_data["latitude"][0] == 45.0000025
+    assert gps_data["longitude"][0] == 5.
+    assert (gps_data["fix"] == 3).all()
+    numpy.testing.assert_allclose(gps_data["precision"], 1.5)
+    assert gps_data["time"][0] == numpy.datetime64("2020-07-03T12:00:00")
+    assert gps_data["time"][18] == numpy.datetime64("2020-07-03T12:00:01")
+
+
+def test_extract_gps_without_gps():
+    assert len(gps.extract_gps(b"")) == 0
+
+
+def test_find_first_gps(make_video, stream):
+    video = make_video()
+    first = gps.find_first_gps(video)
+    expected = gps.parse_gps_block(next(gps.extract_gps_blocks(stream)))
+    assert first.timestamp == expected.timestamp
+    numpy.testing.assert_array_equal(first.latitude, expected.latitude)
+
+    assert gps.find_first_gps(video, skip_no_fix=True, max_precision=2.).timestamp == expected.timestamp
+    assert gps.find_first_gps(video, skip_no_fix=True, max_precision=1.) is None
+
+
+@pytest.mark.parametrize("error", [RuntimeError, ValueError, struct.error])
+def test_find_first_gps_falls_back(make_video, monkeypatch, error):
+    video = make_video()
+    expected = gps.find_first_gps(video)
+
+    def undecodable(fname):
+        raise error("undecodable sample")
+        yield
+
+    monkeypatch.setattr(gps, "_iter_sample_gps_blocks", undecodable)
+    assert gps.find_first_gps(video).timestamp == expected.timestamp
+
+
+def _without_block_id(gps_data):
+    return gps_data[[name for name in gps.GPS_DTYPE.names if name != "block_id"]]
+
+
+@pytest.mark.parametrize("start, end", [
+    (5, 10),
+    (5.5, None),
+    (None, 3),
+    ("2020-07-03T12:00:05", "2020-07-03T12:00:10Z"),
+    (numpy.datetime64("2020-07-03T12:00:05"), None),
+])
+def test_extract_gps_window(make_video, start, end):
+    video = make_video()
+    gps_data = gps.extract_gps_from_file(video)
+    video_time = (gps_data["time"] - gps_data["time"][0]) / numpy.timedelta64(1, "s")
+    start_s = 5 if gps._is_utc(start) else start
+    end_s = 10 if gps._is_utc(end) else end
+    mask = numpy.ones(len(gps_data), dtype=bool)
+    if start_s is not None:
+        mask &= video_time >= start_s
+    if end_s is not None:
+        mask &= video_time < end_s
+
+    window = gps.extract_gps_window(video, start, end)
+    assert len(window) == mask.sum()
+    assert (_without_block_id(window) == _without_block_id(gps_data[mask])).all()
+
+
+def test_extract_gps_window_outside(make_video):
+    assert len(gps.extract_gps_window(make_video(), 100, 200)) == 0
+
+
+def test_interpolate_times(stream):
+    gps_data = gps.extract_gps(stream)
+    time = gps.interpolate_times(gps_data)
+    assert time.dtype == numpy.dtype("datetime64[ns]")
+    step = numpy.timedelta64(round(1e9 / 18), "ns")
+    assert (numpy.abs(numpy.diff(time) - step) <= numpy.timedelta64(1, "ns")).all()
+    assert time[0] == numpy.datetime64("2020-07-03T12:00:00")
+
+
+def test_interpolate_times_without_timestamps(stream):
+    gps_data = gps.extract_gps(stream)
+    expected = gps.interpolate_times(gps_data)
+
+    # A block without GPSU is interpolated between its neighbours
+    gps_data["time"][gps_data["block_id"] == 4] = numpy.datetime64("NaT")
+    numpy.testing.assert_array_equal(gps.interpolate_times(gps_data), expected)
+
+    # The samples preceding the first timestamp are NaT
+    first_block = gps_data["block_id"] == 0
+    gps_data["time"][first_block] = numpy.datetime64("NaT")
+    time = gps.interpolate_times(gps_data)
+    assert numpy.isnat(time[first_block]).all()
+    numpy.testing.assert_array_equal(time[~first_block], expected[~first_block])
+
+    gps_data["time"] = numpy.datetime64("NaT")
+    assert numpy.isnat(gps.interpolate_times(gps_data)).all()
+    assert len(gps.interpolate_times(gps_data[:0])) == 0
+
+
+def test_extract_gps9(stream):
+    gps5 = gps.extract_gps(stream)
+    gps9 = gps.extract_gps(synthetic.make_stream(30, gps_fourcc="GPS9"))
+
+    assert len(gps9) == len(gps5)
+    for name in ["latitude", "longitude", "altitude", "speed_2d", "speed_3d", "precision", "fix", "block_id"]:
+        numpy.testing.assert_allclose(gps9[name], gps5[name], atol=1e-6, err_msg=name)
+    assert (numpy.abs(gps9["time"] - gps5["time"]) <= numpy.timedelta64(1, "ms")).all()
+
+
+def test_extract_gps9_from_file(make_video):
+    video = make_video(gps_fourcc="GPS9")
+    assert len(gps.extract_gps_from_file(video)) == 30 * 18
+
+
+@pytest.mark.parametrize("batch_size", [1, 1000, parse.BATCH_SIZE])
+def test_extract_gps_incremental(stream, batch_size):
+    expected = gps.extract_gps(stream)
+    payloads = parse.read_klv_stream(io.BytesIO(stream), 100)
+    numpy.testing.assert_array_equal(gps.extract_gps_incremental(payloads, batch_size), expected)
+
+
+def test_extract_gps_incremental_with_empty_blocks():
+    # Groups ending with an empty GPS block (repeat 0)
+    payloads = [payload for pair in zip(synthetic.make_payloads(5), synthetic.make_payloads(5, gps_rate=0))
+                for payload in pair]
+    numpy.testing.assert_array_equal(gps.extract_gps_incremental(payloads, 1),
+                                     gps.extract_gps(b"".join(payloads)))
+
+
+def test_extract_gps_incremental_from_file(make_video, stream):
+    numpy.testing.assert_array_equal(gps.extract_gps_incremental(iter_gpmf_stream(make_video())),
+                                     gps.extract_gps(stream))
+    assert len(gps.extract_gps_incremental([])) == 0
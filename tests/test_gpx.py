@@ -0,0 +1,46 @@
+import io
+from xml.etree import ElementTree as ET
+
+import numpy
+import pytest
+
+from gpmf import gps, gpx
+
+
+def _points(xml):
+    # The track points of a GPX document, without the header
+    return xml[xml.index("<trkseg>"):]
+
+
+@pytest.mark.parametrize("version", ["1.0", "1.1"])
+@pytest.mark.parametrize("speeds_as_extensions", [True, False])
+def test_write_gpx_matches_gpxpy(stream, version, speeds_as_extensions):
+    gpxpy_gpx = pytest.importorskip("gpxpy.gpx")
+
+    document = gpxpy_gpx.GPX()
+    track = gpxpy_gpx.GPXTrack()
+    document.tracks.append(track)
+    blocks = list(map(gps.parse_gps_block, gps.extract_gps_blocks(stream)))
+    track.segments.append(gps.make_pgx_segment(blocks, speeds_as_extensions=speeds_as_extensions))
+
+    out_file = io.StringIO()
+    gpx.write_gpx(gps.concatenate_gps_blocks(blocks), out_file, version=version,
+                  speeds_as_extensions=speeds_as_extensions, chunk_size=100)
+    assert _points(out_file.getvalue()) == _points(document.to_xml(version=version))
+
+
+def test_write_gpx(stream):
+    gps_data = gps.extract_gps(stream)
+    out_file = io.StringIO()
+    gpx.write_gpx(gps_data, out_file, chunk_size=7)
+
+    namespace = {"gpx": "http://www.topografix.com/GPX/1/1"}
+    points = ET.fromstring(out_file.getvalue().encode()).findall(".//gpx:trkpt", namespace)
+    assert len(points) == len(gps_data)
+    numpy.testing.assert_array_equal([float(p.get("lat")) for p in points], gps_data["latitude"])
+    assert points[18].find("gpx:time", namespace).text == "2020-07-03T12:00:01"
+
+
+def test_write_gpx_version():
+    with pytest.raises(ValueError):
+        gpx.write_gpx(numpy.zeros(0, dtype=gps.GPS_DTYPE), io.StringIO(), version="2.0")
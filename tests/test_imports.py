@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY_MODULES = ["pandas", "pyarrow", "matplotlib", "geopandas", "contextily", "gpxpy"]
+
+
+def _loaded_modules(module):
+    code = "import sys, %s; print(' '.join(sys.modules))" % module
+    return set(subprocess.check_output([sys.executable, "-c", code]).decode().split())
+
+
+@pytest.mark.parametrize("module", ["gpmf", "gpmf.gps", "gpmf.__main__"])
+def test_no_heavy_dependency_at_import(module):
+    loaded = _loaded_modules(module)
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
+
+
+def test_submodules_are_lazy():
+    loaded = _loaded_modules("gpmf")
+    assert "gpmf.gps" not in loaded
+
+    import gpmf
+    assert gpmf.gps.extract_gps is not None
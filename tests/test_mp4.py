@@ -0,0 +1,47 @@
+import io
+
+import numpy
+import pytest
+
+from gpmf import mp4, synthetic
+from gpmf.io import extract_gpmf_stream, extract_gpmf_stream_native
+
+
+def test_find_gpmf_track(payloads):
+    f = io.BytesIO(synthetic.make_mp4(payloads, timescale=1000, sample_duration=1001))
+    track = mp4.find_gpmf_track(f)
+
+    assert track.timescale == 1000
+    numpy.testing.assert_array_equal(track.sizes, [len(p) for p in payloads])
+    numpy.testing.assert_allclose(track.times, numpy.arange(len(payloads)) * 1.001)
+    numpy.testing.assert_allclose(track.durations, 1.001)
+
+
+def test_read_samples(payloads):
+    f = io.BytesIO(synthetic.make_mp4(payloads))
+    track = mp4.find_gpmf_track(f)
+
+    assert mp4.read_samples(f, track) == b"".join(payloads)
+    assert mp4.read_samples(f, track, 3, 5) == payloads[3] + payloads[4]
+    assert mp4.read_samples(f, track, 5, 5) == b""
+
+
+def test_no_gpmf_track():
+    with pytest.raises(RuntimeError):
+        mp4.find_gpmf_track(io.BytesIO(b"\x00\x00\x00\x10ftypmp41\x00\x00\x00\x00"))
+
+
+def test_sample_range(payloads):
+    track = mp4.find_gpmf_track(io.BytesIO(synthetic.make_mp4(payloads, sample_duration=1000)))
+    assert mp4.sample_range(track) == (0, len(payloads))
+    assert mp4.sample_range(track, 2.5, 4.5) == (2, 5)
+    assert mp4.sample_range(track, 100, None) == (len(payloads), len(payloads))
+
+    sliced = mp4.slice_track(track, 2, 5)
+    numpy.testing.assert_array_equal(sliced.times, [2., 3., 4.])
+
+
+def test_extract_gpmf_stream_native(make_video, stream):
+    path = make_video()
+    assert extract_gpmf_stream_native(path) == stream
+    assert extract_gpmf_stream(path, cache=False) == stream
@@ -0,0 +1,73 @@
+import io
+
+import numpy
+import pytest
+
+from gpmf import gps, mp4, parallel, parse, sensors, synthetic
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Split the small synthetic streams as if they were large
+    monkeypatch.setattr(parallel, "MIN_CHUNK_SIZE", 1)
+
+
+def _assert_same_sensors(a, b):
+    assert sorted(a) == sorted(b)
+    for fourcc in a:
+        assert a[fourcc].description == b[fourcc].description
+        assert a[fourcc].units == b[fourcc].units
+        numpy.testing.assert_array_equal(a[fourcc].values, b[fourcc].values)
+        numpy.testing.assert_array_equal(a[fourcc].time, b[fourcc].time)
+        numpy.testing.assert_array_equal(a[fourcc].block_id, b[fourcc].block_id)
+
+
+@pytest.mark.parametrize("n_chunks", [1, 2, 3, 8, 100])
+def test_split_stream(stream, n_chunks):
+    items = parse._top_level_items(memoryview(stream))
+    bounds = parallel.split_stream(stream, n_chunks)
+    assert bounds[0] == 0 and bounds[-1] == len(stream)
+    assert 1 <= len(bounds) - 1 <= n_chunks
+    assert numpy.isin(bounds[:-1], items).all()
+    assert (numpy.diff(numpy.searchsorted(items, bounds)) >= 2).all()
+
+
+def test_split_stream_boundaries(stream):
+    items = parse._top_level_items(memoryview(stream))
+    bounds = parallel.split_stream(stream, 4, boundaries=items[::10])
+    numpy.testing.assert_array_equal(bounds, list(items[::10]) + [len(stream)])
+    numpy.testing.assert_array_equal(parallel.split_stream(stream[:-10], 4), [0, len(stream) - 10])
+    numpy.testing.assert_array_equal(parallel.split_stream(synthetic.make_stream(3), 4),
+                                     [0, len(synthetic.make_stream(3))])
+
+
+def _with_empty_blocks():
+    # Alternate blocks of 18 GPS points with empty GPS blocks (repeat 0)
+    payloads = zip(synthetic.make_payloads(15), synthetic.make_payloads(15, gps_rate=0))
+    return b"".join(payload for pair in payloads for payload in pair)
+
+
+@pytest.mark.parametrize("stream", [
+    synthetic.make_stream(30), synthetic.make_stream(30, gps_fourcc="GPS9"), _with_empty_blocks()
+], ids=["GPS5", "GPS9", "empty blocks"])
+def test_extract_gps(stream):
+    assert len(parallel.split_stream(stream, 2 * parallel.CHUNKS_PER_JOB)) > 2
+    numpy.testing.assert_array_equal(parallel.extract_gps(stream, jobs=2), gps.extract_gps(stream))
+
+
+def test_extract_sensors(payloads, stream):
+    _assert_same_sensors(parallel.extract_sensors(stream, jobs=2), sensors.extract_sensors(stream))
+
+    track = mp4.find_gpmf_track(io.BytesIO(synthetic.make_mp4(payloads, sample_duration=1001)))
+    _assert_same_sensors(parallel.extract_sensors(stream, track=track, jobs=2),
+                         sensors.extract_sensors(stream, track=track))
+
+
+def test_extract_gps_from_file(make_video, stream):
+    numpy.testing.assert_array_equal(gps.extract_gps_from_file(make_video(), jobs=2), gps.extract_gps(stream))
+
+
+def test_extract_sensors_relative_times(payloads):
+    # STMP starting after the device clock, the chunks being timed from the start of the stream
+    stream = b"".join(payloads[5:])
+    _assert_same_sensors(parallel.extract_sensors(stream, jobs=2), sensors.extract_sensors(stream))
@@ -0,0 +1,175 @@
+import io
+import logging
+
+import numpy
+import pytest
+
+from gpmf import parse, profiling, synthetic
+
+
+def _assert_same_items(a, b):
+    assert len(a) == len(b)
+    for item_a, item_b in zip(a, b):
+        assert item_a.key == item_b.key
+        assert item_a.length == item_b.length
+        if item_a.length.type == "\x00":
+            _assert_same_items(item_a.value, item_b.value)
+        else:
+            numpy.testing.assert_array_equal(item_a.value, item_b.value)
+
+
+def test_iter_klv_inputs(stream):
+    expected = parse.expand_klv(stream)
+    assert len(expected) == 30
+    assert [item.key for item in expected[0].value] == ["DVID", "DVNM", "STRM", "STRM", "STRM"]
+
+    _assert_same_items(parse.expand_klv(memoryview(stream)), expected)
+    _assert_same_items(parse.expand_klv(bytearray(stream)), expected)
+
+
+def test_iter_klv_values(stream):
+    devc = next(parse.iter_klv(stream))
+    items = {item.key: item for item in devc.value}
+    assert items["DVNM"].value == "Synthetic camera"
+    assert items["DVID"].value == 1
+
+
+def _walk(items, depth=0, parent=-1, records=None):
+    # Flatten expanded items into (fourcc, depth, parent) in stream order
+    records = [] if records is None else records
+    for item in items:
+        records.append((item.key, depth, parent))
+        if item.length.type == "\x00":
+            _walk(item.value, depth + 1, len(records) - 1, records)
+    return records
+
+
+def test_build_index(stream):
+    index = parse.build_index(stream)
+    expected = _walk(parse.expand_klv(stream))
+
+    assert [(fourcc.decode(), int(depth), int(parent))
+            for fourcc, depth, parent in index[["fourcc", "depth", "parent"]]] == expected
+    assert (numpy.diff(index["offset"]) > 0).all()
+    assert parse.payload_end(index[index["depth"] == 0])[-1] == len(stream)
+
+
+def test_index_queries(stream):
+    index = parse.build_index(stream)
+    devcs = parse.find_items(index, "DEVC")
+    assert len(devcs) == 30
+    assert len(parse.find_items(index, "SCAL", parent="STRM")) == 90
+
+    children = parse.child_items(index, devcs[1])
+    assert [index["fourcc"][i].decode() for i in children] == ["DVID", "DVNM", "STRM", "STRM", "STRM"]
+    assert len(parse.items_between(index, index["offset"][devcs[1]], index["offset"][devcs[2]])) == \
+        devcs[2] - devcs[1]
+
+    expected = next(parse.iter_klv(stream)).value
+    for i, item in zip(parse.child_items(index, devcs[0]), expected):
+        decoded = parse.decode_item(stream, index, i)
+        assert decoded.key == item.key
+        if item.length.type != "\x00":
+            numpy.testing.assert_array_equal(decoded.value, item.value)
+
+
+def test_filter_klv(stream):
+    expected = [item for devc in parse.expand_klv(stream) for strm in devc.value if strm.key == "STRM"
+                for item in strm.value if item.key in ("GPS5", "SCAL")]
+
+    _assert_same_items(list(parse.filter_klv(stream, ["GPS5", "SCAL"])), expected)
+    lazy = list(parse.filter_klv(stream, ["GPS5", "SCAL"], lazy=True))
+    _assert_same_items([item.to_klv_item() for item in lazy], expected)
+
+
+def test_filter_klv_only_decodes_selected_items(stream):
+    with profiling.Profile() as profile:
+        items = [item.value for item in parse.filter_klv(stream, ["GPS5"], lazy=True)]
+    assert len(items) == 30
+    assert profile.report()["stages"]["decode_payload"]["items_decoded"] == 30
+
+
+def test_lookup_children(stream):
+    index = parse.build_index(stream)
+    strms = parse.find_items(index, "STRM")
+    positions = parse.lookup_children(index, strms, "GPSU")
+    gps_strms = strms[positions >= 0]
+    assert len(gps_strms) == 30
+    numpy.testing.assert_array_equal(index["parent"][positions[positions >= 0]], gps_strms)
+
+    # Unsorted parents
+    order = numpy.random.RandomState(0).permutation(len(strms))
+    numpy.testing.assert_array_equal(parse.lookup_children(index, strms[order], "GPSU"), positions[order])
+
+    # An index which is not sorted by offset
+    reverse = index[::-1]
+    positions = parse.lookup_children(reverse, gps_strms, "GPSU")
+    assert (positions >= 0).all()
+    numpy.testing.assert_array_equal(reverse["parent"][positions], gps_strms)
+    assert (reverse["fourcc"][positions] == b"GPSU").all()
+
+
+def _mixed_stream():
+    # Blocks of several layouts: different rates, GPS9 and a block without GPS
+    blocks = (synthetic.make_payloads(3) + synthetic.make_payloads(2, gps_rate=10)
+              + synthetic.make_payloads(2, gps_fourcc="GPS9") + synthetic.make_payloads(3, seed=1))
+    blocks.insert(4, synthetic.make_container("DEVC", [synthetic.make_klv("DVNM", "c", b"other")]))
+    return b"".join(blocks)
+
+
+@pytest.mark.parametrize("max_layouts", [None, 1])
+def test_layout_index_matches_generic_index(stream, monkeypatch, max_layouts):
+    if max_layouts is not None:
+        monkeypatch.setattr(parse, "MAX_LAYOUTS", max_layouts)
+    for x in [stream, _mixed_stream(), synthetic.make_stream(1), stream[:-10]]:
+        generic = parse._build_index(x)
+        numpy.testing.assert_array_equal(parse.build_index(x), generic)
+        numpy.testing.assert_array_equal(parse.build_index(memoryview(x)), generic)
+
+
+def test_layout_index_is_used(stream):
+    assert parse._build_index_by_layout(stream) is not None
+    assert parse._build_index_by_layout(stream[:-10]) is None
+
+
+def test_compile_type():
+    dtype = parse.compile_type("lllllllSS")
+    assert dtype.names == tuple("f%i" % i for i in range(9))
+    assert dtype["f0"] == numpy.dtype(">i4") and dtype["f8"] == numpy.dtype(">u2")
+    assert parse.compile_type("f[4]c[3]")["f0"].shape == (4,)
+    assert parse.compile_type("f[4]c[3]")["f1"] == numpy.dtype("S3")
+    with pytest.raises(ValueError):
+        parse.compile_type("lZ")
+
+
+def test_complex_payloads():
+    stream = synthetic.make_stream(2, gps_fourcc="GPS9")
+    gps9 = [item for item in parse.filter_klv(stream, ["GPS9"])]
+    assert len(gps9) == 2
+    assert gps9[0].value.dtype == parse.compile_type("lllllllSS")
+    assert len(gps9[0].value) == 18
+
+    index = parse.build_index(stream)
+    items = parse.find_items(index, "GPS9")
+    numpy.testing.assert_array_equal(parse.decode_item(stream, index, items[1]).value, gps9[1].value)
+    assert parse.lookup_type(stream, index, index["parent"][items]) == gps9[0].value.dtype
+
+
+@pytest.mark.parametrize("read_size", [1, 100, 1 << 20])
+def test_read_klv_stream(payloads, read_size):
+    assert list(parse.read_klv_stream(io.BytesIO(b"".join(payloads)), read_size)) == payloads
+
+
+def test_read_klv_stream_truncated(payloads, caplog):
+    with caplog.at_level(logging.WARNING, logger="gpmf.parse"):
+        read = list(parse.read_klv_stream(io.BytesIO(b"".join(payloads)[:-10]), 100))
+    assert read == payloads[:-1]
+    assert "%i bytes are ignored" % (len(payloads[-1]) - 10) in caplog.text
+
+
+def test_group_payloads(payloads):
+    groups = list(parse.group_payloads(payloads, 3 * len(payloads[0])))
+    assert b"".join(groups) == b"".join(payloads)
+    assert len(groups) == 10
+    assert list(parse.group_payloads(payloads, 1)) == payloads
+    assert list(parse.group_payloads([])) == []
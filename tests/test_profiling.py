@@ -0,0 +1,43 @@
+import json
+
+from gpmf import gps, parse, profiling
+
+
+def test_profile(stream):
+    completed = []
+    with profiling.Profile(callback=lambda stage, seconds, counters: completed.append(stage)) as profile:
+        gps_data = gps.extract_gps(stream)
+
+    report = profile.report()
+    assert report["wall_time"] > 0
+    stages = report["stages"]
+    assert stages["extract_gps"]["calls"] == 1
+    assert stages["extract_gps"]["bytes"] == len(stream)
+    assert stages["extract_gps"]["points"] == len(gps_data)
+    assert stages["build_index"]["items_visited"] == len(parse.build_index(stream))
+    assert set(completed) == set(stages)
+    assert json.loads(profile.to_json()) == report
+
+
+def test_nested_profiles(stream):
+    with profiling.Profile() as outer:
+        gps.extract_gps(stream)
+        with profiling.Profile() as inner:
+            gps.extract_gps(stream)
+
+    assert outer.report()["stages"]["extract_gps"]["calls"] == 2
+    assert inner.report()["stages"]["extract_gps"]["calls"] == 1
+    assert not profiling.is_active()
+
+
+def test_timed_iter(stream):
+    with profiling.Profile() as profile:
+        items = list(parse.iter_klv(stream))
+    assert len(items) == 30
+    assert profile.report()["stages"]["iter_klv"]["items_visited"] == 30
+
+
+def test_inactive():
+    assert not profiling.is_active()
+    with profiling.stage("unused") as stage:
+        stage.count(points=1)
@@ -0,0 +1,57 @@
+import io
+import struct
+
+import numpy
+import pytest
+
+from gpmf import mp4, sensors, synthetic
+
+
+def test_extract_sensor(stream):
+    accl = sensors.extract_sensor(stream, "ACCL")
+    assert accl.fourcc == "ACCL"
+    assert accl.description == "Accelerometer"
+    assert accl.values.shape == (30 * 200, 3)
+    # Scaled by SCAL
+    assert accl.values[:, 2].mean() == pytest.approx(9.81, abs=0.1)
+    numpy.testing.assert_allclose(accl.values * 418, numpy.round(accl.values * 418), atol=1e-6)
+
+    # Timestamped from STMP
+    numpy.testing.assert_allclose(accl.time, numpy.arange(30 * 200) / 200.)
+    numpy.testing.assert_array_equal(accl.block_id, numpy.repeat(numpy.arange(30), 200))
+
+
+def test_extract_sensor_with_track(payloads, stream):
+    track = mp4.find_gpmf_track(io.BytesIO(synthetic.make_mp4(payloads, sample_duration=1001)))
+    gyro = sensors.extract_sensor(stream, "GYRO", track=track)
+    expected = 1.001 * (numpy.repeat(numpy.arange(30), 200) + numpy.tile(numpy.arange(200) / 200., 30))
+    numpy.testing.assert_allclose(gyro.time, expected)
+
+
+def test_extract_sensors(stream):
+    found = sensors.extract_sensors(stream)
+    assert sorted(found) == ["ACCL", "GYRO"]
+    numpy.testing.assert_array_equal(found["GYRO"].values, sensors.extract_sensor(stream, "GYRO").values)
+
+
+def test_times_relative_to_first_stmp(payloads):
+    # The STMP of a stream starting 5 s after the device clock
+    accl = sensors.extract_sensor(b"".join(payloads[5:]), "ACCL")
+    numpy.testing.assert_allclose(accl.time, numpy.arange(25 * 200) / 200., atol=1e-9)
+    gyro = sensors.extract_sensors(b"".join(payloads[5:]))["GYRO"]
+    numpy.testing.assert_allclose(gyro.time, accl.time)
+
+
+
+def _set_stmp(payload, old, new):
+    header = b"STMPJ\x08\x00\x01"
+    assert header + struct.pack(">Q", old) in payload
+    return payload.replace(header + struct.pack(">Q", old), header + struct.pack(">Q", new))
+
+
+def test_last_block_rate_from_tsmp(payloads):
+    # The block before the last one is shortened by a late timestamp. The last
+    # block is timed at the average rate, from the total sample counts.
+    shortened = payloads[:8] + [_set_stmp(payloads[8], 8000000, 8500000), payloads[9]]
+    accl = sensors.extract_sensor(b"".join(shortened), "ACCL")
+    numpy.testing.assert_allclose(accl.time[-200:], 9 + numpy.arange(200) / 200.)
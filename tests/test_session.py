@@ -0,0 +1,80 @@
+import os
+
+import numpy
+import pytest
+
+from gpmf import gps, session, synthetic
+
+
+def _write(path, payloads):
+    with open(path, "wb") as f:
+        f.write(synthetic.make_mp4(payloads, sample_duration=1000))
+    return path
+
+
+@pytest.fixture
+def recording(tmp_path, payloads):
+    """ A recording split into three chapters, and the same recording in a single file """
+    directory = str(tmp_path)
+    chapters = [
+        _write(os.path.join(directory, "GX010042.MP4"), payloads[:10]),
+        _write(os.path.join(directory, "GX020042.MP4"), payloads[10:22]),
+        _write(os.path.join(directory, "GX030042.MP4"), payloads[22:]),
+    ]
+    single = _write(os.path.join(directory, "single.mp4"), payloads)
+    return chapters, single
+
+
+def test_find_sessions(recording, tmp_path):
+    chapters, single = recording
+    other = os.path.join(str(tmp_path), "GX010043.MP4")
+    sessions = session.find_sessions([chapters[2], other, single, chapters[0], chapters[1]])
+    assert sessions == [
+        session.Session("GX010042", chapters),
+        session.Session("GX010043", [other]),
+        session.Session("single", [single]),
+    ]
+    assert session.parse_chapter_name("GOPR0042.MP4")[1] == 0
+    assert session.parse_chapter_name("GP020042.MP4")[1] == 2
+
+
+def test_chapter_offsets(recording):
+    offsets, durations = session.chapter_offsets(recording[0])
+    numpy.testing.assert_allclose(offsets, [0., 10., 22.])
+    numpy.testing.assert_allclose(durations, [10., 12., 8.])
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_stitched_chapters_match_single_file(recording, jobs):
+    chapters, single = recording
+    stitched = session.extract_session_gps(chapters, jobs=jobs, cache=False)
+    expected = gps.extract_gps_from_file(single, cache=False)
+    assert (stitched == expected).all()
+
+
+def test_repeated_boundary_block(tmp_path, payloads, recording):
+    chapters = [
+        _write(os.path.join(str(tmp_path), "GH010007.MP4"), payloads[:10]),
+        _write(os.path.join(str(tmp_path), "GH020007.MP4"), payloads[9:]),
+    ]
+    stitched = session.extract_session_gps(chapters, cache=False)
+    assert (stitched == gps.extract_gps_from_file(recording[1], cache=False)).all()
+
+
+@pytest.mark.parametrize("start, end", [(5, 15), (12.5, None), ("2020-07-03T12:00:08", "2020-07-03T12:00:25")])
+def test_session_window(recording, start, end):
+    chapters, single = recording
+    window = session.extract_session_gps(chapters, start, end, cache=False)
+    expected = gps.extract_gps_window(single, start, end)
+    names = [name for name in gps.GPS_DTYPE.names if name != "block_id"]
+    assert len(window) == len(expected)
+    assert (window[names] == expected[names]).all()
+
+
+def test_session_sensors(recording):
+    chapters, single = recording
+    stitched = session.extract_session_sensors(chapters, fourccs=["ACCL"])["ACCL"]
+    expected = session.extract_session_sensors([single], fourccs=["ACCL"])["ACCL"]
+    numpy.testing.assert_array_equal(stitched.values, expected.values)
+    numpy.testing.assert_allclose(stitched.time, expected.time)
+    numpy.testing.assert_array_equal(stitched.block_id, expected.block_id)
@@ -0,0 +1,83 @@
+import numpy
+import pytest
+
+from gpmf import gps, simplify
+
+
+def _reference_douglas_peucker(x, y, tolerance):
+    # Recursive implementation of the algorithm
+    mask = numpy.zeros(len(x), dtype=bool)
+
+    def recurse(start, end):
+        mask[start] = mask[end] = True
+        if end - start < 2:
+            return
+        points = numpy.arange(start + 1, end)
+        distances = simplify._segment_distances(x, y, points, numpy.full(len(points), start),
+                                                numpy.full(len(points), end))
+        i = numpy.argmax(distances)
+        if distances[i] > tolerance:
+            recurse(start, points[i])
+            recurse(points[i], end)
+
+    recurse(0, len(x) - 1)
+    return mask
+
+
+def _max_deviation(x, y, mask):
+    # Largest distance between the points and the segment of the simplified line they belong to
+    kept = numpy.flatnonzero(mask)
+    points = numpy.arange(len(x))
+    segment = numpy.searchsorted(kept, points, side="right") - 1
+    segment = segment.clip(0, len(kept) - 2)
+    return simplify._segment_distances(x, y, points, kept[segment], kept[segment + 1]).max()
+
+
+@pytest.fixture
+def track(stream):
+    gps_data = gps.extract_gps(stream)
+    return gps_data, simplify.project_local(gps_data["latitude"], gps_data["longitude"])
+
+
+@pytest.mark.parametrize("tolerance", [0.1, 1., 5.])
+def test_douglas_peucker(track, tolerance):
+    _, (x, y) = track
+    mask = simplify.douglas_peucker(x, y, tolerance)
+    numpy.testing.assert_array_equal(mask, _reference_douglas_peucker(x, y, tolerance))
+    assert mask[0] and mask[-1]
+    assert _max_deviation(x, y, mask) <= tolerance
+
+
+@pytest.mark.parametrize("tolerance", [0.1, 1., 5.])
+def test_visvalingam(track, tolerance):
+    _, (x, y) = track
+    mask = simplify.visvalingam(x, y, tolerance)
+    assert mask[0] and mask[-1]
+    assert 2 <= mask.sum() < len(x)
+    assert simplify.visvalingam(x, y, tolerance * 2).sum() <= mask.sum()
+
+
+def test_straight_line():
+    x = numpy.arange(10.)
+    for method in simplify.METHODS.values():
+        numpy.testing.assert_array_equal(numpy.flatnonzero(method(x, 2 * x, 0.1)), [0, 9])
+
+
+def test_resample(track):
+    gps_data, _ = track
+    mask = simplify.resample(gps_data, 1.)
+    numpy.testing.assert_array_equal(numpy.flatnonzero(mask), numpy.arange(30) * 18)
+    assert simplify.resample(gps_data, 0.01).all()
+    assert simplify.resample(gps_data, 1e-12).all()
+    for interval in [0, -1.]:
+        with pytest.raises(ValueError):
+            simplify.resample(gps_data, interval)
+
+
+def test_decimate(track):
+    gps_data, _ = track
+    assert simplify.decimate(gps_data).all()
+    mask = simplify.decimate(gps_data, tolerance=1., interval=0.5)
+    assert not (mask & ~simplify.resample(gps_data, 0.5)).any()
+    with pytest.raises(ValueError):
+        simplify.decimate(gps_data, tolerance=1., method="unknown")
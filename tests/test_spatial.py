@@ -0,0 +1,65 @@
+import os
+
+import numpy
+import pytest
+
+from gpmf import gps, spatial
+
+
+def _to_utc(seconds):
+    return numpy.datetime64("2020-07-03T12:00:00") + numpy.timedelta64(int(seconds * 1e6), "us")
+
+
+@pytest.fixture
+def index(tmp_path, make_video):
+    with spatial.SpatialIndex(os.path.join(str(tmp_path), "index.db")) as index:
+        index.update([make_video()])
+        yield index
+
+
+def _segments(index):
+    return index.connection.execute("SELECT offset0, offset1 FROM segments ORDER BY offset0").fetchall()
+
+
+def test_update_is_incremental(index, make_video):
+    path = index.connection.execute("SELECT path FROM files").fetchone()[0]
+    assert index.update([path]) == {"indexed": 0, "unchanged": 1, "failed": 0}
+    assert index.update([path, make_video("other.mp4", seed=1)])["indexed"] == 1
+    assert index.prune() == 0
+
+
+def test_query_point_finds_track(index, make_video):
+    gps_data = gps.extract_gps_from_file(make_video())
+    point = gps_data[100]
+    matches = index.query_point(point["latitude"], point["longitude"], radius=20)
+    assert len(matches) == 1
+    assert matches[0].distance <= 20
+    assert index.query_point(46., 6., radius=1000) == []
+
+
+@pytest.mark.parametrize("query", ["point", "bbox"])
+def test_window_starting_inside_a_segment(index, query):
+    segments = _segments(index)
+    start = 0.5 * (segments[0][0] + segments[0][1])
+    end = segments[-1][1]
+
+    if query == "point":
+        # The start of the track, before the window
+        matches = index.query_point(45., 5., radius=1000, start=_to_utc(start))
+    else:
+        matches = index.query_bbox(44.9, 4.9, 45.1, 5.1, start=_to_utc(start))
+
+    assert len(matches) == 1
+    match = matches[0]
+    assert match.start == pytest.approx(start, abs=1e-3)
+    assert match.end == pytest.approx(end)
+    assert start - 1e-3 <= match.offset <= end
+    assert match.time >= _to_utc(start) - numpy.timedelta64(1, "ms")
+
+
+def test_window_ending_inside_a_segment(index):
+    segments = _segments(index)
+    end = 0.5 * (segments[-1][0] + segments[-1][1])
+    matches = index.query_bbox(44.9, 4.9, 45.1, 5.1, end=_to_utc(end))
+    assert len(matches) == 1
+    assert matches[0].end == pytest.approx(end, abs=1e-3)
@@ -0,0 +1,44 @@
+import numpy
+
+from gpmf import benchmark, parse, synthetic
+
+
+def test_make_klv_roundtrip():
+    values = numpy.array([[1, -2, 3], [4, 5, -6]], dtype="i2")
+    klv = synthetic.make_klv("ACCL", "s", values)
+    assert len(klv) % 4 == 0
+
+    item = next(parse.iter_klv(klv))
+    assert item.key == "ACCL"
+    assert item.length == ("s", 6, 2)
+    numpy.testing.assert_array_equal(item.value, values)
+
+    item = next(parse.iter_klv(synthetic.make_klv("DVNM", "c", b"camera")))
+    assert item.value == "camera"
+
+
+def test_make_payloads_is_deterministic():
+    assert synthetic.make_payloads(5) == synthetic.make_payloads(5)
+    assert synthetic.make_payloads(5, seed=1) != synthetic.make_payloads(5)
+    assert synthetic.make_stream(5) == b"".join(synthetic.make_payloads(5))
+
+
+def test_make_payloads_rates():
+    stream = synthetic.make_stream(4, gps_rate=10, accl_rate=50, gyro_rate=25)
+    index = parse.build_index(stream)
+    assert len(parse.find_items(index, "DEVC")) == 4
+    for fourcc, rate in [("GPS5", 10), ("ACCL", 50), ("GYRO", 25)]:
+        assert (index["repeat"][parse.find_items(index, fourcc)] == rate).all()
+
+
+def test_benchmark_run():
+    stages = ["mp4_extraction", "build_index", "extract_gps", "write_gpx"]
+    results = benchmark.run(durations=[3], stages=stages, repeat=1)
+    assert [r.stage for r in results] == stages
+    for r in results:
+        assert r.seconds > 0
+        assert r.bytes == len(synthetic.make_stream(3))
+    assert results[2].samples == 3 * 18
+
+    table = benchmark.format_results(results)
+    assert len(table.splitlines()) == len(stages) + 1
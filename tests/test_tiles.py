@@ -0,0 +1,118 @@
+import inspect
+import os
+import sqlite3
+import urllib.request
+
+import numpy
+import pytest
+
+from gpmf import tiles
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    def urlopen(*args, **kwargs):
+        raise AssertionError("the network is used")
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+
+
+def test_tile_cache_eviction(tmp_path):
+    cache = tiles.TileCache(str(tmp_path), max_size=250)
+    for i in range(3):
+        cache.store("osm", 1, i, 0, b"x" * 100)
+        os.utime(os.path.join(str(tmp_path), "osm", "1", str(i), "0"), (i, i))
+    cache.evict()
+    assert cache.load("osm", 1, 0, 0) is None
+    assert cache.load("osm", 1, 2, 0) == b"x" * 100
+
+
+@pytest.mark.parametrize("error", [FileNotFoundError, PermissionError])
+def test_tile_cache_load_when_touching_fails(tmp_path, monkeypatch, error):
+    # Evicted by another process after the read, or a read-only tile store
+    cache = tiles.TileCache(str(tmp_path))
+    cache.store("osm", 1, 0, 0, b"x" * 100)
+
+    def utime(path, *args, **kwargs):
+        raise error(path)
+    monkeypatch.setattr(os, "utime", utime)
+    assert cache.load("osm", 1, 0, 0) == b"x" * 100
+
+
+def test_offline_provider(tmp_path, no_network):
+    provider = tiles.CachedTileProvider("https://tiles.test/{z}/{x}/{y}.png", str(tmp_path), offline=True)
+    assert provider.get_tile(3, 1, 2) is None
+
+    provider.cache.store(provider.name, 3, 1, 2, b"tile")
+    assert provider.get_tile(3, 1, 2) == b"tile"
+
+
+def test_download(tmp_path, monkeypatch):
+    urls = []
+
+    class Response(object):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def read(self):
+            return b"downloaded"
+
+    def urlopen(request, timeout):
+        urls.append(request.full_url)
+        return Response()
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    provider = tiles.CachedTileProvider("https://tiles.test/{z}/{x}/{y}.png", str(tmp_path))
+    for _ in range(2):
+        assert provider.get_tile(3, 1, 2) == b"downloaded"
+    assert urls == ["https://tiles.test/3/1/2.png"]
+
+
+def test_local_providers(tmp_path):
+    os.makedirs(str(tmp_path / "tiles" / "3" / "1"))
+    (tmp_path / "tiles" / "3" / "1" / "2.png").write_bytes(b"png")
+    provider = tiles.open_tile_provider(str(tmp_path / "tiles"))
+    assert provider.get_tile(3, 1, 2) == b"png"
+    assert provider.get_tile(3, 1, 3) is None
+
+    path = str(tmp_path / "tiles.mbtiles")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE tiles (zoom_level, tile_column, tile_row, tile_data)")
+        connection.execute("INSERT INTO tiles VALUES (3, 1, 5, ?)", (b"mbtile",))
+    provider = tiles.open_tile_provider(path)
+    assert provider.get_tile(3, 1, 2) == b"mbtile"
+
+    with pytest.raises(ValueError):
+        tiles.open_tile_provider("https://tiles.test/{z}/{x}/{y}.png")
+
+
+def test_plot_offline_with_default_provider(tmp_path, no_network, monkeypatch):
+    pytest.importorskip("geopandas")
+    ctx = pytest.importorskip("contextily")
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from gpmf import gps_plot
+
+    offline = []
+    get_tile = tiles.CachedTileProvider.get_tile
+
+    def record_get_tile(self, z, x, y):
+        offline.append(self.offline)
+        return get_tile(self, z, x, y)
+
+    monkeypatch.setattr(tiles.CachedTileProvider, "get_tile", record_get_tile)
+    gps_plot.plot_gps_trace(numpy.array([[45., 5.], [45.01, 5.01]]), map_provider=ctx.providers.OpenStreetMap.Mapnik,
+                            tile_cache=str(tmp_path), offline=True)
+    plt.close()
+    assert offline and all(offline)
+
+
+def test_plot_from_stream_keeps_positional_parameters():
+    pytest.importorskip("contextily")
+    from gpmf import gps_plot
+
+    parameters = list(inspect.signature(gps_plot.plot_gps_trace_from_stream).parameters)
+    assert parameters[-3:] == ["tolerance", "interval", "offline"]